@@ -3,6 +3,17 @@ from django import forms
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm
 from .models import *
+from . import search
+
+
+class FullTextSearchMixin:
+    """Answer the changelist search box from the user full-text index"""
+    fts_user_field = 'id'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.filter_by_user(queryset, search_term, self.fts_user_field), False
 
 
 class AdminUserCreationForm(UserCreationForm):
@@ -16,7 +27,7 @@ class AdminUserCreationForm(UserCreationForm):
             raise forms.ValidationError('A user with that email already exists.')
         return email
 
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(FullTextSearchMixin, UserAdmin):
     add_form = AdminUserCreationForm
     list_display = ('username', 'name', 'email', 'role', 'is_active_user', 'is_staff')
     list_filter = ('role', 'is_active_user', 'is_staff', 'is_superuser')
@@ -32,7 +43,8 @@ class DepartmentAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
 
 @admin.register(PatientProfile)
-class PatientProfileAdmin(admin.ModelAdmin):
+class PatientProfileAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    fts_user_field = 'user_id'
     list_display = ('user', 'patient_id', 'age', 'gender', 'blood_group', 'registered_at')
     search_fields = ('user__name', 'patient_id', 'contact_number')
     list_filter = ('gender', 'blood_group', 'registered_at')
@@ -83,6 +95,13 @@ class NotificationAdmin(admin.ModelAdmin):
     list_filter = ('notification_type', 'is_read', 'created_at')
     search_fields = ('user__name', 'title', 'message')
 
+@admin.register(NotificationArchive)
+class NotificationArchiveAdmin(admin.ModelAdmin):
+    list_display = ('user', 'title', 'notification_type', 'created_at', 'archived_at')
+    list_filter = ('notification_type', 'archived_at')
+    search_fields = ('user__name', 'title')
+    raw_id_fields = ('user',)
+
 admin.site.register(User, CustomUserAdmin)
 admin.site.site_header = "Hospital Management System Admin"
 admin.site.site_title = "HMS Admin"
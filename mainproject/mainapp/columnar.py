@@ -0,0 +1,294 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db.models import DecimalField, Max, Value
+from django.db.models.functions import Coalesce, TruncDate
+from .models import Appointment, Department, MedicalHistory, TriageQueue
+from .rollups import STATUS_FIELDS
+
+try:
+    import numpy as np
+except ImportError:  # snapshots need numpy; reports fall back to live queries without it
+    np = None
+
+MANIFEST = 'manifest.json'
+BUILD_CHUNK_SIZE = 5000
+# Snapshot directories kept after a build; readers may still hold the previous one open
+KEEP_SNAPSHOTS = 2
+
+EPOCH = date(1970, 1, 1)
+EPOCH_WEEKDAY = EPOCH.weekday()
+STATUS_CODES = {status: code for code, status in enumerate(STATUS_FIELDS)}
+PRIORITY_CODES = {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2, 'URGENT': 3}
+DAYS, HOURS = 7, 24
+
+
+def _day(value):
+    return (value - EPOCH).days if value else -1
+
+
+def _minute(value):
+    return value.hour * 60 + value.minute
+
+
+def _number(value):
+    return float(value) if value is not None else float('nan')
+
+
+def _id(value):
+    return value if value is not None else -1
+
+
+def _code(codes):
+    return lambda value: codes.get(value, -1)
+
+
+# table -> (queryset factory, [(column, dtype, converter)]); rows are (id, *columns)
+TABLES = {
+    'appointments': (
+        lambda: Appointment.objects.order_by('id').annotate(
+            charged=Coalesce('fee', Value(0), output_field=DecimalField()),
+        ).values_list(
+            'id', 'appointment_date', 'appointment_time', 'doctor_id', 'patient_id',
+            'doctor__doctorprofile__department_id', 'status', 'charged',
+        ),
+        [
+            ('day', 'int32', _day),
+            ('minute', 'int16', _minute),
+            ('doctor', 'int32', _id),
+            ('patient', 'int32', _id),
+            ('department', 'int32', _id),
+            ('status', 'int8', _code(STATUS_CODES)),
+            ('fee', 'float64', _number),
+        ],
+    ),
+    'records': (
+        lambda: MedicalHistory.objects.order_by('id').annotate(day=TruncDate('date')).values_list(
+            'id', 'day', 'doctor_id', 'patient_id', 'doctor__doctorprofile__department_id',
+        ),
+        [
+            ('day', 'int32', _day),
+            ('doctor', 'int32', _id),
+            ('patient', 'int32', _id),
+            ('department', 'int32', _id),
+        ],
+    ),
+    'triage': (
+        lambda: TriageQueue.objects.order_by('id').annotate(day=TruncDate('checked_in_at')).values_list(
+            'id', 'day', 'appointment__doctor_id', 'appointment__doctor__doctorprofile__department_id',
+            'priority_level', 'temperature', 'pulse_rate', 'weight',
+        ),
+        [
+            ('day', 'int32', _day),
+            ('doctor', 'int32', _id),
+            ('department', 'int32', _id),
+            ('priority', 'int8', _code(PRIORITY_CODES)),
+            ('temperature', 'float32', _number),
+            ('pulse_rate', 'float32', _number),
+            ('weight', 'float32', _number),
+        ],
+    ),
+}
+
+
+def snapshot_root():
+    return Path(getattr(settings, 'ANALYTICS_SNAPSHOT_DIR', settings.BASE_DIR / 'analytics'))
+
+
+def _last_ids():
+    return {
+        name: factory().model.objects.aggregate(last=Max('id'))['last'] or 0
+        for name, (factory, _) in TABLES.items()
+    }
+
+
+def _write_table(directory, name, chunk_size, last_id):
+    """Copy rows up to ``last_id`` into memory-mapped columns, one short keyset query per chunk.
+
+    No statement stays open between chunks, so bookings are never held up
+    behind the export. Rows changed mid-build may show either state, which
+    is fine for reporting.
+    """
+    queryset_factory, columns = TABLES[name]
+    queryset = queryset_factory().filter(id__lte=last_id)
+    count = queryset.count()
+    arrays = {
+        column: np.lib.format.open_memmap(directory / f'{name}.{column}.npy', mode='w+', dtype=dtype, shape=(count,))
+        for column, dtype, _ in columns
+    }
+    filled, after = 0, 0
+    while filled < count:
+        # Rows deleted since the count leave the tail unused; the manifest records what was filled
+        chunk = list(queryset.filter(id__gt=after)[:min(chunk_size, count - filled)])
+        if not chunk:
+            break
+        for i, (column, _, convert) in enumerate(columns, 1):
+            arrays[column][filled:filled + len(chunk)] = [convert(row[i]) for row in chunk]
+        filled, after = filled + len(chunk), chunk[-1][0]
+    for array in arrays.values():
+        array.flush()
+    return filled
+
+
+def build(chunk_size=BUILD_CHUNK_SIZE, log=None):
+    """Dump the analytics columns into a new snapshot directory and make it current.
+
+    Each column is a typed ``.npy`` array written through a memory map, so
+    building needs only one chunk of rows in memory at a time. The build
+    covers the rows that existed when it started and reads them outside any
+    transaction, in short chunks. Readers switch over when the manifest is
+    replaced.
+    """
+    if np is None:
+        raise RuntimeError('numpy is required to build analytics snapshots')
+    root = snapshot_root()
+    root.mkdir(parents=True, exist_ok=True)
+    # The random suffix keeps builds started within the same second apart
+    directory = Path(tempfile.mkdtemp(prefix=f'snapshot-{time.strftime("%Y%m%d-%H%M%S")}-', dir=root))
+
+    counts = {}
+    for name, last_id in _last_ids().items():
+        counts[name] = _write_table(directory, name, chunk_size, last_id)
+        if log:
+            log(f'{name}: {counts[name]} rows')
+
+    manifest = {'directory': directory.name, 'built_at': time.time(), 'rows': counts}
+    tmp = root / f'{MANIFEST}.{directory.name}.tmp'
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, root / MANIFEST)
+
+    old = sorted((p for p in root.glob('snapshot-*') if p.is_dir() and p.name != directory.name),
+                 key=lambda p: p.stat().st_mtime)
+    for stale in old[:max(0, len(old) - (KEEP_SNAPSHOTS - 1))]:
+        shutil.rmtree(stale, ignore_errors=True)
+    return manifest
+
+
+def manifest():
+    try:
+        return json.loads((snapshot_root() / MANIFEST).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def available():
+    return np is not None and manifest() is not None
+
+
+# Arrays mapped from the current snapshot: {'snapshot': (root, directory, built_at), 'tables': {name: columns}}
+_open = {'snapshot': None, 'tables': {}}
+
+
+def load(name):
+    """Columns of one snapshot table as read-only memory-mapped arrays.
+
+    Maps stay open while the manifest names the same snapshot and are all
+    dropped once a newer build replaces it.
+    """
+    current = manifest()
+    if current is None:
+        raise FileNotFoundError('No analytics snapshot has been built')
+    snapshot = (str(snapshot_root()), current['directory'], current['built_at'])
+    if _open['snapshot'] != snapshot:
+        _open['snapshot'], _open['tables'] = snapshot, {}
+    tables = _open['tables']
+    if name not in tables:
+        directory = snapshot_root() / current['directory']
+        rows = current['rows'][name]
+        tables[name] = {
+            column: np.load(directory / f'{name}.{column}.npy', mmap_mode='r')[:rows]
+            for column, _, _ in TABLES[name][1]
+        }
+    return tables[name]
+
+
+def _mask(table, start, end, doctor_id=None, department_id=None):
+    mask = (table['day'] >= _day(start)) & (table['day'] <= _day(end))
+    if doctor_id:
+        mask &= table['doctor'] == doctor_id
+    if department_id:
+        mask &= table['department'] == department_id
+    return mask
+
+
+def report(start, end, doctor_id=None, department_id=None):
+    """Same figures as reports.build_report, computed over the snapshot arrays"""
+    appts = load('appointments')
+    mask = _mask(appts, start, end, doctor_id, department_id) & (appts['status'] >= 0)
+    status = appts['status'][mask]
+    day, minute = appts['day'][mask], appts['minute'][mask]
+    booked = status != STATUS_CODES['CANCELLED']
+
+    weekday = (day[booked] + EPOCH_WEEKDAY) % 7
+    cells = np.bincount(weekday * HOURS + minute[booked] // 60, minlength=DAYS * HOURS)
+    matrix = cells.reshape(DAYS, HOURS)
+
+    # Department x status counts and completed revenue in one bincount each
+    dept_ids, dept_index = np.unique(appts['department'][mask], return_inverse=True)
+    statuses = len(STATUS_CODES)
+    counts = np.bincount(dept_index * statuses + status, minlength=len(dept_ids) * statuses).reshape(-1, statuses)
+    completed = status == STATUS_CODES['COMPLETED']
+    revenue = np.bincount(dept_index, weights=np.where(completed, appts['fee'][mask], 0), minlength=len(dept_ids))
+
+    names = dict(Department.objects.filter(id__in=[int(d) for d in dept_ids if d >= 0]).values_list('id', 'name'))
+    fields = list(STATUS_FIELDS.values())
+    departments = sorted(({
+        'id': int(dept) if dept >= 0 else None,
+        'name': names.get(int(dept), 'Unassigned'),
+        'appointments': int(row.sum()),
+        'revenue': round(float(rev), 2),
+        **{field: int(n) for field, n in zip(fields, row)},
+    } for dept, row, rev in zip(dept_ids, counts, revenue)), key=lambda d: d['name'])
+
+    totals = counts.sum(axis=0) if len(dept_ids) else np.zeros(statuses, dtype=np.int64)
+    return {
+        'start': start,
+        'end': end,
+        'density': {
+            'matrix': matrix.tolist(),
+            'by_weekday': matrix.sum(axis=1).tolist(),
+            'by_hour': matrix.sum(axis=0).tolist(),
+            'max': int(matrix.max()),
+        },
+        'departments': departments,
+        'totals': {'appointments': int(totals.sum()), **{field: int(n) for field, n in zip(fields, totals)}},
+        'revenue': round(float(revenue.sum()), 2),
+        'monthly': monthly(start, end, doctor_id, department_id),
+        'snapshot_built_at': manifest()['built_at'],
+    }
+
+
+def monthly(start, end, doctor_id=None, department_id=None):
+    """Appointments, medical records, triage entries and mean temperature per month"""
+    months = []
+    first = date(start.year, start.month, 1)
+    while first <= end:
+        following = (first + timedelta(days=32)).replace(day=1)
+        months.append((first, following))
+        first = following
+    edges = np.array([_day(m) for m, _ in months] + [_day(months[-1][1])])
+
+    def per_month(table, values=None):
+        mask = _mask(table, start, end, doctor_id, department_id)
+        index = np.searchsorted(edges, table['day'][mask], side='right') - 1
+        weights = None if values is None else np.nan_to_num(values[mask])
+        return np.bincount(index, weights=weights, minlength=len(months))[:len(months)]
+
+    appts, records, triage = load('appointments'), load('records'), load('triage')
+    temperature_sum = per_month(triage, triage['temperature'])
+    temperature_n = per_month(triage, ~np.isnan(triage['temperature']))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_temperature = np.where(temperature_n > 0, temperature_sum / temperature_n, np.nan)
+
+    return [{
+        'month': m.strftime('%Y-%m'),
+        'appointments': int(a),
+        'records': int(r),
+        'triage': int(t),
+        'mean_temperature': None if np.isnan(temp) else round(float(temp), 1),
+    } for (m, _), a, r, t, temp in zip(months, per_month(appts), per_month(records), per_month(triage), mean_temperature)]
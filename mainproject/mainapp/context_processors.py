@@ -1,8 +1,17 @@
-from .models import Notification
+from functools import partial
+from .events import streaming_supported
+from .notifications import unread_count
 
 def notifications_context(request):
-    """Add unread notifications count to all templates"""
+    """Add unread notifications count to all templates.
+
+    The count is a callable, which templates resolve on first use, so pages
+    that never show it do not look it up. ``live_events`` says whether pages
+    may open the event stream (only when served over ASGI).
+    """
     if request.user.is_authenticated:
-        unread_count = Notification.objects.filter(user=request.user, is_read=False).count()
-        return {'unread_notifications_count': unread_count}
-    return {'unread_notifications_count': 0}
\ No newline at end of file
+        return {
+            'unread_notifications_count': partial(unread_count, request.user.id),
+            'live_events': streaming_supported(request),
+        }
+    return {'unread_notifications_count': 0, 'live_events': False}
@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import defaultdict
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+TRIAGE_CHANNEL = 'triage'
+APPOINTMENTS_CHANNEL = 'appointments'
+HEARTBEAT_SECONDS = 15
+# Streams end after this long and EventSource reconnects, so no connection lives forever
+MAX_STREAM_SECONDS = 10 * 60
+RECONNECT_MS = 3000
+# Events a slow client may fall behind by before it is told to reload instead
+QUEUE_SIZE = 100
+
+
+def streaming_supported(request):
+    """Whether the request is served over ASGI, where an open stream is a parked coroutine.
+
+    Under WSGI (``manage.py runserver``) Django buffers an async stream
+    until it ends and the connection holds a worker thread meanwhile, so
+    pages poll instead of opening one.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def channels_for(user):
+    """Channels a user's stream listens on: their own, plus the shared queues their role watches"""
+    channels = [user_channel(user.id)]
+    if user.role in ('STAFF', 'DOCTOR', 'ADMIN'):
+        channels.append(TRIAGE_CHANNEL)
+    if user.role in ('STAFF', 'ADMIN'):
+        channels.append(APPOINTMENTS_CHANNEL)
+    return channels
+
+
+class Subscription:
+    def __init__(self, channels, loop):
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        # Runs on the subscriber's own event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Hub:
+    """In-process pub/sub between the sync code that changes data and the async event streams.
+
+    ``publish`` can be called from any thread; each subscription is an
+    asyncio queue fed on its own loop. Events pass through ``relay``, which
+    delivers locally. Running several worker processes means pointing
+    ``relay`` at a shared broker whose consumers call ``deliver`` in each worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._ids = itertools.count(1)
+        self.relay = self.deliver
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, asyncio.get_running_loop())
+        with self._lock:
+            for channel in channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscriptions.values() for s in subscribers})
+
+    def publish(self, channels, kind, data):
+        self.relay(channels, (next(self._ids), kind, data))
+
+    def deliver(self, channels, event):
+        with self._lock:
+            targets = {s for channel in channels for s in self._subscriptions.get(channel, ())}
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:  # the stream's loop has closed
+                self.unsubscribe(subscription)
+
+
+hub = Hub()
+
+
+def publish(channels, kind, data):
+    """Publish once the current transaction commits, so clients never see rolled-back changes"""
+    transaction.on_commit(lambda: hub.publish(channels, kind, data))
+
+
+def format_event(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def stream(channels, heartbeat=HEARTBEAT_SECONDS, max_seconds=MAX_STREAM_SECONDS):
+    """Server-sent events for ``channels`` until ``max_seconds`` pass or the client goes away.
+
+    An idle stream is one parked coroutine and a queue, with a comment line
+    every ``heartbeat`` seconds to keep proxies from closing it.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_seconds
+    subscription = hub.subscribe(channels)
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield format_event(*event)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield 'event: overflow\ndata: {}\n\n'
+    finally:
+        hub.unsubscribe(subscription)
+
+
+# Event payloads
+
+def notification_event(notification):
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message,
+        'type': notification.notification_type,
+        'created_at': notification.created_at,
+    }
+
+
+def appointment_event(appointment_id, doctor_id, patient_id, status):
+    """``(channels, kind, data)`` for a status change, ready for ``publish``"""
+    return (
+        [user_channel(doctor_id), user_channel(patient_id), APPOINTMENTS_CHANNEL],
+        'appointment',
+        {'id': appointment_id, 'doctor': doctor_id, 'patient': patient_id, 'status': status},
+    )
+
+
+def triage_event(entry, deleted=False):
+    return {
+        'id': entry.id,
+        'patient': entry.patient_id,
+        'appointment': entry.appointment_id,
+        'priority': entry.priority_level,
+        'processed': entry.is_processed,
+        'deleted': deleted,
+    }
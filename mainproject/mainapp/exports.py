@@ -0,0 +1,145 @@
+import csv
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Appointment, MedicalHistory, Prescription
+
+EXPORT_CHUNK_SIZE = 2000
+# Encoded output is handed to the response in pieces of roughly this size
+FLUSH_BYTES = 64 * 1024
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class Export:
+    """A flat projection of one model: ``columns`` are ``(header, field lookup)`` pairs.
+
+    ``day_lookup`` and ``doctor_lookup`` are used for the date range and doctor filters.
+    """
+
+    def __init__(self, model, day_lookup, doctor_lookup, columns):
+        self.model = model
+        self.day_lookup = day_lookup
+        self.doctor_lookup = doctor_lookup
+        self.columns = columns
+
+    @property
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    def queryset(self, start=None, end=None, doctor_id=None):
+        queryset = self.model.objects.all()
+        if start:
+            queryset = queryset.filter(**{f'{self.day_lookup}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{self.day_lookup}__lte': end})
+        if doctor_id:
+            queryset = queryset.filter(**{self.doctor_lookup: doctor_id})
+        return queryset.order_by('id').values_list(*[field for _, field in self.columns])
+
+
+EXPORTS = {
+    'appointments': Export(Appointment, 'appointment_date', 'doctor_id', [
+        ('id', 'id'),
+        ('date', 'appointment_date'),
+        ('time', 'appointment_time'),
+        ('status', 'status'),
+        ('patient_id', 'patient_id'),
+        ('patient', 'patient__name'),
+        ('doctor_id', 'doctor_id'),
+        ('doctor', 'doctor__name'),
+        ('department', 'doctor__doctorprofile__department__name'),
+        ('reason', 'reason'),
+        ('series_id', 'series_id'),
+        ('created_at', 'created_at'),
+    ]),
+    'medical-records': Export(MedicalHistory, 'date__date', 'doctor_id', [
+        ('id', 'id'),
+        ('date', 'date'),
+        ('patient_id', 'patient_id'),
+        ('patient', 'patient__name'),
+        ('doctor_id', 'doctor_id'),
+        ('doctor', 'doctor__name'),
+        ('appointment_id', 'appointment_id'),
+        ('diagnosis', 'diagnosis'),
+        ('treatment', 'treatment'),
+        ('symptoms', 'symptoms'),
+        ('follow_up_date', 'follow_up_date'),
+    ]),
+    'prescriptions': Export(Prescription, 'created_at__date', 'medical_history__doctor_id', [
+        ('id', 'id'),
+        ('created_at', 'created_at'),
+        ('medical_record_id', 'medical_history_id'),
+        ('patient_id', 'medical_history__patient_id'),
+        ('doctor_id', 'medical_history__doctor_id'),
+        ('medication', 'medication_name'),
+        ('dosage', 'dosage'),
+        ('frequency', 'frequency'),
+        ('duration', 'duration'),
+        ('instructions', 'instructions'),
+    ]),
+}
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+def _csv_lines(export, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(export.headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(export, rows):
+    headers = export.headers
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def _batched(lines):
+    # Join small lines into larger chunks so each write to the socket is worthwhile
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(kind, fmt='csv', compress=False, start=None, end=None, doctor_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the encoded export as byte chunks.
+
+    Rows are read with ``iterator(chunk_size)`` over a ``values_list``
+    projection and encoded as they arrive, so memory stays flat however
+    many rows are exported.
+    """
+    export = EXPORTS[kind]
+    rows = export.queryset(start, end, doctor_id).iterator(chunk_size=chunk_size)
+    lines = _csv_lines(export, rows) if fmt == 'csv' else _ndjson_lines(export, rows)
+    chunks = _batched(lines)
+    return _gzipped(chunks) if compress else chunks
+
+
+def filename(kind, fmt, compress=False):
+    name = f'{kind}.{FORMATS[fmt][1]}'
+    return f'{name}.gz' if compress else name
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainapp import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Move read notifications older than NOTIFICATION_RETENTION_DAYS (or --days) "
+        "into the archive table, a chunk at a time. Run it nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive read notifications older than this many days')
+        parser.add_argument('--chunk-size', type=int, default=notifications.ARCHIVE_CHUNK_SIZE, help='Notifications per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days cannot be negative')
+        moved = notifications.archive_read(options['days'], options['chunk_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} notifications.'))
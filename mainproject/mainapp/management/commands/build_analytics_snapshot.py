@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainapp import columnar
+
+
+class Command(BaseCommand):
+    help = (
+        "Dump appointment, medical record and triage columns into memory-mapped "
+        "NumPy arrays for long-range reports. Meant to run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=columnar.BUILD_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if columnar.np is None:
+            raise CommandError('numpy is required to build analytics snapshots')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        manifest = columnar.build(options['chunk_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot {manifest['directory']} written to {columnar.snapshot_root()}."
+        ))
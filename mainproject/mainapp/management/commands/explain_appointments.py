@@ -0,0 +1,189 @@
+import os
+import random
+import tempfile
+import time as clock
+from contextlib import contextmanager
+from datetime import date, time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.utils import load_backend
+from mainapp.models import Appointment, Department, DoctorProfile, User
+
+
+class Command(BaseCommand):
+    # Half-hour slots from 09:00 to 16:30
+    SLOTS = [time(hour, minute) for hour in range(9, 17) for minute in (0, 30)]
+    # Connection alias of the temporary database the dataset is seeded into
+    SCRATCH = 'explain_scratch'
+    # Queries allowed to SCAN these indexes: unfiltered pages read them in order and stop at the page size
+    ORDERED_SCANS = {('appointment_list', 'staff page'): ('appt_date_time_idx',)}
+
+    help = (
+        "Seed a large dataset into a temporary copy of the database schema, run "
+        "EXPLAIN QUERY PLAN on the Appointment queries behind each dashboard and "
+        "fail if any of them scans the whole table. The live database is only read "
+        "for its schema, so bookings are never held up behind the seeding."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=200000)
+        parser.add_argument('--doctors', type=int, default=200)
+        parser.add_argument('--patients', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=730, help='Spread appointments over this many past/future days')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark reads SQLite query plans; run it against the SQLite database.')
+
+        failures = []
+        with self.scratch_database() as using:
+            started = clock.monotonic()
+            with transaction.atomic(using=using):
+                doctor, patient = self.seed(options, using)
+            connections[using].cursor().execute('ANALYZE')
+            self.stdout.write(f"Seeded {options['appointments']} appointments in {clock.monotonic() - started:.1f}s\n")
+
+            for view_name, label, queryset in self.hot_queries(doctor, patient):
+                queryset = queryset.using(using)
+                plan = queryset.explain()
+                scan_indexes = self.ORDERED_SCANS.get((view_name, label), ())
+                scans = [line for line in plan.splitlines() if self.is_table_scan(line, scan_indexes)]
+                started = clock.monotonic()
+                list(queryset[:50])
+                elapsed = (clock.monotonic() - started) * 1000
+                status = self.style.ERROR('SCAN') if scans else self.style.SUCCESS('OK  ')
+                self.stdout.write(f"{status} {view_name:<20} {label:<40} {elapsed:7.1f} ms")
+                for line in plan.splitlines():
+                    self.stdout.write(f"       {line}")
+                if scans:
+                    failures.append(f"{view_name}: {label}")
+
+        if failures:
+            raise CommandError('Full table scans found in: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('All hot Appointment queries use an index.'))
+
+    @contextmanager
+    def scratch_database(self):
+        """A temporary SQLite file with the live schema, registered as ``SCRATCH``"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'view' THEN 1 ELSE 2 END, rowid"
+            )
+            schema = cursor.fetchall()
+        # Creating a virtual table creates its shadow tables too
+        virtual = [name for _, name, sql in schema if sql.upper().startswith('CREATE VIRTUAL TABLE')]
+        statements = [sql for kind, name, sql in schema
+                      if not (kind == 'table' and any(name.startswith(f'{v}_') for v in virtual))]
+
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        # Registered for this thread only, so querysets can reach it with using()
+        scratch = load_backend(connection.settings_dict['ENGINE']).DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': path}, alias=self.SCRATCH,
+        )
+        connections[self.SCRATCH] = scratch
+        try:
+            with scratch.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+            yield self.SCRATCH
+        finally:
+            scratch.close()
+            del connections[self.SCRATCH]
+            os.remove(path)
+
+    def is_table_scan(self, line, scan_indexes=()):
+        # "SCAN mainapp_appointment" reads every row, and so does a SCAN through
+        # an index unless that index is one the query may walk in order and stop early
+        detail = line.split('SCAN ', 1)
+        if len(detail) < 2:
+            return False
+        words = detail[1].split()
+        if not words[0].startswith('mainapp_appointment'):
+            return False
+        if 'INDEX' not in words:
+            return True
+        position = words.index('INDEX') + 1
+        return position == len(words) or words[position] not in scan_indexes
+
+    def seed(self, options, using):
+        department = Department.objects.using(using).create(name=f'Benchmark {random.randint(0, 10 ** 9)}')
+        tag = department.id
+
+        doctors = User.objects.using(using).bulk_create([
+            User(username=f'bench{tag}_doc{i}', email=f'bench{tag}_doc{i}@bench.local',
+                 name=f'Doctor {i}', role='DOCTOR', password='!')
+            for i in range(options['doctors'])
+        ], batch_size=1000)
+        DoctorProfile.objects.using(using).bulk_create([
+            DoctorProfile(user=d, department=department, specialty='General', qualification='MBBS')
+            for d in doctors
+        ], batch_size=1000)
+        patients = User.objects.using(using).bulk_create([
+            User(username=f'bench{tag}_pat{i}', email=f'bench{tag}_pat{i}@bench.local',
+                 name=f'Patient {i}', role='PATIENT', password='!')
+            for i in range(options['patients'])
+        ], batch_size=1000)
+
+        # Every (doctor, day, slot) is drawn at most once, so unique_active_doctor_slot holds
+        days, slots = options['days'], len(self.SLOTS)
+        grid = len(doctors) * days * slots
+        if options['appointments'] > grid:
+            raise CommandError(
+                f"{options['appointments']} appointments do not fit in {grid} doctor slots; "
+                f"raise --doctors or --days."
+            )
+        statuses = [s for s, _ in Appointment.STATUS_CHOICES]
+        first_day = date.today() - timedelta(days=days // 2)
+        batch = []
+        for cell in random.sample(range(grid), options['appointments']):
+            doctor_index, cell = divmod(cell, days * slots)
+            day, slot = divmod(cell, slots)
+            batch.append(Appointment(
+                doctor=doctors[doctor_index],
+                patient=random.choice(patients),
+                appointment_date=first_day + timedelta(days=day),
+                appointment_time=self.SLOTS[slot],
+                status=random.choice(statuses),
+                reason='Benchmark',
+            ))
+            if len(batch) == 5000:
+                Appointment.objects.using(using).bulk_create(batch)
+                batch = []
+        Appointment.objects.using(using).bulk_create(batch)
+        return doctors[0], patients[0]
+
+    def hot_queries(self, doctor, patient):
+        today = date.today()
+        listing = ('-appointment_date', '-appointment_time', '-id')
+        return [
+            ('doctor_dashboard', "today's appointments",
+             Appointment.objects.filter(doctor=doctor, appointment_date=today)),
+            ('doctor_dashboard', 'pending requests',
+             Appointment.objects.filter(doctor=doctor, status='PENDING')),
+            ('doctor_dashboard', 'distinct patients',
+             User.objects.filter(role='PATIENT', patient_appointments__doctor=doctor).distinct()),
+            ('staff_dashboard', "today's queue",
+             Appointment.objects.filter(appointment_date=today).order_by('appointment_time')),
+            ('staff_dashboard', 'pending requests',
+             Appointment.objects.filter(status='PENDING')),
+            ('patient_dashboard', 'appointment history',
+             Appointment.objects.filter(patient=patient).order_by('-appointment_date')),
+            ('patient_dashboard', 'next appointment',
+             Appointment.objects.filter(patient=patient, appointment_date__gte=today).order_by('appointment_date')),
+            ('triage_form', "patient's appointment today",
+             Appointment.objects.filter(patient=patient, appointment_date=today)),
+            ('reports_view', 'weekday density',
+             Appointment.objects.filter(doctor=doctor, appointment_date__week_day=2)),
+            ('reports_view', 'completed appointments',
+             Appointment.objects.filter(status='COMPLETED')),
+            ('appointment_list', 'doctor page',
+             Appointment.objects.filter(doctor=doctor).order_by(*listing)),
+            ('appointment_list', 'patient page',
+             Appointment.objects.filter(patient=patient).order_by(*listing)),
+            ('appointment_list', 'staff page',
+             Appointment.objects.order_by(*listing)),
+            ('book_appointment', 'slot availability',
+             Appointment.objects.filter(doctor=doctor, appointment_date=today).exclude(status='CANCELLED')),
+        ]
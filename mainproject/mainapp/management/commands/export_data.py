@@ -0,0 +1,34 @@
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from mainapp import exports
+
+
+class Command(BaseCommand):
+    help = "Stream appointments, medical records or prescriptions to a CSV or NDJSON file (or stdout)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+        parser.add_argument('--output', '-o', help='File to write; defaults to stdout')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--doctor', type=int, help='Only rows for this doctor id')
+        parser.add_argument('--chunk-size', type=int, default=exports.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        chunks = exports.stream(
+            options['kind'], options['format'], options['gzip'],
+            options['start'], options['end'], options['doctor'], options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as out:
+                written = sum(out.write(chunk) for chunk in chunks)
+            self.stderr.write(f'Wrote {written} bytes to {options["output"]}')
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
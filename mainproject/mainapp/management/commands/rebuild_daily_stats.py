@@ -0,0 +1,42 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.db.models.functions import TruncDate
+from mainapp.models import Appointment, PatientProfile, TriageQueue
+from mainapp import rollups, snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the DailyStats rollup from appointments, patient registrations and "
+        "triage, a chunk of days at a time. Defaults to the full history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--chunk-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start is None or end is None:
+            bounds = [
+                Appointment.objects.aggregate(lo=Min('appointment_date'), hi=Max('appointment_date')),
+                PatientProfile.objects.aggregate(lo=Min(TruncDate('registered_at')), hi=Max(TruncDate('registered_at'))),
+                TriageQueue.objects.aggregate(lo=Min(TruncDate('checked_in_at')), hi=Max(TruncDate('checked_in_at'))),
+            ]
+            lows = [b['lo'] for b in bounds if b['lo']]
+            highs = [b['hi'] for b in bounds if b['hi']]
+            if not lows:
+                self.stdout.write('Nothing to roll up.')
+                return
+            start = start or min(lows)
+            end = end or max(highs)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be positive')
+
+        rollups.rebuild(start, end, options['chunk_days'], log=lambda msg: self.stdout.write(f'Rebuilt {msg}'))
+        snapshots.invalidate_admin_snapshot()
+        self.stdout.write(self.style.SUCCESS(f'DailyStats rebuilt for {start} .. {end}.'))
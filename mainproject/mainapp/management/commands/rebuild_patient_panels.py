@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainapp import panels
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the DoctorPatientPanel table from appointments and medical records, "
+        "a chunk of doctors at a time. With --stale, only refresh panels whose next "
+        "appointment has passed (run daily)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50, help='Doctors per transaction')
+        parser.add_argument('--stale', action='store_true', help='Only refresh panels whose next appointment has passed')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        if options['stale']:
+            count = panels.refresh_stale()
+            self.stdout.write(self.style.SUCCESS(f'{count} doctor-patient panel(s) refreshed.'))
+            return
+        panels.rebuild(options['chunk_size'], log=lambda msg: self.stdout.write(f'Rebuilt {msg}'))
+        self.stdout.write(self.style.SUCCESS('Doctor-patient panels rebuilt.'))
@@ -0,0 +1,58 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from mainapp.models import Appointment
+from mainapp.transitions import TRANSITIONS, bulk_transition, sources_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Move appointments to a new status in one UPDATE. Select rows with --ids, "
+        "--doctor/--date/--from-status, or use --expire-pending DAYS to cancel "
+        "PENDING appointments that are more than DAYS days in the past."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', dest='target', choices=sorted(TRANSITIONS), help='Target status')
+        parser.add_argument('--ids', help='Comma separated appointment ids')
+        parser.add_argument('--doctor', type=int, help='Doctor user id')
+        parser.add_argument('--date', type=date.fromisoformat, help='Appointment date (YYYY-MM-DD)')
+        parser.add_argument('--from-status', choices=sorted(TRANSITIONS))
+        parser.add_argument('--expire-pending', type=int, metavar='DAYS')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without updating')
+
+    def handle(self, *args, **options):
+        appointments = Appointment.objects.all()
+        target = options['target']
+
+        if options['expire_pending'] is not None:
+            cutoff = date.today() - timedelta(days=options['expire_pending'])
+            appointments = appointments.filter(status='PENDING', appointment_date__lt=cutoff)
+            target = target or 'CANCELLED'
+        elif not any(options[k] for k in ('ids', 'doctor', 'date', 'from_status')):
+            raise CommandError('Refusing to update every appointment; pass a filter or --expire-pending.')
+
+        if not target:
+            raise CommandError('--to is required')
+        if options['ids']:
+            try:
+                appointments = appointments.filter(id__in=[int(i) for i in options['ids'].split(',')])
+            except ValueError:
+                raise CommandError('--ids must be comma separated integers')
+        if options['doctor']:
+            appointments = appointments.filter(doctor_id=options['doctor'])
+        if options['date']:
+            appointments = appointments.filter(appointment_date=options['date'])
+        if options['from_status']:
+            appointments = appointments.filter(status=options['from_status'])
+
+        if options['dry_run']:
+            count = appointments.filter(status__in=sources_for(target)).count()
+            self.stdout.write(f'{count} appointment(s) would move to {target}.')
+            return
+
+        result = bulk_transition(appointments, target)
+        self.stdout.write(self.style.SUCCESS(f"{len(result['updated'])} appointment(s) moved to {target}."))
+        if result['updated']:
+            self.stdout.write('Updated ids: ' + ', '.join(str(i) for i in result['updated']))
+        for row in result['skipped']:
+            self.stdout.write(self.style.WARNING(f"Skipped #{row['id']}: {row['error']}"))
@@ -0,0 +1,83 @@
+from django.db import migrations
+
+# SQLite FTS5 index over the columns people search patients by. rowid is the
+# user id; patient columns stay empty for users without a PatientProfile.
+# Triggers keep it in sync with every write path, including bulk updates.
+FTS_SETUP = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS mainapp_user_fts USING fts5(
+        username, name, email, patient_id, contact_number,
+        tokenize = 'unicode61', prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO mainapp_user_fts (rowid, username, name, email, patient_id, contact_number)
+    SELECT u.id, u.username, u.name, u.email, COALESCE(p.patient_id, ''), COALESCE(p.contact_number, '')
+    FROM mainapp_user u LEFT JOIN mainapp_patientprofile p ON p.user_id = u.id
+    """,
+    """
+    CREATE TRIGGER mainapp_user_fts_ai AFTER INSERT ON mainapp_user BEGIN
+        INSERT INTO mainapp_user_fts (rowid, username, name, email, patient_id, contact_number)
+        VALUES (new.id, new.username, new.name, new.email, '', '');
+    END
+    """,
+    """
+    CREATE TRIGGER mainapp_user_fts_au AFTER UPDATE OF username, name, email ON mainapp_user BEGIN
+        UPDATE mainapp_user_fts SET username = new.username, name = new.name, email = new.email WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER mainapp_user_fts_ad AFTER DELETE ON mainapp_user BEGIN
+        DELETE FROM mainapp_user_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER mainapp_patientprofile_fts_ai AFTER INSERT ON mainapp_patientprofile BEGIN
+        UPDATE mainapp_user_fts SET patient_id = new.patient_id, contact_number = new.contact_number
+        WHERE rowid = new.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER mainapp_patientprofile_fts_au AFTER UPDATE ON mainapp_patientprofile BEGIN
+        UPDATE mainapp_user_fts SET patient_id = '', contact_number = '' WHERE rowid = old.user_id;
+        UPDATE mainapp_user_fts SET patient_id = new.patient_id, contact_number = new.contact_number
+        WHERE rowid = new.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER mainapp_patientprofile_fts_ad AFTER DELETE ON mainapp_patientprofile BEGIN
+        UPDATE mainapp_user_fts SET patient_id = '', contact_number = '' WHERE rowid = old.user_id;
+    END
+    """,
+]
+
+FTS_TEARDOWN = [
+    'DROP TRIGGER IF EXISTS mainapp_patientprofile_fts_ad',
+    'DROP TRIGGER IF EXISTS mainapp_patientprofile_fts_au',
+    'DROP TRIGGER IF EXISTS mainapp_patientprofile_fts_ai',
+    'DROP TRIGGER IF EXISTS mainapp_user_fts_ad',
+    'DROP TRIGGER IF EXISTS mainapp_user_fts_au',
+    'DROP TRIGGER IF EXISTS mainapp_user_fts_ai',
+    'DROP TABLE IF EXISTS mainapp_user_fts',
+]
+
+
+def _run(statements):
+    def apply(apps, schema_editor):
+        # Other backends fall back to icontains search in mainapp.search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(FTS_SETUP), _run(FTS_TEARDOWN)),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Appointments this migration may cancel; anything else is history and is never edited
+OPEN_STATUSES = ('PENDING', 'CONFIRMED')
+NOTE = 'Cancelled automatically (was {}): double booking of this slot.'
+
+
+def cancel_double_bookings(apps, schema_editor):
+    # Keep one booking of each active slot so the constraint can be added: a completed
+    # visit if there is one, otherwise the earliest booking
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    clashes = (
+        Appointment.objects.exclude(status='CANCELLED')
+        .values('doctor_id', 'appointment_date', 'appointment_time')
+        .annotate(n=Count('id')).filter(n__gt=1)
+    )
+    for slot in clashes:
+        bookings = sorted(
+            Appointment.objects.exclude(status='CANCELLED').filter(
+                doctor_id=slot['doctor_id'],
+                appointment_date=slot['appointment_date'],
+                appointment_time=slot['appointment_time'],
+            ),
+            key=lambda appt: (appt.status in OPEN_STATUSES, appt.created_at, appt.id),
+        )
+        completed = [appt.id for appt in bookings if appt.status not in OPEN_STATUSES]
+        if len(completed) > 1:
+            raise RuntimeError(
+                f"Appointments {', '.join(map(str, completed))} are all completed visits with doctor "
+                f"{slot['doctor_id']} at {slot['appointment_date']} {slot['appointment_time']}. "
+                "Resolve the double booking by hand before migrating; completed visits are not edited."
+            )
+        for appt in bookings[1:]:
+            note = NOTE.format(appt.status)
+            appt.status = 'CANCELLED'
+            appt.notes = (appt.notes + '\n' if appt.notes else '') + note
+            appt.save(update_fields=['status', 'notes'])
+
+
+def restore_double_bookings(apps, schema_editor):
+    # Runs after the constraint is dropped, so the clashing bookings can come back
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    for status in OPEN_STATUSES:
+        note = NOTE.format(status)
+        for appt in Appointment.objects.filter(status='CANCELLED', notes__endswith=note):
+            appt.status = status
+            appt.notes = appt.notes[:-len(note)].removesuffix('\n')
+            appt.save(update_fields=['status', 'notes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_user_search_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_double_bookings, restore_double_bookings),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'CANCELLED'), _negated=True), fields=('doctor', 'appointment_date', 'appointment_time'), name='unique_active_doctor_slot'),
+        ),
+    ]
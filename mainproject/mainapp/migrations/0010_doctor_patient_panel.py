@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0009_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorPatientPanel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_seen', models.DateField()),
+                ('last_visit', models.DateField(blank=True, null=True)),
+                ('next_appointment', models.DateField(blank=True, null=True)),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('doctor', models.ForeignKey(limit_choices_to={'role': 'DOCTOR'}, on_delete=django.db.models.deletion.CASCADE, related_name='panel_patients', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(limit_choices_to={'role': 'PATIENT'}, on_delete=django.db.models.deletion.CASCADE, related_name='panel_doctors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'last_visit'], name='panel_doctor_last_visit_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'patient'), name='unique_doctor_patient_panel')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def capture_existing_fees(apps, schema_editor):
+    # Appointments completed before the ledger existed are charged at today's fee,
+    # the best record available
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    DoctorProfile = apps.get_model('mainapp', 'DoctorProfile')
+    RevenueEntry = apps.get_model('mainapp', 'RevenueEntry')
+    profile = DoctorProfile.objects.filter(user_id=OuterRef('doctor_id'))
+    completed = Appointment.objects.filter(status='COMPLETED')
+    completed.update(fee=Subquery(profile.values('consultation_fee')[:1]))
+    rows = completed.exclude(fee__isnull=True).values_list(
+        'id', 'doctor_id', 'appointment_date', 'fee', 'doctor__doctorprofile__department_id',
+    ).iterator(chunk_size=2000)
+    batch = []
+    for appt_id, doctor_id, day, fee, department_id in rows:
+        batch.append(RevenueEntry(appointment_id=appt_id, doctor_id=doctor_id, department_id=department_id, date=day, amount=fee))
+        if len(batch) >= 500:
+            RevenueEntry.objects.bulk_create(batch)
+            batch = []
+    RevenueEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0010_doctor_patient_panel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='fee',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='RevenueEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_entries', to='mainapp.appointment')),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mainapp.department')),
+                ('doctor', models.ForeignKey(blank=True, limit_choices_to={'role': 'DOCTOR'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='revenue_date_idx'), models.Index(fields=['doctor', 'date'], name='revenue_doctor_date_idx'), models.Index(fields=['department', 'date'], name='revenue_dept_date_idx')],
+            },
+        ),
+        migrations.RunPython(capture_existing_fees, migrations.RunPython.noop),
+    ]
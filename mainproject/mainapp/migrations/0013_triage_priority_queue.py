@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Value, When
+
+RANKS = {'URGENT': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+
+
+def rank_existing_entries(apps, schema_editor):
+    TriageQueue = apps.get_model('mainapp', 'TriageQueue')
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    TriageQueue.objects.update(rank=Case(
+        *[When(priority_level=level, then=Value(rank)) for level, rank in RANKS.items()],
+        default=Value(RANKS['MEDIUM']),
+    ))
+    TriageQueue.objects.filter(appointment__isnull=False).update(department_id=Subquery(
+        Appointment.objects.filter(id=OuterRef('appointment_id')).values('doctor__doctorprofile__department_id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0012_notification_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triagequeue',
+            name='called_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='triagequeue',
+            name='called_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='called_triage_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='triagequeue',
+            name='department',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='triage_entries', to='mainapp.department'),
+        ),
+        migrations.AddField(
+            model_name='triagequeue',
+            name='rank',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+        migrations.AddIndex(
+            model_name='triagequeue',
+            index=models.Index(fields=['is_processed', 'rank', 'checked_in_at'], name='triage_waiting_idx'),
+        ),
+        migrations.RunPython(rank_existing_entries, migrations.RunPython.noop),
+    ]
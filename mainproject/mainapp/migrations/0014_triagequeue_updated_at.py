@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0013_triage_priority_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triagequeue',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='triagequeue',
+            index=models.Index(fields=['department', 'is_processed', 'updated_at'], name='triage_department_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+STATUS_FIELDS = {
+    'PENDING': 'pending',
+    'CONFIRMED': 'confirmed',
+    'COMPLETED': 'completed',
+    'CANCELLED': 'cancelled',
+}
+
+
+def backfill_daily_stats(apps, schema_editor):
+    # 0009 created the rollup empty. Rebuild it from the raw tables, replacing
+    # any buckets the signals have filled in since, so existing history counts
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    DailyStats = apps.get_model('mainapp', 'DailyStats')
+    PatientProfile = apps.get_model('mainapp', 'PatientProfile')
+    TriageQueue = apps.get_model('mainapp', 'TriageQueue')
+    buckets = {}
+
+    def bucket(day, department_id, doctor_id):
+        key = (day, department_id, doctor_id)
+        if key not in buckets:
+            buckets[key] = DailyStats(date=day, department_id=department_id, doctor_id=doctor_id)
+        return buckets[key]
+
+    status_counts = {field: Count('id', filter=Q(status=status)) for status, field in STATUS_FIELDS.items()}
+    appointments = Appointment.objects.values(
+        'appointment_date', 'doctor_id', department_id=F('doctor__doctorprofile__department_id'),
+    ).annotate(
+        total=Count('id'),
+        fees=Coalesce(Sum('fee', filter=Q(status='COMPLETED')), Value(0), output_field=DecimalField()),
+        **status_counts,
+    ).order_by()
+    for row in appointments.iterator(chunk_size=2000):
+        stats = bucket(row['appointment_date'], row['department_id'], row['doctor_id'])
+        stats.appointments = row['total']
+        stats.revenue = row['fees']
+        for field in STATUS_FIELDS.values():
+            setattr(stats, field, row[field])
+
+    registrations = PatientProfile.objects.values(day=TruncDate('registered_at')).annotate(n=Count('id')).order_by()
+    for row in registrations:
+        bucket(row['day'], None, None).new_patients = row['n']
+
+    triage = TriageQueue.objects.values(
+        'appointment__doctor_id', day=TruncDate('checked_in_at'),
+        doctor_department_id=F('appointment__doctor__doctorprofile__department_id'),
+    ).annotate(n=Count('id')).order_by()
+    for row in triage:
+        bucket(row['day'], row['doctor_department_id'], row['appointment__doctor_id']).triage_entries = row['n']
+
+    DailyStats.objects.all().delete()
+    DailyStats.objects.bulk_create(buckets.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0014_triagequeue_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
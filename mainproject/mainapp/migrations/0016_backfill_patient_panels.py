@@ -0,0 +1,58 @@
+from datetime import date
+from django.db import migrations
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import TruncDate
+
+
+def backfill_patient_panels(apps, schema_editor):
+    # 0010 created the panels empty, which left doctors' patient lists and
+    # timelines bare on upgraded databases. Rebuild them from the raw tables.
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    DoctorPatientPanel = apps.get_model('mainapp', 'DoctorPatientPanel')
+    MedicalHistory = apps.get_model('mainapp', 'MedicalHistory')
+    today = date.today()
+
+    rows = {}
+    appointments = Appointment.objects.values('doctor_id', 'patient_id').annotate(
+        first=Min('appointment_date'),
+        last=Max('appointment_date', filter=Q(status='COMPLETED')),
+        upcoming=Min('appointment_date', filter=Q(status__in=('PENDING', 'CONFIRMED'), appointment_date__gte=today)),
+        visits=Count('id', filter=Q(status='COMPLETED')),
+    ).order_by()
+    for row in appointments.iterator(chunk_size=2000):
+        rows[(row['doctor_id'], row['patient_id'])] = DoctorPatientPanel(
+            doctor_id=row['doctor_id'], patient_id=row['patient_id'], first_seen=row['first'],
+            last_visit=row['last'], next_appointment=row['upcoming'], visit_count=row['visits'],
+        )
+
+    records = MedicalHistory.objects.values('doctor_id', 'patient_id').annotate(
+        first=Min(TruncDate('date')),
+        last=Max(TruncDate('date')),
+        visits=Count('id', filter=Q(appointment__isnull=True)),
+    ).order_by()
+    for row in records.iterator(chunk_size=2000):
+        key = (row['doctor_id'], row['patient_id'])
+        panel = rows.get(key)
+        if panel is None:
+            rows[key] = DoctorPatientPanel(
+                doctor_id=key[0], patient_id=key[1], first_seen=row['first'],
+                last_visit=row['last'], visit_count=row['visits'],
+            )
+        else:
+            panel.first_seen = min(panel.first_seen, row['first'])
+            panel.last_visit = max(d for d in (panel.last_visit, row['last']) if d is not None)
+            panel.visit_count += row['visits']
+
+    DoctorPatientPanel.objects.all().delete()
+    DoctorPatientPanel.objects.bulk_create(rows.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0015_backfill_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_patient_panels, migrations.RunPython.noop),
+    ]
@@ -80,6 +80,25 @@ class StaffProfile(models.Model):
     def __str__(self):
         return f"{self.user.name} - Staff ({self.department.name})"
 
+class AppointmentSeries(models.Model):
+    FREQUENCY_CHOICES = [
+        ('WEEKLY', 'Weekly'),
+        ('MONTHLY', 'Monthly'),
+    ]
+
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'PATIENT'}, related_name='patient_series')
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'DOCTOR'}, related_name='doctor_series')
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES, default='WEEKLY')
+    interval = models.PositiveSmallIntegerField(default=1)
+    start_date = models.DateField()
+    appointment_time = models.TimeField()
+    occurrences = models.PositiveSmallIntegerField()
+    reason = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.patient.name} - {self.doctor.name} ({self.get_frequency_display()} x{self.occurrences})"
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -95,8 +114,33 @@ class Appointment(models.Model):
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='PENDING')
     reason = models.TextField()
     notes = models.TextField(blank=True)
+    series = models.ForeignKey(AppointmentSeries, on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments')
+    # The doctor's consultation fee at the moment the appointment was completed
+    fee = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Doctor's day / slot lookups and the doctor's appointment list
+            models.Index(fields=['doctor', 'appointment_date', 'appointment_time'], name='appt_doctor_date_idx'),
+            # Pending request counts per doctor
+            models.Index(fields=['doctor', 'status'], name='appt_doctor_status_idx'),
+            # Patient dashboard, triage lookup and the patient's appointment list
+            models.Index(fields=['patient', 'appointment_date', 'appointment_time'], name='appt_patient_date_idx'),
+            # Front desk "today" queue and the staff appointment list
+            models.Index(fields=['appointment_date', 'appointment_time'], name='appt_date_time_idx'),
+            # Hospital-wide status counts
+            models.Index(fields=['status', 'appointment_date'], name='appt_status_date_idx'),
+        ]
+        constraints = [
+            # A doctor can hold only one active booking per slot
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                condition=~models.Q(status='CANCELLED'),
+                name='unique_active_doctor_slot',
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.patient.name} - {self.doctor.name} on {self.appointment_date}"
 
@@ -137,12 +181,119 @@ class TriageQueue(models.Model):
     pulse_rate = models.IntegerField(null=True, blank=True)
     chief_complaint = models.TextField(blank=True)
     priority_level = models.CharField(max_length=10, choices=[('LOW', 'Low'), ('MEDIUM', 'Medium'), ('HIGH', 'High'), ('URGENT', 'Urgent')], default='MEDIUM')
+    # Clinical order of priority_level (0 = most urgent), kept in step by save()
+    rank = models.PositiveSmallIntegerField(default=2)
+    # Department of the appointment's doctor; None for walk-ins
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True, related_name='triage_entries')
     checked_in_at = models.DateTimeField(auto_now_add=True)
     is_processed = models.BooleanField(default=False)
+    called_at = models.DateTimeField(null=True, blank=True)
+    called_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='called_triage_entries')
+    # Any change, including a claim by call_next, moves this forward; queue mirrors compare it to spot changes
+    updated_at = models.DateTimeField(auto_now=True)
+
+    RANKS = {'URGENT': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_processed', 'rank', 'checked_in_at'], name='triage_waiting_idx'),
+            models.Index(fields=['department', 'is_processed', 'updated_at'], name='triage_department_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.rank = self.RANKS.get(self.priority_level, self.RANKS['MEDIUM'])
+        if self.department_id is None and self.appointment_id:
+            self.department_id = Appointment.objects.filter(id=self.appointment_id).values_list(
+                'doctor__doctorprofile__department_id', flat=True,
+            ).first()
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.patient.name} - Triage ({self.priority_level})"
 
+class DailyStats(models.Model):
+    """Per-day rollup of activity, kept current by signals in mainapp.rollups.
+
+    Rows with no doctor/department hold hospital-wide figures such as new
+    patient registrations and walk-in triage.
+    """
+    date = models.DateField()
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True)
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, limit_choices_to={'role': 'DOCTOR'}, related_name='daily_stats')
+    appointments = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    new_patients = models.IntegerField(default=0)
+    triage_entries = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'department', 'doctor'], name='unique_daily_stats_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['doctor', 'date'], name='dailystats_doctor_date_idx'),
+            models.Index(fields=['department', 'date'], name='dailystats_dept_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.doctor.name if self.doctor else 'Hospital'}"
+
+class RevenueEntry(models.Model):
+    """Append-only ledger of earned fees, written by mainapp.revenue.
+
+    Completing an appointment adds a charge; undoing a completion adds a
+    negative entry. Rows are never edited, so totals stay correct after a
+    doctor changes their fee.
+    """
+    appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='revenue_entries')
+    doctor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, limit_choices_to={'role': 'DOCTOR'}, related_name='revenue_entries')
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True)
+    date = models.DateField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date'], name='revenue_date_idx'),
+            models.Index(fields=['doctor', 'date'], name='revenue_doctor_date_idx'),
+            models.Index(fields=['department', 'date'], name='revenue_dept_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Revenue entries are append-only')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.date} - {self.amount}"
+
+class DoctorPatientPanel(models.Model):
+    """A doctor's relationship with one patient, kept current by signals in mainapp.panels.
+
+    A row exists while the pair shares at least one appointment or medical
+    record, so "my patients" is an indexed lookup rather than a DISTINCT join.
+    """
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'DOCTOR'}, related_name='panel_patients')
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'PATIENT'}, related_name='panel_doctors')
+    first_seen = models.DateField()
+    last_visit = models.DateField(null=True, blank=True)
+    next_appointment = models.DateField(null=True, blank=True)
+    visit_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'patient'], name='unique_doctor_patient_panel'),
+        ]
+        indexes = [
+            models.Index(fields=['doctor', 'last_visit'], name='panel_doctor_last_visit_idx'),
+        ]
+
+    def __str__(self):
+        return f"Dr. {self.doctor.name} - {self.patient.name}"
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('APPOINTMENT', 'Appointment'),
@@ -158,6 +309,36 @@ class Notification(models.Model):
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES, default='GENERAL')
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Inbox pages are keyset ranges on (created_at, id) per user
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_inbox_idx'),
+            models.Index(fields=['user', 'is_read'], name='notification_unread_idx'),
+            # The retention job scans read notifications by age
+            models.Index(fields=['is_read', 'created_at'], name='notification_retention_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.title} - {self.user.name}"
\ No newline at end of file
+        return f"{self.title} - {self.user.name}"
+
+class NotificationArchive(models.Model):
+    """Read notifications past the retention age, moved here by notifications.archive_read.
+
+    Rows keep their original id so an archived notification can be traced.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES, default='GENERAL')
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notification_archive_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.user.name} (archived)"
\ No newline at end of file
@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import events
+from .models import Appointment, DoctorPatientPanel, Notification, NotificationArchive, User
+
+logger = logging.getLogger(__name__)
+
+UNREAD_KEY = 'notifications:unread:{}'
+# Counts are kept exact by adjust_unread in the process that made the change. The TTL
+# bounds how long other workers (with a per-process cache) keep a count that drifted.
+UNREAD_TTL = 60
+# Recent-unread lists and dropdown fragments are keyed by a per-user version that every change bumps.
+# All three expire within a minute: the fragment's "n minutes ago" text would otherwise freeze, and
+# bumps made by other workers never reach a per-process cache.
+FRAGMENT_TTL = 60
+VERSION_KEY = 'notifications:version:{}'
+RECENT_KEY = 'notifications:recent:{}:{}:{}'
+DROPDOWN_KEY = 'notifications:dropdown:{}:{}'
+RECENT_LIMIT = 5
+FANOUT_BATCH_SIZE = 2000
+INBOX_PAGE_SIZE = 25
+INBOX_KEYSET = ['created_at', 'id']
+DEFAULT_RETENTION_DAYS = 90
+ARCHIVE_CHUNK_SIZE = 1000
+
+
+def unread_count(user_id):
+    """Unread notifications for a user, counted once and then kept in the cache"""
+    key = UNREAD_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.add(key, count, UNREAD_TTL)
+    return count
+
+
+def version(user_id):
+    """Current cache version of a user's notifications; a new one is started after each bump"""
+    key = VERSION_KEY.format(user_id)
+    value = cache.get(key)
+    if value is None:
+        value = time.time_ns()
+        cache.add(key, value, FRAGMENT_TTL)
+        value = cache.get(key, value)
+    return value
+
+
+def bump_version(user_ids):
+    cache.delete_many([VERSION_KEY.format(user_id) for user_id in user_ids])
+
+
+def recent_unread(user_id, limit=RECENT_LIMIT):
+    """Newest unread notifications, cached per user until their notifications change or a minute passes"""
+    key = RECENT_KEY.format(user_id, version(user_id), limit)
+    unread = cache.get(key)
+    if unread is None:
+        count_key = UNREAD_KEY.format(user_id)
+        if cache.get(count_key) == 0:
+            unread = []
+        else:
+            unread = list(Notification.objects.filter(user_id=user_id, is_read=False).order_by('-created_at', '-id')[:limit])
+            if len(unread) < limit:
+                # A short page is every unread notification, so the count comes for free
+                cache.add(count_key, len(unread), UNREAD_TTL)
+        cache.set(key, unread, FRAGMENT_TTL)
+    return unread
+
+
+def dropdown_fragment(user_id, render):
+    """The rendered notification dropdown, cached under the user's current version"""
+    key = DROPDOWN_KEY.format(user_id, version(user_id))
+    html = cache.get(key)
+    if html is None:
+        html = render()
+        cache.set(key, html, FRAGMENT_TTL)
+    return html
+
+
+def adjust_unread(user_id, delta):
+    # Nothing to adjust until someone has asked for the count; it is computed fresh then
+    try:
+        cache.incr(UNREAD_KEY.format(user_id), delta)
+    except ValueError:
+        pass
+
+
+def mark_read(user_id, ids=None):
+    """Mark a user's unread notifications (or just ``ids``) read in one UPDATE"""
+    unread = Notification.objects.filter(user_id=user_id, is_read=False)
+    if ids is not None:
+        unread = unread.filter(id__in=ids)
+    updated = unread.update(is_read=True)
+    if updated:
+        adjust_unread(user_id, -updated)
+        bump_version([user_id])
+    return updated
+
+
+def archive_read(older_than_days=None, chunk_size=ARCHIVE_CHUNK_SIZE, log=None):
+    """Move read notifications older than the retention age into NotificationArchive.
+
+    Works a chunk of ids at a time, each copied and deleted in one short
+    transaction, so the job never holds a long write lock. Returns the
+    number of notifications moved.
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    expired = Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = list(expired.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            NotificationArchive.objects.bulk_create([
+                NotificationArchive(
+                    id=n['id'], user_id=n['user_id'], title=n['title'], message=n['message'],
+                    notification_type=n['notification_type'], created_at=n['created_at'],
+                )
+                for n in Notification.objects.filter(id__in=ids).values(
+                    'id', 'user_id', 'title', 'message', 'notification_type', 'created_at',
+                )
+            ], ignore_conflicts=True)
+            Notification.objects.filter(id__in=ids).delete()
+        moved += len(ids)
+        if log:
+            log(f'{moved} notifications archived')
+    return moved
+
+
+# Fan-out: audience -> recipient user ids as one set-based query
+
+def _department(department_id):
+    return User.objects.filter(
+        Q(doctorprofile__department_id=department_id) | Q(staffprofile__department_id=department_id),
+    ).values_list('id', flat=True)
+
+
+def _doctor_patients(doctor_id):
+    return DoctorPatientPanel.objects.filter(doctor_id=doctor_id).values_list('patient_id', flat=True)
+
+
+def _tomorrow(doctor_id=None):
+    appointments = Appointment.objects.filter(
+        appointment_date=date.today() + timedelta(days=1), status__in=['PENDING', 'CONFIRMED'],
+    )
+    if doctor_id:
+        appointments = appointments.filter(doctor_id=doctor_id)
+    return appointments.values_list('patient_id', flat=True).distinct()
+
+
+AUDIENCES = {
+    'department': _department,
+    'doctor-patients': _doctor_patients,
+    'tomorrow': _tomorrow,
+}
+
+
+def recipients(audience, target=None):
+    if audience not in AUDIENCES:
+        raise ValueError(f'Unknown audience {audience!r}')
+    return AUDIENCES[audience](target)
+
+
+def fan_out(audience, target, title, message, notification_type='GENERAL', batch_size=FANOUT_BATCH_SIZE):
+    """Create one notification per recipient of ``audience``; returns how many were sent.
+
+    Recipients are resolved in one query and written with ``bulk_create`` a
+    batch at a time, each batch in its own transaction. The cached unread
+    counts of each batch's users are dropped and connected clients are told,
+    since bulk_create sends no signals.
+    """
+    user_ids = list(recipients(audience, target))
+    for i in range(0, len(user_ids), batch_size):
+        batch = user_ids[i:i + batch_size]
+        with transaction.atomic():
+            created = Notification.objects.bulk_create([
+                Notification(user_id=user_id, title=title, message=message, notification_type=notification_type)
+                for user_id in batch
+            ])
+        cache.delete_many([UNREAD_KEY.format(user_id) for user_id in batch])
+        bump_version(batch)
+        for notification in created:
+            events.hub.publish([events.user_channel(notification.user_id)], 'notification', events.notification_event(notification))
+    return len(user_ids)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _worker():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # One worker keeps fan-outs from competing with each other for write locks
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notification-fanout')
+    return _executor
+
+
+def _run(*args):
+    try:
+        sent = fan_out(*args)
+        logger.info('Sent %s notifications to %s %s', sent, args[0], args[1])
+    except Exception:
+        logger.exception('Notification fan-out to %s %s failed', args[0], args[1])
+    finally:
+        # The worker thread's connection is not closed by the request cycle
+        connections.close_all()
+
+
+def enqueue(audience, target, title, message, notification_type='GENERAL'):
+    """Run ``fan_out`` on the background worker once the current transaction commits.
+
+    With ``NOTIFICATION_FANOUT_ASYNC = False`` it runs inline instead.
+    """
+    recipients(audience, target)  # reject unknown audiences in the caller
+    args = (audience, target, title, message, notification_type)
+    if getattr(settings, 'NOTIFICATION_FANOUT_ASYNC', True):
+        transaction.on_commit(lambda: _worker().submit(_run, *args))
+    else:
+        transaction.on_commit(lambda: fan_out(*args))
@@ -0,0 +1,71 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    raw = json.dumps([str(v) for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Decode a cursor into its key values, or ``None`` if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def decode_keyset(cursor, model, fields):
+    """Decode a cursor into values of ``model``'s ``fields``, or ``None`` if it is missing, malformed or tampered with"""
+    values = decode_cursor(cursor, len(fields))
+    if values is None or None in values:
+        return None
+    try:
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+
+def keyset_before(fields, values):
+    """Q matching rows whose ``fields`` sort strictly before ``values`` in descending order"""
+    # (f1, f2, ..., fn) < (v1, v2, ..., vn) expanded into an OR of prefix matches
+    condition = Q()
+    for i, field in enumerate(fields):
+        term = Q(**{f'{field}__lt': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            term &= Q(**{prev_field: prev_value})
+        condition |= term
+    return condition
+
+
+def keyset_page(queryset, fields, cursor=None, page_size=25):
+    """Return ``(rows, next_cursor)`` for one page of ``queryset``.
+
+    Rows are ordered descending on ``fields``, which must end with a unique
+    column (usually ``id``). Each page is a single indexed range query, so
+    its cost does not grow with how deep the user has scrolled. A cursor
+    that does not decode to valid values starts from the first page.
+    """
+    queryset = queryset.order_by(*[f'-{f}' for f in fields])
+    values = decode_keyset(cursor, queryset.model, fields)
+    if values is not None:
+        queryset = queryset.filter(keyset_before(fields, values))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor([last[f] for f in fields])
+        else:
+            next_cursor = encode_cursor([getattr(last, f) for f in fields])
+    return rows, next_cursor
@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Appointment, DoctorPatientPanel, MedicalHistory, User
+
+# Appointments still expected to take place
+UPCOMING_STATUSES = ('PENDING', 'CONFIRMED')
+
+PANEL_FIELDS = ['first_seen', 'last_visit', 'next_appointment', 'visit_count']
+
+_local = threading.local()
+
+
+def _latest(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def _earliest(*values):
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+def _compute(doctor_ids, patient_ids=None):
+    """Panel rows for every pair among ``doctor_ids`` (and ``patient_ids``) from the raw tables.
+
+    Visits are completed appointments plus medical records written outside
+    an appointment.
+    """
+    pair_filter = Q(doctor_id__in=doctor_ids)
+    if patient_ids is not None:
+        pair_filter &= Q(patient_id__in=patient_ids)
+    today = timezone.localdate()
+
+    rows = {}
+    appointments = Appointment.objects.filter(pair_filter).values('doctor_id', 'patient_id').annotate(
+        first=Min('appointment_date'),
+        last=Max('appointment_date', filter=Q(status='COMPLETED')),
+        upcoming=Min('appointment_date', filter=Q(status__in=UPCOMING_STATUSES, appointment_date__gte=today)),
+        visits=Count('id', filter=Q(status='COMPLETED')),
+    ).order_by()
+    for row in appointments:
+        rows[(row['doctor_id'], row['patient_id'])] = DoctorPatientPanel(
+            doctor_id=row['doctor_id'], patient_id=row['patient_id'], first_seen=row['first'],
+            last_visit=row['last'], next_appointment=row['upcoming'], visit_count=row['visits'],
+        )
+
+    records = MedicalHistory.objects.filter(pair_filter).values('doctor_id', 'patient_id').annotate(
+        first=Min(TruncDate('date')),
+        last=Max(TruncDate('date')),
+        visits=Count('id', filter=Q(appointment__isnull=True)),
+    ).order_by()
+    for row in records:
+        key = (row['doctor_id'], row['patient_id'])
+        panel = rows.get(key)
+        if panel is None:
+            rows[key] = DoctorPatientPanel(
+                doctor_id=key[0], patient_id=key[1], first_seen=row['first'],
+                last_visit=row['last'], visit_count=row['visits'],
+            )
+        else:
+            panel.first_seen = _earliest(panel.first_seen, row['first'])
+            panel.last_visit = _latest(panel.last_visit, row['last'])
+            panel.visit_count += row['visits']
+    return rows
+
+
+@contextmanager
+def deferred():
+    """Collect this thread's refreshes and apply them together on exit, e.g. while a doctor's rows cascade away"""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+    finally:
+        pairs, _local.pending = _local.pending, None
+    refresh(pairs)
+
+
+def refresh(pairs):
+    """Recompute the panel rows of the given ``(doctor_id, patient_id)`` pairs.
+
+    Pairs that no longer share an appointment or record lose their row.
+    Costs a fixed handful of queries however many pairs are passed.
+    """
+    pairs = {(d, p) for d, p in pairs if d is not None and p is not None}
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.update(pairs)
+        return
+    if not pairs:
+        return
+    doctor_ids = {d for d, _ in pairs}
+    patient_ids = {p for _, p in pairs}
+    computed = [panel for key, panel in _compute(doctor_ids, patient_ids).items() if key in pairs]
+
+    with transaction.atomic():
+        if computed:
+            DoctorPatientPanel.objects.bulk_create(
+                computed, update_conflicts=True,
+                unique_fields=['doctor', 'patient'], update_fields=PANEL_FIELDS,
+            )
+        kept = {(panel.doctor_id, panel.patient_id) for panel in computed}
+        stale = [
+            panel_id for panel_id, d, p in DoctorPatientPanel.objects.filter(
+                doctor_id__in=doctor_ids, patient_id__in=patient_ids
+            ).values_list('id', 'doctor_id', 'patient_id')
+            if (d, p) in pairs and (d, p) not in kept
+        ]
+        if stale:
+            DoctorPatientPanel.objects.filter(id__in=stale).delete()
+
+
+def refresh_stale(chunk_size=500):
+    """Refresh pairs whose stored ``next_appointment`` has passed; run daily.
+
+    ``next_appointment`` is worked out when a pair changes, so once its day
+    goes by it stays put until something else touches the pair. Returns how
+    many pairs were refreshed.
+    """
+    stale = list(DoctorPatientPanel.objects.filter(next_appointment__lt=timezone.localdate()).values_list('doctor_id', 'patient_id'))
+    for i in range(0, len(stale), chunk_size):
+        refresh(stale[i:i + chunk_size])
+    return len(stale)
+
+
+def rebuild(chunk_size=50, log=None):
+    """Recompute every panel, ``chunk_size`` doctors per transaction"""
+    doctor_ids = list(User.objects.filter(role='DOCTOR').order_by('id').values_list('id', flat=True))
+    for i in range(0, len(doctor_ids), chunk_size):
+        chunk = doctor_ids[i:i + chunk_size]
+        with transaction.atomic():
+            DoctorPatientPanel.objects.filter(doctor_id__in=chunk).delete()
+            DoctorPatientPanel.objects.bulk_create(_compute(chunk).values(), batch_size=500)
+        if log:
+            log(f'doctors {chunk[0]} .. {chunk[-1]}')
@@ -0,0 +1,137 @@
+import logging
+from asyncio import iscoroutinefunction
+import re
+import sys
+from collections import Counter
+from functools import wraps
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 20
+# A query shape repeated this many times in one request is reported as N+1
+REPEAT_THRESHOLD = 3
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*(?:\?\s*,\s*)+\?\s*\)')
+# bulk_create splits large inserts into batches; those repeat by design, not per row
+_BATCHED_INSERT = re.compile(r'^INSERT INTO .* VALUES \(\.\.\.\), \(')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """Declare the most queries a view may run; checked by QueryBudgetMiddleware and the test suite"""
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view(request, *args, **kwargs):
+                return await view_func(request, *args, **kwargs)
+        else:
+            @wraps(view_func)
+            def _wrapped_view(request, *args, **kwargs):
+                return view_func(request, *args, **kwargs)
+        _wrapped_view.query_budget = max_queries
+        return _wrapped_view
+    return decorator
+
+
+def budget_for(view_func):
+    return getattr(view_func, 'query_budget', getattr(settings, 'QUERY_BUDGET_DEFAULT', DEFAULT_BUDGET))
+
+
+def query_shape(sql):
+    """SQL with literals and IN-lists collapsed, so repeated lookups group together"""
+    shape = _LITERALS.sub('?', sql)
+    shape = shape.replace('%s', '?')
+    return _IN_LISTS.sub('(...)', shape)
+
+
+def template_origin():
+    """``template.html:line`` of the template tag being rendered, if any"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` hook recording each query's shape and template origin"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((query_shape(sql), template_origin()))
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold=REPEAT_THRESHOLD):
+        """Query shapes run at least ``threshold`` times, with where they came from"""
+        counts = Counter(shape for shape, _ in self.queries)
+        report = []
+        for shape, n in counts.most_common():
+            if n < threshold:
+                break
+            if _BATCHED_INSERT.match(shape):
+                continue
+            origins = sorted({origin for s, origin in self.queries if s == shape and origin})
+            report.append({'count': n, 'sql': shape, 'origins': origins})
+        return report
+
+
+class QueryBudgetMiddleware:
+    """Count queries per view and report views over budget or with N+1 patterns.
+
+    Active when ``QUERY_BUDGET_ENABLED`` is set (defaults to ``DEBUG``).
+    Problems are logged, or raised when ``QUERY_BUDGET_RAISE`` is true.
+    Queries are recorded around the rest of the chain, so the view still
+    runs through the handler with its exception handling and later
+    middleware intact.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', settings.DEBUG):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            # The handler renders lazy responses before returning, still inside the wrapper
+            response = self.get_response(request)
+
+        view_func = getattr(request, '_query_budget_view', None)
+        if view_func is not None:
+            self.check(request, view_func, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not iscoroutinefunction(view_func):
+            # Async views query from other threads, out of sight of this connection's wrapper
+            request._query_budget_view = view_func
+        return None
+
+    def check(self, request, view_func, recorder):
+        budget = budget_for(view_func)
+        problems = []
+        if len(recorder.queries) > budget:
+            problems.append(f'{len(recorder.queries)} queries (budget {budget})')
+        for group in recorder.repeated():
+            where = ', '.join(group['origins']) or 'view code'
+            problems.append(f"N+1: {group['count']}x from {where}: {group['sql'][:200]}")
+
+        if problems:
+            message = f'{request.method} {request.path}: ' + '; '.join(problems)
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,117 @@
+from datetime import date, timedelta
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractHour, ExtractWeekDay
+from . import columnar
+from .models import Appointment, DailyStats
+from .rollups import STATUS_FIELDS
+
+try:
+    import numpy as np
+except ImportError:  # numpy only speeds up reshaping; plain lists work the same
+    np = None
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+HOURS = 24
+
+# Default window when no range is given: recent history plus what is already booked
+DEFAULT_PAST_DAYS = 90
+DEFAULT_FUTURE_DAYS = 30
+# Ranges longer than this are answered from the columnar snapshot when one exists
+LIVE_RANGE_DAYS = 366
+
+
+def default_range(today=None):
+    today = today or date.today()
+    return today - timedelta(days=DEFAULT_PAST_DAYS), today + timedelta(days=DEFAULT_FUTURE_DAYS)
+
+
+def _weekday_index(week_day):
+    # ExtractWeekDay counts 1=Sunday .. 7=Saturday; rows here start on Monday
+    return (week_day + 5) % 7
+
+
+def _grid(cells, rows, cols):
+    """``rows`` x ``cols`` matrix from ``(row, col, value)`` cells, with row and column totals"""
+    if np is not None:
+        grid = np.zeros((rows, cols), dtype=np.int64)
+        if cells:
+            r, c, v = (np.array(part) for part in zip(*cells))
+            grid[r, c] = v
+        return grid.tolist(), grid.sum(axis=1).tolist(), grid.sum(axis=0).tolist()
+    grid = [[0] * cols for _ in range(rows)]
+    for r, c, v in cells:
+        grid[r][c] = v
+    return grid, [sum(row) for row in grid], [sum(col) for col in zip(*grid)]
+
+
+def density(start, end, doctor_id=None, department_id=None):
+    """Weekday x hour counts of booked (not cancelled) appointments in one GROUP BY"""
+    appointments = Appointment.objects.filter(appointment_date__range=(start, end)).exclude(status='CANCELLED')
+    if doctor_id:
+        appointments = appointments.filter(doctor_id=doctor_id)
+    if department_id:
+        appointments = appointments.filter(doctor__doctorprofile__department_id=department_id)
+    rows = appointments.values(
+        week_day=ExtractWeekDay('appointment_date'), hour=ExtractHour('appointment_time'),
+    ).annotate(n=Count('id')).order_by()
+
+    matrix, by_weekday, by_hour = _grid(
+        [(_weekday_index(row['week_day']), row['hour'], row['n']) for row in rows], len(WEEKDAYS), HOURS,
+    )
+    return {
+        'weekdays': WEEKDAYS,
+        'matrix': matrix,
+        'by_weekday': by_weekday,
+        'by_hour': by_hour,
+        'max': max(max(row) for row in matrix),
+    }
+
+
+def breakdown(start, end, doctor_id=None, department_id=None):
+    """Status counts and revenue per department from the DailyStats rollup in one GROUP BY"""
+    stats = DailyStats.objects.filter(date__range=(start, end), doctor__isnull=False)
+    if doctor_id:
+        stats = stats.filter(doctor_id=doctor_id)
+    if department_id:
+        stats = stats.filter(department_id=department_id)
+    fields = ['appointments'] + list(STATUS_FIELDS.values())
+    rows = list(stats.values('department_id', 'department__name').annotate(
+        revenue_total=Sum('revenue'), **{f'{field}_total': Sum(field) for field in fields},
+    ).order_by('department__name'))
+
+    counts, _, totals = _grid(
+        [(i, j, row[f'{field}_total'] or 0) for i, row in enumerate(rows) for j, field in enumerate(fields)],
+        len(rows), len(fields),
+    )
+    departments = [{
+        'id': row['department_id'],
+        'name': row['department__name'] or 'Unassigned',
+        'revenue': row['revenue_total'] or 0,
+        **dict(zip(fields, counts[i])),
+    } for i, row in enumerate(rows)]
+    return {
+        'departments': departments,
+        'totals': dict(zip(fields, totals or [0] * len(fields))),
+        'revenue': sum((d['revenue'] for d in departments), 0),
+    }
+
+
+def build_report(start, end, doctor_id=None, department_id=None, use_snapshot=None):
+    """Everything the reports page charts for one date range and scope.
+
+    Long ranges are computed from the nightly columnar snapshot (see
+    mainapp.columnar) instead of the live tables; ``use_snapshot`` forces
+    either source.
+    """
+    if use_snapshot is None:
+        use_snapshot = (end - start).days > LIVE_RANGE_DAYS and columnar.available()
+    if use_snapshot:
+        report = columnar.report(start, end, doctor_id, department_id)
+        report['density']['weekdays'] = WEEKDAYS
+        return report
+    return {
+        'start': start,
+        'end': end,
+        'density': density(start, end, doctor_id, department_id),
+        **breakdown(start, end, doctor_id, department_id),
+    }
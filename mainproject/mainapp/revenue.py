@@ -0,0 +1,51 @@
+from decimal import Decimal
+from django.db.models import OuterRef, Subquery, Sum
+from .models import Appointment, DoctorProfile, RevenueEntry
+
+
+def current_fee():
+    """Expression for the appointment's doctor's consultation fee, for use in ``update()``"""
+    return Subquery(DoctorProfile.objects.filter(user_id=OuterRef('doctor_id')).values('consultation_fee')[:1])
+
+
+def charge(appointment_ids, sign=1):
+    """Append a ledger entry for each appointment at its captured fee; returns ``{id: fee}`` charged.
+
+    ``sign=-1`` records a reversal. Appointments without a captured fee are
+    skipped. One read and one bulk insert however many appointments.
+    """
+    rows = list(Appointment.objects.filter(id__in=appointment_ids, fee__isnull=False).values_list(
+        'id', 'doctor_id', 'appointment_date', 'fee', 'doctor__doctorprofile__department_id',
+    ))
+    RevenueEntry.objects.bulk_create([
+        RevenueEntry(
+            appointment_id=appt_id, doctor_id=doctor_id, department_id=department_id,
+            date=day, amount=fee * sign,
+        )
+        for appt_id, doctor_id, day, fee, department_id in rows
+    ])
+    return {row[0]: row[3] for row in rows}
+
+
+def _in_range(start, end):
+    entries = RevenueEntry.objects.all()
+    if start:
+        entries = entries.filter(date__gte=start)
+    if end:
+        entries = entries.filter(date__lte=end)
+    return entries
+
+
+def total(start=None, end=None, doctor_id=None, department_id=None):
+    """Revenue over an optional date range and scope, as an indexed sum over the ledger"""
+    entries = _in_range(start, end)
+    if doctor_id:
+        entries = entries.filter(doctor_id=doctor_id)
+    if department_id:
+        entries = entries.filter(department_id=department_id)
+    return entries.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+
+
+def by(field, start=None, end=None):
+    """``{value: revenue}`` grouped by ``doctor_id``, ``department_id`` or ``date``"""
+    return dict(_in_range(start, end).values_list(field).annotate(total=Sum('amount')).order_by())
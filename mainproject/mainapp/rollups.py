@@ -0,0 +1,226 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from .models import Appointment, DailyStats, DoctorProfile, PatientProfile, TriageQueue
+
+STATUS_FIELDS = {
+    'PENDING': 'pending',
+    'CONFIRMED': 'confirmed',
+    'COMPLETED': 'completed',
+    'CANCELLED': 'cancelled',
+}
+
+_appointment_date = Appointment._meta.get_field('appointment_date')
+_local = threading.local()
+
+
+def as_date(value):
+    return _appointment_date.to_python(value)
+
+
+@contextmanager
+def paused():
+    """Skip the signal-driven DailyStats updates in this thread, e.g. while a doctor's rows cascade away"""
+    previous = getattr(_local, 'paused', False)
+    _local.paused = True
+    try:
+        yield
+    finally:
+        _local.paused = previous
+
+
+def is_paused():
+    return getattr(_local, 'paused', False)
+
+
+def _departments(doctor_ids):
+    """``{doctor_id: department_id}`` for many doctors in one query"""
+    doctor_ids = {d for d in doctor_ids if d is not None}
+    departments = dict.fromkeys(doctor_ids)
+    if doctor_ids:
+        departments.update(DoctorProfile.objects.filter(user_id__in=doctor_ids).values_list('user_id', 'department_id'))
+    return departments
+
+
+def _department(doctor_id):
+    return _departments([doctor_id]).get(doctor_id)
+
+
+def bump(day, doctor_id=None, department_id=None, **deltas):
+    """Add ``deltas`` to the (day, department, doctor) bucket, creating it if needed"""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    with transaction.atomic():
+        bucket = DailyStats.objects.filter(date=day, department_id=department_id, doctor_id=doctor_id)
+        if not bucket.update(**{field: F(field) + value for field, value in deltas.items()}):
+            DailyStats.objects.create(date=day, department_id=department_id, doctor_id=doctor_id, **deltas)
+
+
+def bump_many(buckets):
+    """Apply ``{(day, department_id, doctor_id): deltas}`` with one read and one write of each kind.
+
+    The affected rows are locked and updated in Python, so a batch costs the
+    same few queries however many buckets it touches.
+    """
+    buckets = {key: {f: v for f, v in deltas.items() if v} for key, deltas in buckets.items()}
+    buckets = {key: deltas for key, deltas in buckets.items() if deltas}
+    if not buckets:
+        return
+    days = {day for day, _, _ in buckets}
+    doctor_ids = {doctor_id for _, _, doctor_id in buckets}
+    doctor_filter = Q(doctor_id__in=doctor_ids - {None})
+    if None in doctor_ids:
+        doctor_filter |= Q(doctor__isnull=True)
+
+    with transaction.atomic():
+        existing = {
+            (stats.date, stats.department_id, stats.doctor_id): stats
+            for stats in DailyStats.objects.select_for_update().filter(doctor_filter, date__in=days)
+        }
+        changed, created, fields = [], [], set()
+        for (day, department_id, doctor_id), deltas in buckets.items():
+            stats = existing.get((day, department_id, doctor_id))
+            if stats is None:
+                created.append(DailyStats(date=day, department_id=department_id, doctor_id=doctor_id, **deltas))
+                continue
+            for field, value in deltas.items():
+                setattr(stats, field, getattr(stats, field) + value)
+            fields.update(deltas)
+            changed.append(stats)
+        if changed:
+            DailyStats.objects.bulk_update(changed, sorted(fields))
+        if created:
+            DailyStats.objects.bulk_create(created)
+
+
+def _appointment_deltas(status, fee, sign):
+    # Revenue is the fee captured on completion, as in the ledger; none captured counts as 0
+    deltas = {'appointments': sign, STATUS_FIELDS[status]: sign}
+    if status == 'COMPLETED':
+        deltas['revenue'] = (fee or 0) * sign
+    return deltas
+
+
+def appointment_added(day, doctor_id, status, sign=1, fee=None):
+    """Count an appointment into (or, with ``sign=-1``, out of) its day's bucket; ``fee`` is its captured fee"""
+    bump(as_date(day), doctor_id, _department(doctor_id), **_appointment_deltas(status, fee, sign))
+
+
+def appointments_added(appointments):
+    """Count a batch of new appointments into their buckets with a fixed handful of queries"""
+    per_bucket = defaultdict(lambda: defaultdict(int))
+    for appt in appointments:
+        for field, value in _appointment_deltas(appt.status, appt.fee, 1).items():
+            per_bucket[(as_date(appt.appointment_date), appt.doctor_id)][field] += value
+    departments = _departments(doctor_id for _, doctor_id in per_bucket)
+    bump_many({(day, departments.get(doctor_id), doctor_id): deltas for (day, doctor_id), deltas in per_bucket.items()})
+
+
+def appointment_changed(old, new, fee=None):
+    """Move an appointment between buckets/statuses; ``old``/``new`` are (day, doctor_id, status).
+
+    ``fee`` is the appointment's captured fee, which is what completed
+    appointments add to revenue.
+    """
+    if old == new:
+        return
+    old_day, old_doctor, old_status = old
+    new_day, new_doctor, new_status = new
+    if (old_day, old_doctor) != (new_day, new_doctor):
+        appointment_added(old_day, old_doctor, old_status, -1, fee=fee)
+        appointment_added(new_day, new_doctor, new_status, 1, fee=fee)
+        return
+
+    deltas = defaultdict(int)
+    deltas[STATUS_FIELDS[old_status]] -= 1
+    deltas[STATUS_FIELDS[new_status]] += 1
+    if old_status == 'COMPLETED':
+        deltas['revenue'] -= fee or 0
+    if new_status == 'COMPLETED':
+        deltas['revenue'] += fee or 0
+    bump(as_date(new_day), new_doctor, _department(new_doctor), **deltas)
+
+
+def appointments_transitioned(rows, target):
+    """Apply a bulk status change; rows carry the previous status and the captured fee"""
+    per_bucket = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        deltas = per_bucket[(row['appointment_date'], row['doctor_id'])]
+        deltas[STATUS_FIELDS[row['status']]] -= 1
+        deltas[STATUS_FIELDS[target]] += 1
+        if row['status'] == 'COMPLETED':
+            deltas['revenue'] -= row['fee'] or 0
+        if target == 'COMPLETED':
+            deltas['revenue'] += row['fee'] or 0
+
+    departments = _departments(row['doctor_id'] for row in rows)
+    bump_many({(day, departments.get(doctor_id), doctor_id): deltas for (day, doctor_id), deltas in per_bucket.items()})
+
+
+def triage_added(day, appointment_id, sign=1):
+    doctor_id = None
+    if appointment_id:
+        doctor_id = Appointment.objects.filter(id=appointment_id).values_list('doctor_id', flat=True).first()
+    bump(day, doctor_id, _department(doctor_id), triage_entries=sign)
+
+
+def rebuild(start, end, chunk_days=31, log=None):
+    """Recompute DailyStats for ``start``..``end`` (inclusive) from the raw tables.
+
+    Works through the range ``chunk_days`` at a time, each chunk replaced
+    in its own transaction with a few GROUP BY queries and one bulk insert.
+    """
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        with transaction.atomic():
+            DailyStats.objects.filter(date__range=(chunk_start, chunk_end)).delete()
+            DailyStats.objects.bulk_create(_compute(chunk_start, chunk_end), batch_size=500)
+        if log:
+            log(f'{chunk_start} .. {chunk_end}')
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+def _compute(start, end):
+    buckets = {}
+
+    def bucket(day, department_id, doctor_id):
+        key = (day, department_id, doctor_id)
+        if key not in buckets:
+            buckets[key] = DailyStats(date=day, department_id=department_id, doctor_id=doctor_id)
+        return buckets[key]
+
+    status_counts = {field: Count('id', filter=Q(status=status)) for status, field in STATUS_FIELDS.items()}
+    appointments = Appointment.objects.filter(appointment_date__range=(start, end)).values(
+        'appointment_date', 'doctor_id', department_id=F('doctor__doctorprofile__department_id'),
+    ).annotate(
+        total=Count('id'),
+        fees=Coalesce(Sum('fee', filter=Q(status='COMPLETED')), Value(0), output_field=DecimalField()),
+        **status_counts,
+    ).order_by()
+    for row in appointments:
+        stats = bucket(row['appointment_date'], row['department_id'], row['doctor_id'])
+        stats.appointments = row['total']
+        stats.revenue = row['fees']
+        for field in STATUS_FIELDS.values():
+            setattr(stats, field, row[field])
+
+    registrations = PatientProfile.objects.filter(registered_at__date__range=(start, end)).values(
+        day=TruncDate('registered_at'),
+    ).annotate(n=Count('id')).order_by()
+    for row in registrations:
+        bucket(row['day'], None, None).new_patients = row['n']
+
+    triage = TriageQueue.objects.filter(checked_in_at__date__range=(start, end)).values(
+        'appointment__doctor_id', day=TruncDate('checked_in_at'),
+        doctor_department_id=F('appointment__doctor__doctorprofile__department_id'),
+    ).annotate(n=Count('id')).order_by()
+    for row in triage:
+        bucket(row['day'], row['doctor_department_id'], row['appointment__doctor_id']).triage_entries = row['n']
+
+    return list(buckets.values())
@@ -0,0 +1,311 @@
+import time as clock
+from datetime import datetime, date, time, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from .models import Appointment, DoctorProfile, User
+
+# Length of one bookable slot in minutes
+SLOT_MINUTES = 30
+# Short, since bookings made by other workers only invalidate their own per-process cache;
+# the booking constraint still rejects a slot that a stale map shows as free
+SLOT_CACHE_TIMEOUT = 30
+
+# Statuses that free up the slot they were booked in
+RELEASED_STATUSES = ('CANCELLED',)
+
+# How often a booking re-plans after losing a slot to a concurrent request
+BOOKING_RETRIES = 3
+
+# Sent after book_batch inserts appointments; bulk_create skips post_save
+appointments_created = Signal()
+
+
+def _version_key(doctor_id):
+    return f"slots:ver:{doctor_id}"
+
+
+def _doctor_version(doctor_id):
+    key = _version_key(doctor_id)
+    version = cache.get(key)
+    if version is None:
+        # Never reused, so an evicted version key cannot bring back days cached under an old one
+        version = clock.time_ns()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_doctor(doctor_id):
+    """Drop every cached day for a doctor by starting a new version"""
+    cache.delete(_version_key(doctor_id))
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+class DaySchedule:
+    """Free/busy bitmap of one doctor's working day.
+
+    Bit ``i`` of ``busy`` is set when slot ``i`` (``start + i * SLOT_MINUTES``)
+    is taken. ``count`` is 0 when the doctor does not work that day.
+    """
+
+    def __init__(self, start, count, busy):
+        self.start = start
+        self.count = count
+        self.busy = busy
+
+    def index_of(self, t):
+        offset = _minutes(t) - self.start
+        if offset < 0:
+            return None
+        idx = offset // SLOT_MINUTES
+        return idx if idx < self.count else None
+
+    def time_of(self, idx):
+        minutes = self.start + idx * SLOT_MINUTES
+        return time(minutes // 60, minutes % 60)
+
+    def mark_busy(self, t):
+        idx = self.index_of(t)
+        if idx is not None:
+            self.busy |= 1 << idx
+
+    def is_free(self, t):
+        idx = self.index_of(t)
+        return idx is not None and not (self.busy >> idx) & 1
+
+    def free_slots(self, n=None, after=None):
+        """Start times of free slots in order, at most ``n`` of them"""
+        free = ~self.busy & ((1 << self.count) - 1)
+        if after is not None:
+            # Keep only slots starting strictly after the given time
+            first = max(0, -(-(_minutes(after) + 1 - self.start) // SLOT_MINUTES))
+            free &= ~((1 << first) - 1)
+        slots = []
+        while free and (n is None or len(slots) < n):
+            lowest = free & -free
+            slots.append(self.time_of(lowest.bit_length() - 1))
+            free ^= lowest
+        return slots
+
+
+def _empty_schedule(profile):
+    if not profile or not profile['is_available']:
+        return DaySchedule(0, 0, 0)
+    start = _minutes(profile['available_from'])
+    count = max(0, (_minutes(profile['available_to']) - start) // SLOT_MINUTES)
+    return DaySchedule(start, count, 0)
+
+
+def _hours(doctor_ids):
+    return {
+        p['user_id']: p for p in DoctorProfile.objects.filter(user_id__in=doctor_ids).values(
+            'user_id', 'available_from', 'available_to', 'is_available'
+        )
+    }
+
+
+def _build(doctor_id, day):
+    schedule = _empty_schedule(_hours([doctor_id]).get(doctor_id))
+    booked = Appointment.objects.filter(
+        doctor_id=doctor_id, appointment_date=day
+    ).exclude(status__in=RELEASED_STATUSES).values_list('appointment_time', flat=True)
+    for t in booked:
+        schedule.mark_busy(t)
+    return schedule
+
+
+def get_day_schedules(pairs):
+    """Fresh schedules for many ``(doctor_id, day)`` pairs using two queries.
+
+    Used by batch operations that must validate against the database rather
+    than a possibly stale cache entry.
+    """
+    pairs = set(pairs)
+    doctor_ids = {doctor_id for doctor_id, _ in pairs}
+    days = {day for _, day in pairs}
+    hours = _hours(doctor_ids)
+    schedules = {pair: _empty_schedule(hours.get(pair[0])) for pair in pairs}
+
+    booked = Appointment.objects.filter(
+        doctor_id__in=doctor_ids, appointment_date__in=days
+    ).exclude(status__in=RELEASED_STATUSES).values_list('doctor_id', 'appointment_date', 'appointment_time')
+    for doctor_id, day, t in booked:
+        schedule = schedules.get((doctor_id, day))
+        if schedule:
+            schedule.mark_busy(t)
+    return schedules
+
+
+def get_day_schedule(doctor_id, day):
+    key = f"slots:{doctor_id}:{_doctor_version(doctor_id)}:{day.isoformat()}"
+    cached = cache.get(key)
+    if cached is not None:
+        return DaySchedule(*cached)
+    schedule = _build(doctor_id, day)
+    cache.set(key, (schedule.start, schedule.count, schedule.busy), SLOT_CACHE_TIMEOUT)
+    return schedule
+
+
+def is_slot_available(doctor_id, day, t):
+    return get_day_schedule(doctor_id, day).is_free(t)
+
+
+def is_past(day, t):
+    """True once the slot starting at ``t`` on ``day`` has begun in local time"""
+    now = timezone.localtime()
+    return (day, t) < (now.date(), now.time())
+
+
+def claim_time(doctor_id, day, t):
+    """Return the start of the free slot containing ``t``, or ``None`` if it is taken or past"""
+    schedule = get_day_schedule(doctor_id, day)
+    if not schedule.is_free(t):
+        return None
+    slot_time = schedule.time_of(schedule.index_of(t))
+    return None if is_past(day, slot_time) else slot_time
+
+
+def book_slot(patient_id, doctor_id, day, t, reason, retries=0):
+    """Book the slot containing ``t``; returns ``(appointment, suggestions)``.
+
+    The unique constraint on active (doctor, date, time) rows is the final
+    arbiter between concurrent requests. When the slot is taken the next
+    free slots are returned as suggestions, and with ``retries`` > 0 they
+    are tried in turn before giving up.
+    """
+    for attempt in range(retries + 1):
+        slot_time = claim_time(doctor_id, day, t)
+        if slot_time is not None:
+            try:
+                with transaction.atomic():
+                    appointment = Appointment.objects.create(
+                        patient_id=patient_id, doctor_id=doctor_id,
+                        appointment_date=day, appointment_time=slot_time, reason=reason,
+                    )
+                return appointment, []
+            except IntegrityError:
+                # Lost the race; the cached bitmap is stale
+                invalidate_doctor(doctor_id)
+        suggestions = next_free_slots(doctor_id, day, 3)
+        if attempt == retries or not suggestions:
+            return None, suggestions
+        day, t = suggestions[0].date(), suggestions[0].time()
+
+
+def next_free_slots(doctor_id, day, n=5, max_days=14):
+    """Return up to ``n`` free ``datetime`` slots starting from ``day``.
+
+    Slots in the past are skipped, and following days are searched until
+    ``n`` slots are found or ``max_days`` have been scanned.
+    """
+    now = timezone.localtime()
+    results = []
+    for offset in range(max_days):
+        current = day + timedelta(days=offset)
+        if current < now.date():
+            continue
+        after = now.time() if current == now.date() else None
+        for t in get_day_schedule(doctor_id, current).free_slots(n - len(results), after=after):
+            results.append(datetime.combine(current, t))
+        if len(results) >= n:
+            break
+    return results
+
+
+def parse_slot(date_str, time_str):
+    """Parse posted ``YYYY-MM-DD`` / ``HH:MM`` values, returning ``(None, None)`` on bad input"""
+    try:
+        return date.fromisoformat(date_str), time.fromisoformat(time_str)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def book_batch(rows, **fields):
+    """Validate and insert many bookings at once.
+
+    ``rows`` is a list of dicts with patient, doctor, date, time and reason.
+    All rows are checked against doctor hours, existing bookings and each
+    other with a handful of set-based queries; the valid ones are inserted
+    with one ``bulk_create`` inside a transaction. Extra ``fields`` are set
+    on every created appointment. Returns one result dict per input row,
+    in order.
+    """
+    results = [{'row': i} for i in range(len(rows))]
+    parsed = {}
+    for i, row in enumerate(rows):
+        try:
+            doctor_id, patient_id = int(row.get('doctor')), int(row.get('patient'))
+        except (TypeError, ValueError):
+            results[i]['error'] = 'doctor and patient must be user ids'
+            continue
+        day, t = parse_slot(row.get('date'), row.get('time'))
+        if day is None:
+            results[i]['error'] = 'Invalid date or time'
+            continue
+        parsed[i] = (doctor_id, patient_id, day, t, (row.get('reason') or '').strip())
+
+    doctor_ids = {p[0] for p in parsed.values()}
+    patient_ids = {p[1] for p in parsed.values()}
+    known_doctors = set(User.objects.filter(id__in=doctor_ids, role='DOCTOR').values_list('id', flat=True))
+    known_patients = set(User.objects.filter(id__in=patient_ids, role='PATIENT').values_list('id', flat=True))
+    created = []
+    for _ in range(BOOKING_RETRIES + 1):
+        errors, to_create = _plan_batch(parsed, known_doctors, known_patients, fields)
+        try:
+            with transaction.atomic():
+                created = Appointment.objects.bulk_create([appt for _, appt in to_create])
+            break
+        except IntegrityError:
+            # A concurrent booking took one of the planned slots; re-plan against fresh data
+            continue
+    else:
+        errors.update({i: 'Slot conflict with a concurrent booking, please retry' for i, _ in to_create})
+        to_create = []
+
+    for i, error in errors.items():
+        results[i]['error'] = error
+    for (i, _), appt in zip(to_create, created):
+        results[i].update(success=True, appointment_id=appt.id)
+    for result in results:
+        result.setdefault('success', False)
+
+    if created:
+        appointments_created.send(sender=Appointment, appointments=created)
+    return results
+
+
+def _plan_batch(parsed, known_doctors, known_patients, fields):
+    schedules = get_day_schedules((p[0], p[2]) for p in parsed.values())
+    today = timezone.localdate()
+    errors = {}
+    to_create = []
+    for i, (doctor_id, patient_id, day, t, reason) in parsed.items():
+        schedule = schedules[(doctor_id, day)]
+        if doctor_id not in known_doctors:
+            errors[i] = 'Unknown doctor'
+        elif patient_id not in known_patients:
+            errors[i] = 'Unknown patient'
+        elif not reason:
+            errors[i] = 'Reason is required'
+        elif day < today:
+            errors[i] = 'Date is in the past'
+        elif schedule.index_of(t) is None:
+            errors[i] = "Outside the doctor's working hours"
+        elif not schedule.is_free(t):
+            errors[i] = 'Slot already booked'
+        elif is_past(day, schedule.time_of(schedule.index_of(t))):
+            errors[i] = 'Time is in the past'
+        else:
+            slot_time = schedule.time_of(schedule.index_of(t))
+            # Later rows in the same batch must not reuse this slot
+            schedule.mark_busy(slot_time)
+            to_create.append((i, Appointment(
+                doctor_id=doctor_id, patient_id=patient_id,
+                appointment_date=day, appointment_time=slot_time, reason=reason, **fields,
+            )))
+    return errors, to_create
@@ -0,0 +1,77 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'mainapp_user_fts'
+
+# Used when the database has no FTS5 index (non-SQLite backends)
+FALLBACK_FIELDS = ('username', 'name', 'email', 'patientprofile__patient_id', 'patientprofile__contact_number')
+
+
+_fts_available = {}
+
+
+def fts_enabled():
+    # Looked up once per database, either way; the index is created by migration 0006
+    name = connection.settings_dict['NAME']
+    if name not in _fts_available:
+        _fts_available[name] = (
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available[name]
+
+
+def to_match_query(text):
+    """Turn free text into an FTS5 query where every word is a prefix match"""
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def matching_user_ids(text):
+    """Subquery expression selecting ids of users whose indexed fields match ``text``"""
+    return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [to_match_query(text)])
+
+
+def _fallback_q(text, prefix=''):
+    q = Q()
+    for field in FALLBACK_FIELDS:
+        q |= Q(**{f'{prefix}{field}__icontains': text})
+    return q
+
+
+def filter_by_user(queryset, text, user_field='id'):
+    """Restrict ``queryset`` to rows whose ``user_field`` points at a user matching ``text``.
+
+    ``user_field`` is the lookup from the queryset's model to the user id,
+    e.g. ``'id'`` for users, ``'user_id'`` for profiles or ``'patient_id'``
+    for appointments.
+    """
+    if not to_match_query(text):
+        return queryset
+    if fts_enabled():
+        return queryset.filter(**{f'{user_field}__in': matching_user_ids(text)})
+    prefix = '' if user_field == 'id' else user_field.removesuffix('_id') + '__'
+    return queryset.filter(_fallback_q(text, prefix))
+
+
+def search_users(text, role=None, limit=20):
+    """Best matches for ``text`` ordered by relevance (bm25)"""
+    from .models import User
+
+    match = to_match_query(text)
+    if not match:
+        return []
+    if not fts_enabled():
+        users = User.objects.filter(_fallback_q(text))
+        if role:
+            users = users.filter(role=role)
+        return list(users.order_by('name')[:limit])
+
+    role_clause = 'AND u.role = %s' if role else ''
+    params = [match] + ([role] if role else []) + [limit]
+    return list(User.objects.raw(
+        f"SELECT u.* FROM {FTS_TABLE} f JOIN mainapp_user u ON u.id = f.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s {role_clause} ORDER BY f.rank LIMIT %s",
+        params,
+    ))
@@ -0,0 +1,120 @@
+import calendar
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.dispatch import Signal
+from .models import Appointment, AppointmentSeries
+from . import scheduling
+from .transitions import bulk_transition
+
+MAX_OCCURRENCES = 52
+
+# Sent after reschedule_following moves occurrences with update(), which skips post_save.
+# Each row is a dict of id, doctor_id, patient_id, appointment_date, the new
+# appointment_time and status.
+appointments_rescheduled = Signal()
+
+
+def occurrence_dates(start, frequency, interval, count):
+    """All occurrence dates of a recurrence rule, computed arithmetically from ``start``.
+
+    Monthly dates keep the start's day of month, clamped to shorter months.
+    """
+    if frequency == 'WEEKLY':
+        step = timedelta(weeks=interval)
+        return [start + step * i for i in range(count)]
+
+    dates = []
+    for i in range(count):
+        month_index = start.month - 1 + i * interval
+        year, month = start.year + month_index // 12, month_index % 12 + 1
+        dates.append(start.replace(year=year, month=month, day=min(start.day, calendar.monthrange(year, month)[1])))
+    return dates
+
+
+def create_series(patient_id, doctor_id, start_date, appointment_time, frequency, interval, occurrences, reason):
+    """Create a series and book every occurrence that is free.
+
+    Availability for all dates is checked together and the free occurrences
+    are inserted with one ``bulk_create``. Returns ``(series, results)`` with
+    one result per occurrence date; ``series`` is ``None`` if nothing could
+    be booked.
+    """
+    dates = occurrence_dates(start_date, frequency, interval, occurrences)
+    rows = [
+        {'patient': patient_id, 'doctor': doctor_id, 'date': d.isoformat(),
+         'time': appointment_time.strftime('%H:%M'), 'reason': reason}
+        for d in dates
+    ]
+    with transaction.atomic():
+        series = AppointmentSeries.objects.create(
+            patient_id=patient_id, doctor_id=doctor_id, frequency=frequency, interval=interval,
+            start_date=start_date, appointment_time=appointment_time, occurrences=occurrences, reason=reason,
+        )
+        results = scheduling.book_batch(rows, series=series)
+        for result, d in zip(results, dates):
+            result['date'] = d.isoformat()
+        if not any(r['success'] for r in results):
+            transaction.set_rollback(True)
+            series = None
+    return series, results
+
+
+def following(series, from_date):
+    """Active occurrences of ``series`` on or after ``from_date``"""
+    return Appointment.objects.filter(series=series, appointment_date__gte=from_date).exclude(status='CANCELLED')
+
+
+def cancel_following(series, from_date):
+    return bulk_transition(following(series, from_date), 'CANCELLED')
+
+
+def reschedule_following(series, from_date, new_time=None, reason=None):
+    """Change the time and/or reason of this and all following occurrences.
+
+    All-or-nothing: if the new time is taken, outside the doctor's hours or
+    already past on any of the dates nothing is changed and the clashing
+    dates are returned. The rows are written with update(), so
+    ``appointments_rescheduled`` is sent in place of post_save.
+    """
+    occurrences = following(series, from_date).exclude(status='COMPLETED')
+    rows = list(occurrences.values('id', 'doctor_id', 'patient_id', 'appointment_date', 'appointment_time', 'status'))
+    if not rows:
+        return {'updated': [], 'conflicts': []}
+
+    moves = {}  # slot time -> ids moved there
+    if new_time is not None:
+        schedules = scheduling.get_day_schedules((row['doctor_id'], row['appointment_date']) for row in rows)
+        conflicts = []
+        for row in rows:
+            day = row['appointment_date']
+            schedule = schedules[(row['doctor_id'], day)]
+            # An occurrence's own slot does not block it from staying there
+            new_index = schedule.index_of(new_time)
+            if new_index is None or (not schedule.is_free(new_time) and new_index != schedule.index_of(row['appointment_time'])):
+                conflicts.append(day.isoformat())
+                continue
+            slot_time = schedule.time_of(new_index)
+            if scheduling.is_past(day, slot_time):
+                conflicts.append(day.isoformat())
+                continue
+            moves.setdefault(slot_time, []).append(row['id'])
+        if conflicts:
+            return {'updated': [], 'conflicts': conflicts}
+    if not moves and not reason:
+        return {'updated': [], 'conflicts': []}
+
+    ids = [row['id'] for row in rows]
+    try:
+        with transaction.atomic():
+            if reason:
+                Appointment.objects.filter(id__in=ids).update(reason=reason)
+            for slot_time, moved in moves.items():
+                Appointment.objects.filter(id__in=moved).update(appointment_time=slot_time)
+    except IntegrityError:
+        return {'updated': [], 'conflicts': ['A slot was booked concurrently, please retry']}
+
+    moved_to = {id_: slot_time for slot_time, moved in moves.items() for id_ in moved}
+    for row in rows:
+        row['appointment_time'] = moved_to.get(row['id'], row['appointment_time'])
+    appointments_rescheduled.send(sender=Appointment, rows=rows)
+    return {'updated': ids, 'conflicts': []}
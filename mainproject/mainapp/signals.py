@@ -0,0 +1,286 @@
+from functools import wraps
+from django.db import transaction
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Appointment, Department, DoctorProfile, MedicalHistory, Notification, PatientProfile, StaffProfile, TriageQueue, User
+from . import events, notifications, panels, revenue, rollups, scheduling, snapshots, triage, waittimes
+from .scheduling import appointments_created
+from .series import appointments_rescheduled
+from .transitions import appointments_transitioned
+from .triage import entry_called
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_changed(sender, instance, **kwargs):
+    scheduling.invalidate_doctor(instance.doctor_id)
+
+
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def doctor_hours_changed(sender, instance, **kwargs):
+    scheduling.invalidate_doctor(instance.user_id)
+
+
+@receiver(appointments_transitioned)
+def appointments_bulk_changed(sender, rows, target, **kwargs):
+    for doctor_id in {row['doctor_id'] for row in rows}:
+        scheduling.invalidate_doctor(doctor_id)
+    snapshots.invalidate_admin_snapshot()
+    snapshots.touch_staff_board()
+    rollups.appointments_transitioned(rows, target)
+    panels.refresh((row['doctor_id'], row['patient_id']) for row in rows)
+
+
+@receiver(appointments_created)
+def appointments_bulk_created(sender, appointments, **kwargs):
+    for doctor_id in {appt.doctor_id for appt in appointments}:
+        scheduling.invalidate_doctor(doctor_id)
+    snapshots.invalidate_admin_snapshot()
+    snapshots.touch_staff_board()
+    rollups.appointments_added(appointments)
+    panels.refresh((appt.doctor_id, appt.patient_id) for appt in appointments)
+
+
+@receiver(appointments_rescheduled)
+def appointments_bulk_rescheduled(sender, rows, **kwargs):
+    # Only times and reasons change, so DailyStats buckets and panel dates stay put
+    for doctor_id in {row['doctor_id'] for row in rows}:
+        scheduling.invalidate_doctor(doctor_id)
+    snapshots.invalidate_admin_snapshot()
+    snapshots.touch_staff_board()
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=PatientProfile)
+@receiver(post_delete, sender=PatientProfile)
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+@receiver(post_save, sender=StaffProfile)
+@receiver(post_delete, sender=StaffProfile)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def admin_figures_changed(sender, **kwargs):
+    snapshots.invalidate_admin_snapshot()
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=TriageQueue)
+@receiver(post_delete, sender=TriageQueue)
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def staff_board_changed(sender, **kwargs):
+    snapshots.touch_staff_board()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_count_changed(sender, created=True, **kwargs):
+    # Logins and profile edits save the user too; only creation/deletion changes the count
+    if created:
+        snapshots.invalidate_admin_snapshot()
+
+
+
+# DailyStats rollup
+
+def unless_paused(receiver_func):
+    @wraps(receiver_func)
+    def _receiver(*args, **kwargs):
+        if not rollups.is_paused():
+            receiver_func(*args, **kwargs)
+    return _receiver
+
+
+# Not paused with the rollups: the revenue ledger below needs the previous status on every save
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_state(sender, instance, **kwargs):
+    instance._rollup_state = instance._panel_pair = None
+    if instance.pk:
+        previous = Appointment.objects.filter(pk=instance.pk).values_list(
+            'appointment_date', 'doctor_id', 'status', 'patient_id'
+        ).first()
+        if previous:
+            instance._rollup_state = previous[:3]
+            instance._panel_pair = previous[1], previous[3]
+
+
+@receiver(post_save, sender=Appointment)
+@unless_paused
+def rollup_appointment_saved(sender, instance, created, **kwargs):
+    state = (rollups.as_date(instance.appointment_date), instance.doctor_id, instance.status)
+    previous = getattr(instance, '_rollup_state', None)
+    if created or previous is None:
+        rollups.appointment_added(*state, fee=instance.fee)
+    else:
+        rollups.appointment_changed(previous, state, fee=instance.fee)
+
+
+@receiver(post_delete, sender=Appointment)
+@unless_paused
+def rollup_appointment_deleted(sender, instance, **kwargs):
+    rollups.appointment_added(rollups.as_date(instance.appointment_date), instance.doctor_id, instance.status, -1, fee=instance.fee)
+
+
+@receiver(post_save, sender=PatientProfile)
+@unless_paused
+def rollup_patient_registered(sender, instance, created, **kwargs):
+    if created:
+        rollups.bump(timezone.localdate(instance.registered_at), new_patients=1)
+
+
+@receiver(post_delete, sender=PatientProfile)
+@unless_paused
+def rollup_patient_removed(sender, instance, **kwargs):
+    rollups.bump(timezone.localdate(instance.registered_at), new_patients=-1)
+
+
+@receiver(post_save, sender=TriageQueue)
+@unless_paused
+def rollup_triage_saved(sender, instance, created, **kwargs):
+    if created:
+        rollups.triage_added(timezone.localdate(instance.checked_in_at), instance.appointment_id)
+
+
+@receiver(post_delete, sender=TriageQueue)
+@unless_paused
+def rollup_triage_deleted(sender, instance, **kwargs):
+    rollups.triage_added(timezone.localdate(instance.checked_in_at), instance.appointment_id, -1)
+
+
+# Doctor-patient panels
+
+@receiver(post_save, sender=Appointment)
+def panel_appointment_saved(sender, instance, **kwargs):
+    pairs = {(instance.doctor_id, instance.patient_id)}
+    if getattr(instance, '_panel_pair', None):
+        pairs.add(instance._panel_pair)
+    panels.refresh(pairs)
+
+
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=MedicalHistory)
+@receiver(post_delete, sender=MedicalHistory)
+def panel_pair_changed(sender, instance, **kwargs):
+    panels.refresh([(instance.doctor_id, instance.patient_id)])
+
+
+# Revenue ledger for completions made through save() (bulk_transition charges directly)
+
+@receiver(pre_save, sender=Appointment)
+def capture_completion_fee(sender, instance, **kwargs):
+    previous = getattr(instance, '_rollup_state', None)
+    was_completed = previous is not None and previous[2] == 'COMPLETED'
+    if instance.status == 'COMPLETED' and not was_completed:
+        instance.fee = DoctorProfile.objects.filter(user_id=instance.doctor_id).values_list(
+            'consultation_fee', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Appointment)
+def ledger_appointment_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_rollup_state', None)
+    was_completed = previous is not None and previous[2] == 'COMPLETED'
+    if instance.status == 'COMPLETED' and not was_completed:
+        revenue.charge([instance.id])
+    elif was_completed and instance.status != 'COMPLETED':
+        revenue.charge([instance.id], sign=-1)
+
+
+@receiver(pre_delete, sender=Appointment)
+@unless_paused
+def ledger_appointment_deleted(sender, instance, **kwargs):
+    # The rollup drops a deleted visit's revenue; reverse its charge so the ledger, which the
+    # admin totals read, keeps agreeing with it. Paused callers reverse in bulk themselves.
+    if instance.status == 'COMPLETED':
+        revenue.charge([instance.id], sign=-1)
+
+
+# Cached unread-notification counts and recent lists
+
+@receiver(pre_save, sender=Notification)
+def remember_notification_read(sender, instance, **kwargs):
+    instance._was_unread = False
+    if not instance._state.adding:
+        instance._was_unread = Notification.objects.filter(pk=instance.pk, is_read=False).exists()
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, **kwargs):
+    delta = (not instance.is_read) - instance._was_unread
+    if delta:
+        notifications.adjust_unread(instance.user_id, delta)
+    notifications.bump_version([instance.user_id])
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        notifications.adjust_unread(instance.user_id, -1)
+    notifications.bump_version([instance.user_id])
+
+
+# Live event streams
+
+@receiver(post_save, sender=Appointment)
+def publish_appointment_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rollup_state', None)
+    if created or previous is None or previous[2] != instance.status:
+        events.publish(*events.appointment_event(instance.id, instance.doctor_id, instance.patient_id, instance.status))
+
+
+@receiver(appointments_transitioned)
+def publish_appointments_transitioned(sender, rows, target, **kwargs):
+    for row in rows:
+        events.publish(*events.appointment_event(row['id'], row['doctor_id'], row['patient_id'], target))
+
+
+@receiver(appointments_created)
+def publish_appointments_created(sender, appointments, **kwargs):
+    for appt in appointments:
+        events.publish(*events.appointment_event(appt.id, appt.doctor_id, appt.patient_id, appt.status))
+
+
+@receiver(appointments_rescheduled)
+def publish_appointments_rescheduled(sender, rows, **kwargs):
+    for row in rows:
+        events.publish(*events.appointment_event(row['id'], row['doctor_id'], row['patient_id'], row['status']))
+
+
+@receiver(post_save, sender=TriageQueue)
+def publish_triage_saved(sender, instance, **kwargs):
+    events.publish([events.TRIAGE_CHANNEL], 'triage', events.triage_event(instance))
+
+
+@receiver(post_delete, sender=TriageQueue)
+def publish_triage_deleted(sender, instance, **kwargs):
+    events.publish([events.TRIAGE_CHANNEL], 'triage', events.triage_event(instance, deleted=True))
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification(sender, instance, created, **kwargs):
+    if created:
+        events.publish([events.user_channel(instance.user_id)], 'notification', events.notification_event(instance))
+
+
+# Triage priority queue mirrors
+
+@receiver(post_save, sender=TriageQueue)
+def triage_queue_saved(sender, instance, **kwargs):
+    # After commit, so no mirror ever holds an entry that was rolled back
+    transaction.on_commit(lambda: triage.entry_saved(instance))
+
+
+@receiver(post_delete, sender=TriageQueue)
+def triage_queue_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: triage.entry_deleted(instance))
+
+
+@receiver(entry_called)
+def triage_entry_called(sender, entry, **kwargs):
+    waittimes.record(entry)
+    snapshots.touch_staff_board()
+    events.publish([events.TRIAGE_CHANNEL], 'triage', events.triage_event(entry))
@@ -0,0 +1,114 @@
+import time
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import Appointment, DailyStats, Department, DoctorProfile, PatientProfile, RevenueEntry, StaffProfile, TriageQueue, User
+
+ADMIN_SNAPSHOT_KEY = 'dashboard:admin'
+ADMIN_SNAPSHOT_TTL = 5 * 60
+STAFF_BOARD_STAMP_KEY = 'dashboard:staff:stamp'
+# Writes bump the stamp; the TTL only bounds how long a worker that did not
+# see a change itself (its cache is not shared) serves a stale board. It must
+# stay well above the dashboard's poll interval or idle boards stop returning 304
+STAFF_BOARD_STAMP_TTL = 10 * 60
+
+
+def _admin_totals():
+    # Every headline figure as a scalar subquery of one SELECT; appointment
+    # totals come from the DailyStats rollup and revenue from the ledger, the
+    # record of truth for money (deletions append reversals to keep the two equal)
+    tables = {
+        'patients': PatientProfile._meta.db_table,
+        'doctors': DoctorProfile._meta.db_table,
+        'staff': StaffProfile._meta.db_table,
+        'stats': DailyStats._meta.db_table,
+        'revenue': RevenueEntry._meta.db_table,
+        'users': User._meta.db_table,
+    }
+    sql = f"""
+        SELECT
+            (SELECT COUNT(*) FROM {tables['patients']}),
+            (SELECT COUNT(*) FROM {tables['doctors']}),
+            (SELECT COUNT(*) FROM {tables['staff']}),
+            (SELECT COALESCE(SUM(appointments), 0) FROM {tables['stats']}),
+            (SELECT COUNT(*) FROM {tables['users']}),
+            (SELECT COALESCE(SUM(amount), 0) FROM {tables['revenue']})
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        patients, doctors, staff, appointments, users, revenue = cursor.fetchone()
+    return {
+        'total_patients': patients,
+        'total_doctors': doctors,
+        'total_staff': staff,
+        'total_appointments': appointments,
+        'total_users': users,
+        'revenue': Decimal(str(revenue)).quantize(Decimal('0.01')),
+    }
+
+
+def compute_admin_snapshot():
+    snapshot = _admin_totals()
+    snapshot['departments'] = list(
+        Department.objects.annotate(doctor_count=Count('doctorprofile')).order_by('name').values('id', 'name', 'doctor_count')
+    )
+    return snapshot
+
+
+def admin_snapshot():
+    """Headline figures for the admin dashboard, cached until a counted model changes"""
+    snapshot = cache.get(ADMIN_SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = compute_admin_snapshot()
+        cache.set(ADMIN_SNAPSHOT_KEY, snapshot, ADMIN_SNAPSHOT_TTL)
+    return snapshot
+
+
+def invalidate_admin_snapshot():
+    cache.delete(ADMIN_SNAPSHOT_KEY)
+
+
+def staff_board_stamp():
+    """Time of the last change to anything on the staff dashboard.
+
+    Only writes move the stamp. It still expires after
+    ``STAFF_BOARD_STAMP_TTL`` seconds, so changes handled by another worker
+    show up within that time even when the cache is per process.
+    """
+    stamp = cache.get(STAFF_BOARD_STAMP_KEY)
+    if stamp is None:
+        stamp = time.time()
+        cache.add(STAFF_BOARD_STAMP_KEY, stamp, STAFF_BOARD_STAMP_TTL)
+        stamp = cache.get(STAFF_BOARD_STAMP_KEY, stamp)
+    return stamp
+
+
+def touch_staff_board():
+    cache.set(STAFF_BOARD_STAMP_KEY, time.time(), STAFF_BOARD_STAMP_TTL)
+
+
+def staff_board(day=None):
+    """Counters and appointment queue shown on the staff dashboard"""
+    day = day or timezone.localdate()
+    appointments = Appointment.objects.filter(appointment_date=day).select_related(
+        'patient', 'doctor'
+    ).prefetch_related('triagequeue_set').order_by('appointment_time')
+    queue = [{
+        'id': appt.id,
+        'time': appt.appointment_time.strftime('%H:%M'),
+        'status': appt.status,
+        'patient': {'id': appt.patient.id, 'name': appt.patient.get_full_name()},
+        'doctor': {'id': appt.doctor.id, 'name': appt.doctor.get_full_name()},
+        'triaged': bool(appt.triagequeue_set.all()),
+    } for appt in appointments]
+    return {
+        'date': day.isoformat(),
+        'appointments_today_count': len(queue),
+        'patients_waiting_count': TriageQueue.objects.filter(is_processed=False).count(),
+        'doctors_on_duty_count': DoctorProfile.objects.filter(is_available=True).count(),
+        # All-time, like the PENDING count it replaced: every date's bucket is summed
+        'pending_requests_count': DailyStats.objects.aggregate(n=Sum('pending'))['n'] or 0,
+        'queue': queue,
+    }
@@ -1,6 +1,7 @@
 from django import template
+from django.template.loader import render_to_string
 from django.utils.safestring import mark_safe
-from ..models import Notification
+from .. import notifications
 
 register = template.Library()
 
@@ -35,8 +36,12 @@ def priority_badge(priority):
     color = badges.get(priority, 'secondary')
     return mark_safe(f'<span class="badge bg-{color}">{priority}</span>')
 
-@register.inclusion_tag('partials/notification_dropdown.html')
+@register.simple_tag
 def notification_dropdown(user):
-    """Render notification dropdown"""
-    notifications = Notification.objects.filter(user=user, is_read=False)[:5]
-    return {'notifications': notifications}
\ No newline at end of file
+    """Render notification dropdown, reusing the cached fragment until the user's notifications change"""
+    def render():
+        return render_to_string('partials/notification_dropdown.html', {
+            'notifications': notifications.recent_unread(user.id),
+            'unread_count': notifications.unread_count(user.id),
+        })
+    return mark_safe(notifications.dropdown_fragment(user.id, render))
\ No newline at end of file
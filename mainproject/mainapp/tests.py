@@ -1,3 +1,1644 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import io
+import json
+import random
+import re
+import tempfile
+import threading
+import time as clock
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from unittest import mock
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import ConnectionDoesNotExist
+from django.db.models import Count, Max, Min, Sum
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from .models import *
+from . import columnar, events, exports, notifications, reports, revenue, rollups, scheduling, search, snapshots, triage, views, waittimes
+from . import series as series_ops
+from .pagination import encode_cursor
+from .querybudget import QueryBudgetExceeded, QueryRecorder, budget_for
+from .transitions import bulk_transition
+from .urls import urlpatterns
 
-# Create your tests here.
+
+class ConcurrentBookingTests(TransactionTestCase):
+    THREADS = 16
+    ATTEMPTS_PER_THREAD = 150
+
+    def setUp(self):
+        department = Department.objects.create(name='Outpatients')
+        self.doctors = []
+        for i in range(4):
+            doctor = User.objects.create(username=f'doc{i}', email=f'doc{i}@example.com', name=f'Doctor {i}', role='DOCTOR')
+            DoctorProfile.objects.create(
+                user=doctor, department=department, specialty='General', qualification='MBBS',
+                available_from=time(8, 0), available_to=time(18, 0),
+            )
+            self.doctors.append(doctor.id)
+        self.patients = [
+            User.objects.create(username=f'pat{i}', email=f'pat{i}@example.com', name=f'Patient {i}', role='PATIENT').id
+            for i in range(50)
+        ]
+        self.days = [date.today() + timedelta(days=d) for d in range(1, 6)]
+
+    def _worker(self, seed, outcomes):
+        rng = random.Random(seed)
+        try:
+            for _ in range(self.ATTEMPTS_PER_THREAD):
+                appointment, _ = scheduling.book_slot(
+                    rng.choice(self.patients), rng.choice(self.doctors), rng.choice(self.days),
+                    time(rng.randint(8, 17), rng.choice((0, 30))), 'Stress test',
+                )
+                outcomes.append(appointment is not None)
+        finally:
+            connection.close()
+
+    def test_simultaneous_bookings_never_double_book(self):
+        outcomes = []
+        threads = [threading.Thread(target=self._worker, args=(n, outcomes)) for n in range(self.THREADS)]
+        started = clock.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = clock.monotonic() - started
+
+        attempts = self.THREADS * self.ATTEMPTS_PER_THREAD
+        self.assertEqual(len(outcomes), attempts)
+        duplicates = (
+            Appointment.objects.exclude(status='CANCELLED')
+            .values('doctor_id', 'appointment_date', 'appointment_time')
+            .annotate(n=Count('id')).filter(n__gt=1)
+        )
+        self.assertFalse(duplicates.exists())
+        # Every successful booking is a distinct row, and no slot was given out twice
+        self.assertEqual(Appointment.objects.count(), sum(outcomes))
+        self.assertLessEqual(sum(outcomes), len(self.doctors) * len(self.days) * 20)
+        self.assertGreater(attempts / elapsed, 100, f'{attempts} bookings took {elapsed:.1f}s')
+
+
+def seed_hospital():
+    """A small but realistic hospital: several of everything, so per-row queries show up"""
+    today = date.today()
+    departments = [Department.objects.create(name=name) for name in ('Cardiology', 'Neurology', 'Pediatrics')]
+    admin = User.objects.create(username='admin', email='admin@example.com', name='Admin', role='ADMIN')
+    staff = User.objects.create(username='staff', email='staff@example.com', name='Front Desk', role='STAFF')
+    StaffProfile.objects.create(user=staff, department=departments[0], position='Reception')
+
+    doctors = []
+    for i in range(6):
+        doctor = User.objects.create(username=f'doctor{i}', email=f'doctor{i}@example.com', name=f'Doctor {i}', role='DOCTOR')
+        DoctorProfile.objects.create(
+            user=doctor, department=departments[i % 3], specialty='General', qualification='MBBS',
+            consultation_fee=100 + i * 10, available_from=time(8, 0), available_to=time(18, 0),
+        )
+        doctors.append(doctor)
+
+    patients = []
+    for i in range(30):
+        patient = User.objects.create(username=f'patient{i}', email=f'patient{i}@example.com', name=f'Patient {i}', role='PATIENT')
+        PatientProfile.objects.create(user=patient, age=20 + i, gender='Female', contact_number=f'555{i:04d}')
+        patients.append(patient)
+
+    statuses = ['PENDING', 'CONFIRMED', 'COMPLETED', 'CANCELLED']
+    for i, patient in enumerate(patients):
+        for offset in (-14, -7, 0, 7):
+            doctor = doctors[(i + offset) % len(doctors)]
+            appointment = Appointment.objects.create(
+                patient=patient, doctor=doctor, appointment_date=today + timedelta(days=offset),
+                appointment_time=time(8 + i % 10, 30 if offset % 2 else 0),
+                status=statuses[(i + offset) % 4] if offset else 'CONFIRMED', reason='Checkup',
+            )
+            if offset == 0:
+                TriageQueue.objects.create(patient=patient, appointment=appointment, priority_level='HIGH' if i % 5 == 0 else 'MEDIUM')
+            if offset < 0:
+                record = MedicalHistory.objects.create(
+                    patient=patient, doctor=doctor, appointment=appointment, diagnosis='Flu', treatment='Rest'
+                )
+                for name in ('Paracetamol', 'Ibuprofen'):
+                    Prescription.objects.create(medical_history=record, medication_name=name, dosage='1', frequency='2x', duration='5d')
+
+    for user in [admin, staff] + doctors + patients:
+        for n in range(8):
+            Notification.objects.create(user=user, title=f'Notice {n}', message='Hello', is_read=n % 2 == 0)
+
+    series = AppointmentSeries.objects.create(
+        patient=patients[0], doctor=doctors[0], start_date=today + timedelta(days=21),
+        appointment_time=time(17, 0), occurrences=3, reason='Follow up',
+    )
+    Appointment.objects.create(
+        patient=patients[0], doctor=doctors[0], appointment_date=today + timedelta(days=21),
+        appointment_time=time(17, 0), reason='Follow up', series=series,
+    )
+    return {'admin': admin, 'staff': staff, 'doctor': doctors[0], 'doctors': doctors,
+            'patient': patients[0], 'patients': patients, 'series': series}
+
+
+def _book_rows(data):
+    day = (date.today() + timedelta(days=30)).isoformat()
+    return json.dumps({'appointments': [
+        {'patient': p.id, 'doctor': data['doctors'][1].id, 'date': day, 'time': f'{9 + n}:00', 'reason': 'Camp'}
+        for n, p in enumerate(data['patients'][:5])
+    ]})
+
+
+# url pattern -> (role to log in as, method, url kwargs, request data) used by the budget tests
+URL_CASES = {
+    '': (None, 'get', {}, None),
+    'dashboard/': ('PATIENT', 'get', {}, None),
+    'login/': (None, 'get', {}, None),
+    'login/<str:role>/': (None, 'get', {'role': 'doctor'}, None),
+    'logout/': ('PATIENT', 'get', {}, None),
+    'register/': (None, 'get', {}, None),
+    'hospital-admin/dashboard/': ('ADMIN', 'get', {}, None),
+    'doctor/dashboard/': ('DOCTOR', 'get', {}, None),
+    'doctor/profile/': ('DOCTOR', 'get', {}, None),
+    'profile/security/': ('PATIENT', 'get', {}, None),
+    'staff/dashboard/': ('STAFF', 'get', {}, None),
+    'staff/dashboard/data/': ('STAFF', 'get', {}, None),
+    'staff/profile/': ('STAFF', 'get', {}, None),
+    'patient/dashboard/': ('PATIENT', 'get', {}, None),
+    'patient/timeline/': ('DOCTOR', 'get', {}, 'timeline_query'),
+    'appointments/': ('STAFF', 'get', {}, None),
+    'appointments/json/': ('STAFF', 'get', {}, None),
+    'appointments/complete/<int:appt_id>/': ('DOCTOR', 'post', {'appt_id': 'doctor_appointment'}, {}),
+    'appointments/status/': ('DOCTOR', 'post', {}, 'doctor_appointment_ids'),
+    'book-appointment/': ('STAFF', 'get', {}, None),
+    'appointments/bulk/': ('STAFF', 'post', {}, _book_rows),
+    'appointments/series/<int:series_id>/following/': ('PATIENT', 'post', {'series_id': 'series'}, 'series_cancel'),
+    'appointments/slots/': ('PATIENT', 'get', {}, 'slots_query'),
+    'patients/': ('DOCTOR', 'get', {}, None),
+    'patients/search/': ('STAFF', 'get', {}, {'q': 'pat'}),
+    'patients/create-guest/': ('STAFF', 'post', {}, {'name': 'Walk In', 'age': '40', 'gender': 'Male', 'contact_number': '123'}),
+    'patient/<int:patient_id>/': ('DOCTOR', 'get', {'patient_id': 'patient'}, None),
+    'patient/<int:patient_id>/add-record/': ('DOCTOR', 'post', {'patient_id': 'patient'}, {'diagnosis': 'Cold', 'treatment': 'Tea', 'notes': 'Sore throat'}),
+    'prescription/<int:record_id>/add/': ('DOCTOR', 'get', {'record_id': 'record'}, None),
+    'doctors/': ('ADMIN', 'get', {}, None),
+    'delete-doctor/<int:doctor_id>/': ('ADMIN', 'get', {'doctor_id': 'doctor'}, None),
+    'triage/': ('STAFF', 'get', {}, None),
+    'triage/<int:patient_id>/': ('STAFF', 'get', {'patient_id': 'patient'}, None),
+    'triage/call-next/': ('STAFF', 'post', {}, {}),
+    'triage/wait/': ('PATIENT', 'get', {}, None),
+    'notifications/': ('PATIENT', 'get', {}, None),
+    'events/': ('PATIENT', 'get', {}, None),
+    'notifications/read-all/': ('PATIENT', 'post', {}, {}),
+    'notifications/send/': ('STAFF', 'post', {}, {'audience': 'tomorrow', 'title': 'Reminder', 'message': 'See you tomorrow'}),
+    'reports/': ('DOCTOR', 'get', {}, None),
+    'exports/<str:kind>/': ('ADMIN', 'get', {'kind': 'appointments'}, {'gzip': '1'}),
+    'admin/add-doctor/': ('ADMIN', 'get', {}, None),
+    'admin/add-staff/': ('ADMIN', 'get', {}, None),
+    'admin/add-patient/': ('ADMIN', 'get', {}, None),
+}
+
+
+class SlotAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.doctor = cls.data['doctors'][1]
+        cls.day = date.today() + timedelta(days=40)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_booking_elsewhere_shows_up_once_the_map_expires(self):
+        with mock.patch.object(scheduling, 'SLOT_CACHE_TIMEOUT', 1):
+            self.assertTrue(scheduling.is_slot_available(self.doctor.id, self.day, time(9, 0)))
+            # Another worker booked it; its invalidation never reached this process's cache
+            Appointment.objects.bulk_create([Appointment(
+                patient=self.data['patient'], doctor=self.doctor, appointment_date=self.day,
+                appointment_time=time(9, 0), reason='Elsewhere',
+            )])
+            self.assertTrue(scheduling.is_slot_available(self.doctor.id, self.day, time(9, 0)))
+            clock.sleep(1.1)
+        self.assertFalse(scheduling.is_slot_available(self.doctor.id, self.day, time(9, 0)))
+
+    def test_map_follows_bookings_cancellations_and_hours(self):
+        doctor, patient = self.doctor, self.data['patient']
+        self.assertEqual(len(scheduling.get_day_schedule(doctor.id, self.day).free_slots()), 20)
+        with self.assertNumQueries(0):
+            scheduling.get_day_schedule(doctor.id, self.day)
+
+        # A time inside a slot books the slot's start
+        appointment, _ = scheduling.book_slot(patient.id, doctor.id, self.day, time(9, 10), 'Checkup')
+        self.assertEqual(appointment.appointment_time, time(9, 0))
+        self.assertFalse(scheduling.is_slot_available(doctor.id, self.day, time(9, 20)))
+        taken, suggestions = scheduling.book_slot(patient.id, doctor.id, self.day, time(9, 0), 'Again')
+        self.assertIsNone(taken)
+        self.assertEqual(suggestions[0], datetime.combine(self.day, time(8, 0)))
+        retried, _ = scheduling.book_slot(patient.id, doctor.id, self.day, time(9, 0), 'Again', retries=1)
+        self.assertEqual(retried.appointment_time, time(8, 0))
+
+        appointment.status = 'CANCELLED'
+        appointment.save()
+        self.assertTrue(scheduling.is_slot_available(doctor.id, self.day, time(9, 0)))
+        bulk_transition(Appointment.objects.filter(id=retried.id), 'CANCELLED')
+        self.assertTrue(scheduling.is_slot_available(doctor.id, self.day, time(8, 0)))
+
+        profile = doctor.doctorprofile
+        profile.available_from = time(10, 0)
+        profile.save()
+        self.assertFalse(scheduling.is_slot_available(doctor.id, self.day, time(9, 0)))
+        self.assertEqual(scheduling.next_free_slots(doctor.id, self.day, 1), [datetime.combine(self.day, time(10, 0))])
+
+    def test_slots_earlier_today_cannot_be_booked(self):
+        noon = timezone.make_aware(datetime.combine(self.day, time(12, 0)))
+        patient = self.data['patient']
+        with mock.patch('django.utils.timezone.localtime', return_value=noon):
+            appointment, suggestions = scheduling.book_slot(patient.id, self.doctor.id, self.day, time(9, 0), 'Late')
+            self.assertIsNone(appointment)
+            self.assertTrue(all(s > datetime.combine(self.day, time(12, 0)) for s in suggestions))
+            results = scheduling.book_batch([
+                {'doctor': self.doctor.id, 'patient': patient.id, 'date': self.day.isoformat(), 'time': '11:30', 'reason': 'Late'},
+                {'doctor': self.doctor.id, 'patient': patient.id, 'date': self.day.isoformat(), 'time': '12:30', 'reason': 'Later'},
+            ])
+        self.assertEqual(results[0]['error'], 'Time is in the past')
+        self.assertTrue(results[1]['success'])
+
+    def test_bad_doctor_id_is_a_bad_request(self):
+        self.client.force_login(self.data['patient'])
+        self.assertEqual(self.client.get(reverse('doctor_slots'), {'doctor': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('doctor_slots'), {'doctor': self.data['patient'].id}).status_code, 404)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def setUp(self):
+        self.client.force_login(self.data['staff'])
+
+    def test_pages_walk_the_list_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            body = self.client.get(reverse('appointment_list_json'), {'cursor': cursor} if cursor else {}).json()
+            seen += [row['id'] for row in body['results']]
+            if not (cursor := body['next_cursor']):
+                break
+        expected = Appointment.objects.order_by('-appointment_date', '-appointment_time', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_tampered_cursor_falls_back_to_the_first_page(self):
+        first = self.client.get(reverse('appointment_list_json')).json()
+        for values in (['x', 'y', 'z'], ['2026-01-01', '10:00', 'abc'], [[1], {}, None], ['2026-01-01', '10:00']):
+            response = self.client.get(reverse('appointment_list_json'), {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 200, values)
+            self.assertEqual(response.json()['results'], first['results'])
+        self.assertEqual(self.client.get(reverse('appointment_list'), {'cursor': encode_cursor(['x', 'y', 'z'])}).status_code, 200)
+
+
+class ExplainAppointmentsTests(TestCase):
+    def test_seeded_slots_respect_the_booking_constraint(self):
+        out = io.StringIO()
+        # 1000 of 1200 slots: random draws with replacement would collide
+        users = User.objects.count()
+        call_command('explain_appointments', appointments=1000, doctors=5, patients=20, days=15, stdout=out)
+        self.assertIn('Seeded 1000 appointments', out.getvalue())
+        # Everything went into the scratch database, which is gone afterwards
+        self.assertFalse(Appointment.objects.filter(reason='Benchmark').exists())
+        self.assertEqual(User.objects.count(), users)
+        with self.assertRaises(ConnectionDoesNotExist):
+            connections['explain_scratch']
+
+    def test_more_appointments_than_slots_is_an_error(self):
+        with self.assertRaises(CommandError):
+            call_command('explain_appointments', appointments=500, doctors=2, patients=5, days=10, stdout=io.StringIO())
+
+
+    def test_index_scans_count_only_for_the_allowed_index(self):
+        from .management.commands.explain_appointments import Command
+        is_table_scan = Command().is_table_scan
+        self.assertTrue(is_table_scan('SCAN mainapp_appointment'))
+        self.assertTrue(is_table_scan('SCAN mainapp_appointment USING INDEX appt_status_date_idx'))
+        self.assertTrue(is_table_scan('SCAN mainapp_appointment USING COVERING INDEX appt_doctor_status_idx'))
+        self.assertFalse(is_table_scan('SCAN mainapp_appointment USING INDEX appt_date_time_idx', ('appt_date_time_idx',)))
+        self.assertFalse(is_table_scan('SEARCH mainapp_appointment USING INDEX appt_patient_date_idx (patient_id=?)'))
+        self.assertFalse(is_table_scan('SCAN mainapp_user'))
+
+
+class PatientSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def found(self, text):
+        return [u.id for u in search.search_users(text, role='PATIENT')]
+
+    def test_index_follows_user_and_profile_writes(self):
+        patient = self.data['patients'][3]
+        patient.name = 'Zebulon Quist'
+        patient.save()
+        self.assertEqual(self.found('zebu qui'), [patient.id])
+        # Queryset updates bypass signals; the triggers still see them
+        User.objects.filter(id=patient.id).update(name='Ophelia Marsh')
+        self.assertEqual(self.found('zebu'), [])
+        self.assertEqual(self.found('ophel'), [patient.id])
+
+        profile = patient.patientprofile
+        PatientProfile.objects.filter(id=profile.id).update(contact_number='7779911')
+        self.assertEqual(self.found('7779911'), [patient.id])
+        self.assertEqual(self.found(profile.patient_id), [patient.id])
+        profile.delete()
+        self.assertEqual(self.found(profile.patient_id), [])
+        patient.delete()
+        self.assertEqual(self.found('ophel'), [])
+
+    def test_filter_matches_the_fallback(self):
+        appointments = Appointment.objects.all()
+        with_fts = set(search.filter_by_user(appointments, 'Patient 1', 'patient_id').values_list('id', flat=True))
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            fallback = set(search.filter_by_user(appointments, 'Patient 1', 'patient_id').values_list('id', flat=True))
+        self.assertTrue(with_fts)
+        self.assertEqual(with_fts, fallback)
+
+    def test_missing_index_is_looked_up_once(self):
+        self.addCleanup(search._fts_available.clear)
+        search._fts_available.clear()
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]) as table_names:
+            self.assertFalse(search.fts_enabled())
+            self.assertFalse(search.fts_enabled())
+        self.assertEqual(table_names.call_count, 1)
+
+
+class BulkBookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.day = date.today() + timedelta(days=45)
+
+    def row(self, time_str, doctor=None, patient=None, **extra):
+        return {'doctor': (doctor or self.data['doctors'][2]).id, 'patient': (patient or self.data['patient']).id,
+                'date': self.day.isoformat(), 'time': time_str, 'reason': 'Camp', **extra}
+
+    def test_each_row_is_validated_against_the_tables_and_the_batch(self):
+        doctor = self.data['doctors'][2]
+        Appointment.objects.create(patient=self.data['patient'], doctor=doctor, appointment_date=self.day,
+                                   appointment_time=time(10, 0), reason='Existing')
+        results = scheduling.book_batch([
+            self.row('09:00'),
+            self.row('09:15'),  # the same slot as the row above
+            self.row('10:00'),
+            self.row('07:00'),
+            self.row('11:00', doctor=self.data['patient']),
+            self.row('11:00', patient=doctor),
+            self.row('11:00', reason=''),
+            self.row('11:00', date=(date.today() - timedelta(days=1)).isoformat()),
+            self.row('eleven'),
+            {**self.row('11:00'), 'doctor': 'x'},
+            self.row('11:00'),
+        ])
+        self.assertEqual([r.get('error') for r in results], [
+            None, 'Slot already booked', 'Slot already booked', "Outside the doctor's working hours",
+            'Unknown doctor', 'Unknown patient', 'Reason is required', 'Date is in the past',
+            'Invalid date or time', 'doctor and patient must be user ids', None,
+        ])
+        booked = Appointment.objects.filter(id__in=[r['appointment_id'] for r in results if r['success']])
+        self.assertEqual(sorted(booked.values_list('appointment_time', flat=True)), [time(9, 0), time(11, 0)])
+
+    def test_slot_taken_between_planning_and_insert_is_replanned(self):
+        doctor, patient = self.data['doctors'][2], self.data['patients'][1]
+        plan = scheduling._plan_batch
+
+        def plan_then_lose_a_slot(*args):
+            planned = plan(*args)
+            if not Appointment.objects.filter(reason='Concurrent').exists():
+                Appointment.objects.create(patient=patient, doctor=doctor, appointment_date=self.day,
+                                           appointment_time=time(9, 0), reason='Concurrent')
+            return planned
+
+        with mock.patch.object(scheduling, '_plan_batch', side_effect=plan_then_lose_a_slot) as planner:
+            results = scheduling.book_batch([self.row('09:00'), self.row('09:30')])
+        self.assertEqual(planner.call_count, 2)
+        self.assertEqual(results[0]['error'], 'Slot already booked')
+        self.assertTrue(results[1]['success'])
+
+    def test_csv_upload(self):
+        rows = [self.row('13:00'), self.row('13:30', patient=self.data['patients'][1])]
+        body = 'doctor,patient,date,time,reason\n' + ''.join(
+            f"{r['doctor']},{r['patient']},{r['date']},{r['time']},{r['reason']}\n" for r in rows
+        )
+        self.client.force_login(self.data['staff'])
+        response = self.client.post(reverse('bulk_book_appointments'), body, content_type='text/csv')
+        self.assertEqual(response.json()['booked'], 2)
+        self.assertEqual(self.client.post(reverse('bulk_book_appointments'), '{', content_type='application/json').status_code, 400)
+
+
+class DoubleBookingMigrationTests(TransactionTestCase):
+    before = [('mainapp', '0006_user_search_fts')]
+    after = [('mainapp', '0007_unique_active_doctor_slot')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.executor.loader.build_graph()
+        self.addCleanup(self.migrate_to_latest)
+        apps = self.executor.loader.project_state(self.before).apps
+        self.Appointment = apps.get_model('mainapp', 'Appointment')
+        User = apps.get_model('mainapp', 'User')
+        self.doctor = User.objects.create(username='doc', email='doc@example.com', name='Doc', role='DOCTOR')
+        self.patient = User.objects.create(username='pat', email='pat@example.com', name='Pat', role='PATIENT')
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def book(self, status, hour=9):
+        return self.Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=date(2026, 3, 2),
+            appointment_time=time(hour, 0), status=status, reason='Checkup',
+        ).id
+
+    def statuses(self, ids):
+        return list(self.Appointment.objects.filter(id__in=ids).order_by('id').values_list('status', flat=True))
+
+    def test_completed_visits_survive_and_cancellations_are_reversible(self):
+        ids = [self.book('PENDING'), self.book('COMPLETED'), self.book('CONFIRMED')]
+        others = [self.book('CONFIRMED', 10), self.book('PENDING', 10)]
+        self.executor.migrate(self.after)
+        self.assertEqual(self.statuses(ids), ['CANCELLED', 'COMPLETED', 'CANCELLED'])
+        self.assertEqual(self.statuses(others), ['CONFIRMED', 'CANCELLED'])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.assertEqual(self.statuses(ids), ['PENDING', 'COMPLETED', 'CONFIRMED'])
+        self.assertEqual(self.statuses(others), ['CONFIRMED', 'PENDING'])
+        self.assertFalse(self.Appointment.objects.exclude(notes='').exists())
+
+    def test_two_completed_visits_in_one_slot_stop_the_migration(self):
+        ids = [self.book('COMPLETED'), self.book('COMPLETED')]
+        with self.assertRaisesMessage(RuntimeError, 'Resolve the double booking by hand'):
+            self.executor.migrate(self.after)
+        self.assertEqual(self.statuses(ids), ['COMPLETED', 'COMPLETED'])
+        self.Appointment.objects.filter(id__in=ids).delete()
+
+
+class AppointmentTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def test_only_allowed_moves_are_applied(self):
+        doctor = self.data['doctor']
+        appointments = Appointment.objects.filter(doctor=doctor)
+        before = dict(appointments.values_list('id', 'status'))
+        result = bulk_transition(appointments, 'CONFIRMED')
+        self.assertEqual(sorted(result['updated']), sorted(i for i, status in before.items() if status == 'PENDING'))
+        self.assertEqual({row['status'] for row in result['skipped']}, {'CONFIRMED', 'COMPLETED', 'CANCELLED'} & set(before.values()))
+        after = dict(appointments.values_list('id', 'status'))
+        for appt_id, status in before.items():
+            self.assertEqual(after[appt_id], 'CONFIRMED' if status == 'PENDING' else status)
+        with self.assertRaises(ValueError):
+            bulk_transition(appointments, 'LOST')
+
+    def test_doctors_can_only_move_their_own(self):
+        mine = Appointment.objects.filter(doctor=self.data['doctor'], status='CONFIRMED').first()
+        theirs = Appointment.objects.filter(status='CONFIRMED').exclude(doctor=self.data['doctor']).first()
+        self.client.force_login(self.data['doctor'])
+        body = self.client.post(reverse('bulk_appointment_status'), {'ids': f'{mine.id},{theirs.id}', 'status': 'CANCELLED'},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(body['updated'], [mine.id])
+        self.assertEqual(body['skipped'], [{'id': theirs.id, 'error': 'Not found'}])
+        self.assertEqual(Appointment.objects.get(id=theirs.id).status, 'CONFIRMED')
+
+    def test_command_expires_old_pending_appointments(self):
+        stale = Appointment.objects.filter(status='PENDING', appointment_date__lt=date.today() - timedelta(days=3))
+        stale_ids = set(stale.values_list('id', flat=True))
+        self.assertTrue(stale_ids)
+        out = io.StringIO()
+        call_command('transition_appointments', expire_pending=3, dry_run=True, stdout=out)
+        self.assertIn(f'{len(stale_ids)} appointment(s) would move to CANCELLED', out.getvalue())
+        call_command('transition_appointments', expire_pending=3, stdout=io.StringIO())
+        self.assertEqual(set(Appointment.objects.filter(id__in=stale_ids, status='CANCELLED').values_list('id', flat=True)), stale_ids)
+        with self.assertRaises(CommandError):
+            call_command('transition_appointments', target='CANCELLED', stdout=io.StringIO())
+
+    def test_command_rejects_an_invalid_date(self):
+        with self.assertRaisesMessage(CommandError, '--date'):
+            call_command('transition_appointments', '--to', 'CANCELLED', '--date', '2026-02-30', stdout=io.StringIO())
+        day = Appointment.objects.filter(status='PENDING').values_list('appointment_date', flat=True).first()
+        out = io.StringIO()
+        call_command('transition_appointments', '--to', 'CANCELLED', '--date', day.isoformat(), '--dry-run', stdout=out)
+        count = Appointment.objects.filter(appointment_date=day, status__in=('PENDING', 'CONFIRMED')).count()
+        self.assertIn(f'{count} appointment(s) would move to CANCELLED', out.getvalue())
+
+
+class AppointmentSeriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.doctor = cls.data['doctors'][3]
+        cls.start = date.today() + timedelta(days=50)
+
+    def create(self, occurrences=4, at=time(10, 0), patient=None):
+        return series_ops.create_series((patient or self.data['patient']).id, self.doctor.id, self.start, at,
+                                        'WEEKLY', 1, occurrences, 'Physio')
+
+    def test_occurrence_dates(self):
+        self.assertEqual(series_ops.occurrence_dates(date(2027, 1, 31), 'MONTHLY', 1, 4),
+                         [date(2027, 1, 31), date(2027, 2, 28), date(2027, 3, 31), date(2027, 4, 30)])
+        self.assertEqual(series_ops.occurrence_dates(date(2027, 11, 15), 'MONTHLY', 3, 2), [date(2027, 11, 15), date(2028, 2, 15)])
+        self.assertEqual(series_ops.occurrence_dates(date(2027, 1, 1), 'WEEKLY', 2, 3), [date(2027, 1, 1), date(2027, 1, 15), date(2027, 1, 29)])
+
+    def test_taken_dates_are_skipped_and_an_empty_series_is_not_kept(self):
+        Appointment.objects.create(patient=self.data['patients'][1], doctor=self.doctor,
+                                   appointment_date=self.start + timedelta(weeks=1), appointment_time=time(10, 0), reason='Taken')
+        series, results = self.create()
+        self.assertEqual([r['success'] for r in results], [True, False, True, True])
+        self.assertEqual(series.appointments.count(), 3)
+
+        count = AppointmentSeries.objects.count()
+        series, results = self.create(occurrences=2, patient=self.data['patients'][2])
+        self.assertIsNone(series)
+        self.assertEqual(AppointmentSeries.objects.count(), count)
+
+    def test_cancel_and_reschedule_following(self):
+        series, _ = self.create()
+        third = self.start + timedelta(weeks=2)
+        Appointment.objects.create(patient=self.data['patients'][1], doctor=self.doctor,
+                                   appointment_date=self.start + timedelta(weeks=3), appointment_time=time(14, 0), reason='Taken')
+
+        result = series_ops.reschedule_following(series, self.start + timedelta(weeks=1), time(14, 0))
+        self.assertEqual(result['conflicts'], [(self.start + timedelta(weeks=3)).isoformat()])
+        self.assertEqual(set(series.appointments.values_list('appointment_time', flat=True)), {time(10, 0)})
+
+        result = series_ops.reschedule_following(series, self.start + timedelta(weeks=1), time(15, 10), 'Longer sessions')
+        self.assertEqual(len(result['updated']), 3)
+        self.assertEqual(series.appointments.get(appointment_date=self.start).appointment_time, time(10, 0))
+        self.assertEqual(set(series.appointments.filter(appointment_date__gt=self.start).values_list('appointment_time', 'reason')),
+                         {(time(15, 0), 'Longer sessions')})
+        self.assertFalse(scheduling.is_slot_available(self.doctor.id, third, time(15, 0)))
+
+        series_ops.cancel_following(series, third)
+        self.assertEqual(list(series.appointments.exclude(status='CANCELLED').values_list('appointment_date', flat=True).order_by('appointment_date')),
+                         [self.start, self.start + timedelta(weeks=1)])
+        self.assertTrue(scheduling.is_slot_available(self.doctor.id, third, time(15, 0)))
+
+    def test_reschedule_following_rejects_past_slots_and_notifies_listeners(self):
+        series, _ = self.create()
+        ids = set(series.appointments.values_list('id', flat=True))
+        noon = timezone.make_aware(datetime.combine(self.start, time(12, 0)))
+        with mock.patch('django.utils.timezone.localtime', return_value=noon):
+            result = series_ops.reschedule_following(series, self.start, time(11, 0))
+        self.assertEqual(result['conflicts'], [self.start.isoformat()])
+        self.assertEqual(set(series.appointments.values_list('appointment_time', flat=True)), {time(10, 0)})
+
+        scheduling.get_day_schedule(self.doctor.id, self.start)
+        stamp = snapshots.staff_board_stamp()
+        published = []
+        relay, events.hub.relay = events.hub.relay, lambda channels, event: published.append(event)
+        self.addCleanup(setattr, events.hub, 'relay', relay)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = series_ops.reschedule_following(series, self.start, time(14, 0))
+        self.assertEqual(set(result['updated']), ids)
+        self.assertFalse(scheduling.is_slot_available(self.doctor.id, self.start, time(14, 0)))
+        self.assertTrue(scheduling.is_slot_available(self.doctor.id, self.start, time(10, 0)))
+        self.assertNotEqual(snapshots.staff_board_stamp(), stamp)
+        self.assertEqual({data['id'] for _, kind, data in published if kind == 'appointment'}, ids)
+
+    def test_only_the_series_patient_or_doctor_may_change_it(self):
+        series, _ = self.create()
+        self.client.force_login(self.data['patients'][1])
+        response = self.client.post(reverse('series_following', args=[series.id]), {'from_date': self.start.isoformat(), 'action': 'cancel'})
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(self.doctor)
+        response = self.client.post(reverse('series_following', args=[series.id]), {'from_date': self.start.isoformat(), 'action': 'cancel'})
+        self.assertEqual(len(response.json()['cancelled']), 4)
+
+
+class MaintenanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return HttpResponse(status=503)
+
+
+class QueryBudgetTests(TestCase):
+    """Every mainapp URL must stay within the query budget its view declares"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def resolve_value(self, value):
+        data = self.data
+        doctor_appointments = Appointment.objects.filter(doctor=data['doctor']).exclude(status__in=['COMPLETED', 'CANCELLED'])
+        lookups = {
+            'doctor': lambda: data['doctor'].id,
+            'patient': lambda: data['patient'].id,
+            'series': lambda: data['series'].id,
+            'record': lambda: MedicalHistory.objects.first().id,
+            'doctor_appointment': lambda: doctor_appointments.first().id,
+            'doctor_appointment_ids': lambda: {'ids': [a.id for a in doctor_appointments], 'status': 'COMPLETED'},
+            'series_cancel': lambda: {'from_date': date.today().isoformat(), 'action': 'cancel'},
+            'slots_query': lambda: {'doctor': data['doctor'].id, 'n': 10},
+            'timeline_query': lambda: {'patient': data['patient'].id, 'page_size': 5},
+        }
+        if callable(value):
+            return value(data)
+        if isinstance(value, str) and value in lookups:
+            return lookups[value]()
+        return value
+
+    def request(self, pattern):
+        role, method, kwargs, payload = URL_CASES[pattern]
+        users = {'ADMIN': 'admin', 'STAFF': 'staff', 'DOCTOR': 'doctor', 'PATIENT': 'patient'}
+        if role:
+            self.client.force_login(self.data[users[role]])
+        url = '/' + pattern
+        for name, value in kwargs.items():
+            url = re.sub(rf'<\w+:{name}>', str(self.resolve_value(value)), url)
+        payload = self.resolve_value(payload)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            if isinstance(payload, str):
+                response = getattr(self.client, method)(url, payload, content_type='application/json')
+            else:
+                response = getattr(self.client, method)(url, payload or {})
+        return url, response, recorder
+
+    def test_every_url_has_a_case(self):
+        self.assertEqual({str(p.pattern) for p in urlpatterns}, set(URL_CASES))
+
+    @override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True)
+    def test_middleware_passes_views_within_budget(self):
+        _, response, _ = self.request('staff/dashboard/')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True, QUERY_BUDGET_DEFAULT=1)
+    def test_middleware_raises_over_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.request('triage/')
+
+    @override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True)
+    def test_bulk_booking_at_the_row_limit_stays_in_budget(self):
+        doctors, patients = self.data['doctors'], self.data['patients']
+        start = date.today() + timedelta(days=60)
+        # 20 half-hour slots a day per doctor, spread over enough days for every row
+        rows = [
+            {'doctor': doctors[n % 6].id, 'patient': patients[n % 30].id,
+             'date': (start + timedelta(days=n // 120)).isoformat(),
+             'time': f'{8 + n % 120 // 6 // 2:02d}:{30 * (n % 120 // 6 % 2):02d}', 'reason': 'Camp'}
+            for n in range(views.BULK_BOOKING_LIMIT)
+        ]
+        self.client.force_login(self.data['staff'])
+        response = self.client.post(reverse('bulk_book_appointments'), json.dumps({'appointments': rows}), content_type='application/json')
+        self.assertEqual(response.json()['booked'], len(rows))
+        self.assertEqual(DailyStats.objects.filter(date__gte=start).aggregate(n=Sum('pending'))['n'], len(rows))
+
+    @override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True,
+                       MIDDLEWARE=settings.MIDDLEWARE + ['mainapp.tests.MaintenanceMiddleware'])
+    def test_middleware_leaves_the_view_to_the_handler(self):
+        # A later middleware may still answer in place of the view
+        _, response, _ = self.request('staff/dashboard/')
+        self.assertEqual(response.status_code, 503)
+
+
+class AdminSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def setUp(self):
+        cache.clear()
+
+    def assertFresh(self):
+        cached = snapshots.admin_snapshot()
+        self.assertEqual(cached, snapshots.compute_admin_snapshot())
+        self.assertEqual(cached['total_appointments'], Appointment.objects.count())
+        self.assertEqual(cached['revenue'], DailyStats.objects.aggregate(total=Sum('revenue'))['total'])
+        self.assertEqual(cached['revenue'], revenue.total())
+
+    def test_cached_totals_follow_every_appointment_change(self):
+        doctor, patient = self.data['doctors'][2], self.data['patients'][4]
+        self.assertFresh()
+        appt = Appointment.objects.create(patient=patient, doctor=doctor, appointment_date=date.today() + timedelta(days=3),
+                                          appointment_time=time(15, 0), reason='Checkup')
+        self.assertFresh()
+        appt.status = 'COMPLETED'
+        appt.save()
+        self.assertFresh()
+        bulk_transition(Appointment.objects.filter(doctor=doctor, status='CONFIRMED'), 'COMPLETED')
+        self.assertFresh()
+        other = Appointment.objects.filter(status='PENDING').first()
+        other.status = 'CANCELLED'
+        other.save()
+        self.assertFresh()
+        # Deleting completed visits keeps the ledger and the rollup in step
+        appt.delete()
+        Appointment.objects.filter(doctor=doctor, status='COMPLETED').delete()
+        self.assertFresh()
+        self.client.force_login(self.data['admin'])
+        self.client.get(reverse('delete_doctor', args=[self.data['doctors'][1].id]))
+        self.assertFresh()
+
+
+class StaffBoardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def setUp(self):
+        self.client.force_login(self.data['staff'])
+
+    def test_unchanged_poll_is_not_modified(self):
+        first = self.client.get(reverse('staff_dashboard_data'))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['appointments_today_count'], 30)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            again = self.client.get(reverse('staff_dashboard_data'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertFalse([sql for sql, _ in recorder.queries if 'mainapp_appointment' in sql])
+
+    def test_idle_board_stays_not_modified_between_writes(self):
+        first = self.client.get(reverse('staff_dashboard_data'))
+        later = clock.time() + 60  # several poll intervals with nothing written
+        with mock.patch('time.time', return_value=later):
+            again = self.client.get(reverse('staff_dashboard_data'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_booking_changes_the_etag(self):
+        first = self.client.get(reverse('staff_dashboard_data'))
+        Appointment.objects.filter(appointment_date=date.today()).first().delete()
+        again = self.client.get(reverse('staff_dashboard_data'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()['appointments_today_count'], 29)
+
+    def test_stamp_expires_so_other_workers_catch_up(self):
+        first = self.client.get(reverse('staff_dashboard_data'))
+        # A write handled by another worker never touches this process's stamp
+        moved = Appointment.objects.filter(appointment_date=date.today()).first()
+        Appointment.objects.filter(id=moved.id).update(appointment_date=date.today() + timedelta(days=1))
+        stale = self.client.get(reverse('staff_dashboard_data'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(stale.status_code, 304)
+        cache.delete(snapshots.STAFF_BOARD_STAMP_KEY)  # as when STAFF_BOARD_STAMP_TTL runs out
+        again = self.client.get(reverse('staff_dashboard_data'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()['appointments_today_count'], 29)
+
+    def test_pending_requests_count_covers_all_dates(self):
+        pending = Appointment.objects.filter(status='PENDING')
+        self.assertTrue(pending.exclude(appointment_date=date.today()).exists())
+        self.assertEqual(snapshots.staff_board()['pending_requests_count'], pending.count())
+
+        # A date given as a string must leave the same bucket it entered
+        appt = Appointment.objects.create(patient=self.data['patient'], doctor=self.data['doctor'],
+                                          appointment_date='2030-01-02', appointment_time=time(9, 0), reason='Later')
+        self.assertEqual(snapshots.staff_board()['pending_requests_count'], pending.count())
+        appt.delete()
+        self.assertEqual(snapshots.staff_board()['pending_requests_count'], pending.count())
+        self.assertFalse(DailyStats.objects.filter(date=date(2030, 1, 2)).exclude(appointments=0).exists())
+
+    def test_poll_includes_the_triage_waiting_list(self):
+        triage._queues.clear()
+        first = self.client.get(reverse('staff_dashboard_data'))
+        department = self.data['staff'].staffprofile.department
+        appointment = Appointment.objects.filter(doctor__doctorprofile__department=department).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = TriageQueue.objects.create(patient=self.data['patient'], appointment=appointment, priority_level='URGENT')
+        again = self.client.get(reverse('staff_dashboard_data'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        waiting = again.json()['triage']
+        self.assertEqual(waiting['count'], first.json()['triage']['count'] + 1)
+        self.assertIn(entry.id, [row['id'] for row in waiting['waiting']])
+
+
+class PatientTimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def test_pages_cover_the_history_once_in_order(self):
+        patient = self.data['patient']
+        self.client.force_login(patient)
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 3, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get(reverse('patient_timeline'), params).json()
+            # session, user, one query per source and the prescriptions prefetch
+            self.assertLessEqual(len(queries), 6)
+            seen += [(item['at'], item['kind'], item['id']) for item in page['results']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        expected = (
+            Appointment.objects.filter(patient=patient).count()
+            + MedicalHistory.objects.filter(patient=patient).count()
+            + TriageQueue.objects.filter(patient=patient).count()
+        )
+        self.assertEqual(len(set(seen)), expected)
+        self.assertEqual(len(seen), expected)
+        self.assertEqual([at for at, _, _ in seen], sorted((at for at, _, _ in seen), reverse=True))
+
+    def test_doctors_only_see_patients_on_their_panel(self):
+        doctor, patient = self.data['doctor'], self.data['patient']
+        stranger = User.objects.filter(role='PATIENT').exclude(panel_doctors__doctor=doctor).first()
+        self.client.force_login(doctor)
+        self.assertEqual(self.client.get(reverse('patient_timeline'), {'patient': patient.id}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('patient_timeline'), {'patient': stranger.id}).status_code, 404)
+        self.client.force_login(self.data['staff'])
+        self.assertEqual(self.client.get(reverse('patient_timeline'), {'patient': stranger.id}).status_code, 200)
+
+
+class PatientPanelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def panels(self):
+        return sorted(DoctorPatientPanel.objects.values_list(
+            'doctor_id', 'patient_id', 'first_seen', 'last_visit', 'next_appointment', 'visit_count',
+        ))
+
+    def test_incremental_updates_match_a_rebuild(self):
+        doctors, patients = self.data['doctors'], self.data['patients']
+        day = date.today() + timedelta(days=12)
+        scheduling.book_batch([
+            {'doctor': doctors[1].id, 'patient': p.id, 'date': day.isoformat(), 'time': f'{9 + n}:00', 'reason': 'Camp'}
+            for n, p in enumerate(patients[:3])
+        ])
+        # Moving an appointment to another doctor updates both pairs
+        moved = Appointment.objects.filter(doctor=doctors[0], patient=patients[0], status='CONFIRMED').first()
+        moved.doctor = doctors[5]
+        moved.save()
+        bulk_transition(Appointment.objects.filter(doctor=doctors[1], appointment_date__lte=date.today()), 'COMPLETED')
+        Appointment.objects.filter(doctor=doctors[2]).first().delete()
+        MedicalHistory.objects.create(patient=patients[29], doctor=doctors[0], diagnosis='Cold', treatment='Tea')
+        panel = DoctorPatientPanel.objects.get(doctor=doctors[0], patient=patients[29])
+        self.assertEqual(panel.visit_count, 1)
+
+        incremental = self.panels()
+        call_command('rebuild_patient_panels', stdout=io.StringIO())
+        self.assertEqual(incremental, self.panels())
+
+    def test_passed_next_appointments_are_refreshed_daily(self):
+        doctor, patient = self.data['doctors'][4], self.data['patients'][29]
+        today = date.today()
+        for days in (2, 9):
+            Appointment.objects.create(patient=patient, doctor=doctor, appointment_date=today + timedelta(days=days),
+                                       appointment_time=time(11, 0), reason='Review')
+        panel = DoctorPatientPanel.objects.filter(doctor=doctor, patient=patient)
+        self.assertEqual(panel.get().next_appointment, today + timedelta(days=2))
+
+        with mock.patch('django.utils.timezone.localdate', return_value=today + timedelta(days=3)):
+            out = io.StringIO()
+            call_command('rebuild_patient_panels', stale=True, stdout=out)
+            self.assertEqual(panel.get().next_appointment, today + timedelta(days=9))
+            self.assertIn('panel(s) refreshed', out.getvalue())
+            incremental = self.panels()
+            call_command('rebuild_patient_panels', stdout=io.StringIO())
+            self.assertEqual(incremental, self.panels())
+
+    def test_deleting_a_doctor_keeps_panels_and_streams_consistent(self):
+        doctor = self.data['doctor']
+        triage_ids = set(TriageQueue.objects.filter(appointment__doctor=doctor).values_list('id', flat=True))
+        self.assertTrue(triage_ids)
+        published = []
+        relay, events.hub.relay = events.hub.relay, lambda channels, event: published.append(event)
+        self.addCleanup(setattr, events.hub, 'relay', relay)
+
+        self.client.force_login(self.data['admin'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('delete_doctor', args=[doctor.id]))
+        self.assertFalse(User.objects.filter(id=doctor.id).exists())
+        self.assertFalse(DoctorPatientPanel.objects.filter(doctor_id=doctor.id).exists())
+        remaining = self.panels()
+        call_command('rebuild_patient_panels', stdout=io.StringIO())
+        self.assertEqual(remaining, self.panels())
+        removed = {data['id'] for _, kind, data in published if kind == 'triage' and data['deleted']}
+        self.assertEqual(removed, triage_ids)
+
+    def test_migration_backfills_existing_history(self):
+        expected = self.panels()
+        DoctorPatientPanel.objects.all().delete()
+        backfill = importlib.import_module('mainapp.migrations.0016_backfill_patient_panels')
+        backfill.backfill_patient_panels(django_apps, None)
+        self.assertEqual(self.panels(), expected)
+
+
+class ReportsEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.start, cls.end = date.today() - timedelta(days=30), date.today() + timedelta(days=30)
+
+    def test_report_matches_raw_appointments(self):
+        report = reports.build_report(self.start, self.end)
+        in_range = Appointment.objects.filter(appointment_date__range=(self.start, self.end))
+        self.assertEqual(report['totals']['appointments'], in_range.count())
+        self.assertEqual(report['totals']['cancelled'], in_range.filter(status='CANCELLED').count())
+        self.assertEqual(sum(report['density']['by_weekday']), in_range.exclude(status='CANCELLED').count())
+        self.assertEqual(len(report['departments']), Department.objects.count())
+
+    def test_numpy_and_plain_reshaping_agree(self):
+        with_numpy = reports.build_report(self.start, self.end)
+        numpy, reports.np = reports.np, None
+        try:
+            plain = reports.build_report(self.start, self.end)
+        finally:
+            reports.np = numpy
+        self.assertEqual(with_numpy, plain)
+
+    def test_admin_gets_department_view(self):
+        self.client.force_login(self.data['admin'])
+        department = Department.objects.first()
+        response = self.client.get(reverse('reports'), {'department': department.id})
+        self.assertEqual([d['id'] for d in response.context['report']['departments']], [department.id])
+
+
+class ColumnarSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def test_snapshot_report_matches_live_report(self):
+        start, end = date.today() - timedelta(days=30), date.today() + timedelta(days=30)
+        with tempfile.TemporaryDirectory() as root, override_settings(ANALYTICS_SNAPSHOT_DIR=root):
+            columnar.build(chunk_size=7)
+            snapshot = reports.build_report(start, end, use_snapshot=True)
+            monthly = snapshot['monthly']
+        live = reports.build_report(start, end, use_snapshot=False)
+
+        self.assertEqual(snapshot['density'], live['density'])
+        self.assertEqual(snapshot['totals'], live['totals'])
+        self.assertEqual(
+            [(d['id'], d['appointments'], d['completed']) for d in snapshot['departments']],
+            [(d['id'], d['appointments'], d['completed']) for d in live['departments']],
+        )
+        self.assertAlmostEqual(snapshot['revenue'], float(live['revenue']))
+        self.assertEqual(sum(m['records'] for m in monthly), MedicalHistory.objects.count())
+
+
+    def test_builds_in_the_same_second_get_their_own_directory(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(ANALYTICS_SNAPSHOT_DIR=root), \
+                mock.patch('mainapp.columnar.time.strftime', return_value='20270101-090000'):
+            columnar.build()
+            first = columnar.load('appointments')
+            self.assertIs(columnar.load('appointments'), first)
+            self.assertEqual(len(first['day']), Appointment.objects.count())
+
+            Appointment.objects.create(patient=self.data['patient'], doctor=self.data['doctor'],
+                                       appointment_date=date.today() + timedelta(days=90), appointment_time=time(9, 0), reason='Late')
+            columnar.build()
+            columnar.build()
+            self.assertEqual(len(columnar.load('appointments')['day']), Appointment.objects.count())
+            directories = [p.name for p in Path(root).glob('snapshot-*')]
+            self.assertEqual(len(directories), columnar.KEEP_SNAPSHOTS)
+            self.assertIn(columnar.manifest()['directory'], directories)
+
+
+class ColumnarBuildLockTests(TransactionTestCase):
+    def test_build_does_not_block_writers(self):
+        Department.objects.create(name='Cardiology')
+        written = []
+
+        def write(name):
+            try:
+                Department.objects.create(name=name)
+                written.append(True)
+            finally:
+                connection.close()
+
+        def between_tables(message):
+            # A booking made mid-build must not wait for the export to finish
+            thread = threading.Thread(target=write, args=(f'Ward for {message}',))
+            thread.start()
+            thread.join(5)
+
+        with tempfile.TemporaryDirectory() as root, override_settings(ANALYTICS_SNAPSHOT_DIR=root):
+            columnar.build(log=between_tables)
+        self.assertEqual(len(written), len(columnar.TABLES))
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def setUp(self):
+        self.client.force_login(self.data['admin'])
+
+    def download(self, kind, **params):
+        response = self.client.get(reverse('export_data', args=[kind]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_has_every_row(self):
+        body = self.download('appointments').decode()
+        self.assertEqual(len(body.splitlines()), Appointment.objects.count() + 1)
+
+    def test_gzip_ndjson_round_trips(self):
+        body = gzip.decompress(self.download('medical-records', format='ndjson', gzip='1'))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(sorted(r['id'] for r in rows), list(MedicalHistory.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_rows_are_read_in_chunks(self):
+        # Small chunks and flushes still produce the full export
+        exports.FLUSH_BYTES, flush = 10, exports.FLUSH_BYTES
+        try:
+            chunks = list(exports.stream('prescriptions', chunk_size=7))
+        finally:
+            exports.FLUSH_BYTES = flush
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(b''.join(chunks).splitlines()), Prescription.objects.count() + 1)
+
+
+
+class DailyStatsRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def stats(self):
+        fields = ('date', 'department_id', 'doctor_id', 'appointments', 'pending', 'confirmed',
+                  'completed', 'cancelled', 'revenue', 'new_patients', 'triage_entries')
+        # Empty buckets left behind by moves carry no information
+        rows = DailyStats.objects.exclude(appointments=0, new_patients=0, triage_entries=0).values_list(*fields)
+        return sorted(rows, key=repr)
+
+    def test_incremental_updates_match_a_rebuild(self):
+        doctor, patients = self.data['doctors'][2], self.data['patients']
+        day = date.today() + timedelta(days=10)
+        scheduling.book_batch([
+            {'doctor': doctor.id, 'patient': p.id, 'date': day.isoformat(), 'time': f'{9 + n}:00', 'reason': 'Camp'}
+            for n, p in enumerate(patients[:4])
+        ])
+        appt = Appointment.objects.filter(appointment_date=day).first()
+        appt.status = 'COMPLETED'
+        appt.save()
+        moved = Appointment.objects.filter(doctor=self.data['doctor'], status='PENDING').first()
+        moved.doctor, moved.appointment_date = doctor, day + timedelta(days=1)
+        moved.save()
+        bulk_transition(Appointment.objects.filter(appointment_date=day, status='PENDING'), 'CANCELLED')
+        Appointment.objects.filter(appointment_date=day, status='CANCELLED').first().delete()
+        TriageQueue.objects.create(patient=patients[5], appointment=appt, priority_level='LOW')
+        walk_in = User.objects.create(username='walkin', email='walkin@example.com', name='Walk In', role='PATIENT')
+        PatientProfile.objects.create(user=walk_in, age=40, gender='Male', contact_number='5550000')
+
+        incremental = self.stats()
+        call_command('rebuild_daily_stats', stdout=io.StringIO())
+        self.assertEqual(incremental, self.stats())
+
+    def test_migration_backfills_existing_history(self):
+        expected = self.stats()
+        DailyStats.objects.all().delete()
+        backfill = importlib.import_module('mainapp.migrations.0015_backfill_daily_stats')
+        backfill.backfill_daily_stats(django_apps, None)
+        self.assertEqual(self.stats(), expected)
+
+
+class RevenueLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def test_completion_is_charged_at_the_fee_of_the_day(self):
+        doctor = self.data['doctor']
+        profile = doctor.doctorprofile
+        appt = Appointment.objects.filter(doctor=doctor, status__in=['PENDING', 'CONFIRMED']).first()
+        before = revenue.total()
+
+        self.client.force_login(doctor)
+        self.client.post(reverse('complete_appointment', args=[appt.id]))
+        appt.refresh_from_db()
+        self.assertEqual(appt.fee, profile.consultation_fee)
+        self.assertEqual(revenue.total() - before, profile.consultation_fee)
+
+        # Raising the fee later leaves recorded revenue alone
+        profile.consultation_fee += 50
+        profile.save()
+        self.assertEqual(revenue.total() - before, appt.fee)
+
+    def test_reopening_a_completion_records_a_reversal(self):
+        appt = Appointment.objects.filter(status='CONFIRMED').first()
+        before = revenue.total()
+        appt.status = 'COMPLETED'
+        appt.save()
+        appt.status = 'CONFIRMED'
+        appt.save()
+        self.assertEqual(list(RevenueEntry.objects.filter(appointment=appt).values_list('amount', flat=True)), [appt.fee, -appt.fee])
+        self.assertEqual(revenue.total(), before)
+
+    def test_resaving_a_completion_while_rollups_are_paused_charges_nothing(self):
+        appt = Appointment.objects.filter(status='COMPLETED').first()
+        charged = list(RevenueEntry.objects.filter(appointment=appt).values_list('amount', flat=True))
+        profile = appt.doctor.doctorprofile
+        profile.consultation_fee += 25
+        profile.save()
+        with rollups.paused():
+            appt.reason = 'Follow-up notes'
+            appt.save()
+        self.assertEqual(list(RevenueEntry.objects.filter(appointment=appt).values_list('amount', flat=True)), charged)
+        self.assertEqual(Appointment.objects.get(id=appt.id).fee, charged[0])
+
+    def test_rollup_revenue_matches_the_ledger_after_fee_changes(self):
+        doctor = self.data['doctor']
+        open_ids = list(Appointment.objects.filter(doctor=doctor, status__in=['PENDING', 'CONFIRMED']).values_list('id', flat=True))
+        bulk_transition(Appointment.objects.filter(id__in=open_ids), 'COMPLETED')
+        profile = doctor.doctorprofile
+        profile.consultation_fee += 75
+        profile.save()
+        # A completed appointment moved to another day keeps its captured fee
+        moved = Appointment.objects.get(id=open_ids[0])
+        moved.appointment_date += timedelta(days=365)
+        moved.save()
+
+        def rolled_up():
+            return DailyStats.objects.aggregate(total=Sum('revenue'))['total']
+
+        self.assertEqual(rolled_up(), revenue.total())
+        span = Appointment.objects.aggregate(first=Min('appointment_date'), last=Max('appointment_date'))
+        rollups.rebuild(span['first'], span['last'])
+        self.assertEqual(rolled_up(), revenue.total())
+
+
+class UnreadCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def setUp(self):
+        cache.clear()
+        self.user = self.data['patient']
+
+    def assertCount(self):
+        self.assertEqual(
+            notifications.unread_count(self.user.id),
+            Notification.objects.filter(user=self.user, is_read=False).count(),
+        )
+
+    def test_count_follows_saves_bulk_reads_and_deletes(self):
+        self.assertCount()
+        with self.assertNumQueries(0):
+            notifications.unread_count(self.user.id)
+
+        Notification.objects.create(user=self.user, title='New', message='Hi')
+        self.assertCount()
+        first = Notification.objects.filter(user=self.user, is_read=False).first()
+        first.is_read = True
+        first.save()
+        self.assertCount()
+        Notification.objects.filter(user=self.user, is_read=False).first().delete()
+        self.assertCount()
+        self.assertGreater(notifications.mark_read(self.user.id), 0)
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+        self.assertCount()
+
+    def test_count_changed_by_another_worker_expires(self):
+        with mock.patch.object(notifications, 'UNREAD_TTL', 1):
+            before = notifications.unread_count(self.user.id)
+            # Another worker's cache saw this write; this process's did not
+            Notification.objects.filter(user=self.user, is_read=False).update(is_read=True)
+            self.assertEqual(notifications.unread_count(self.user.id), before)
+            clock.sleep(1.1)
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+
+    def test_pages_that_do_not_show_the_count_skip_it(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('patient_timeline'))
+        self.assertFalse([q for q in queries if 'mainapp_notification' in q['sql']])
+
+
+class NotificationFanOutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def test_audiences_get_one_notification_each(self):
+        doctor = self.data['doctor']
+        department = doctor.doctorprofile.department
+        expected = {
+            ('department', department.id): set(
+                User.objects.filter(doctorprofile__department=department).values_list('id', flat=True)
+            ) | set(User.objects.filter(staffprofile__department=department).values_list('id', flat=True)),
+            ('doctor-patients', doctor.id): set(
+                Appointment.objects.filter(doctor=doctor).values_list('patient_id', flat=True)
+            ),
+        }
+        for (audience, target), user_ids in expected.items():
+            before = Notification.objects.count()
+            sent = notifications.fan_out(audience, target, 'Hello', 'Message', batch_size=4)
+            self.assertEqual(sent, len(user_ids))
+            created = Notification.objects.order_by('-id')[:sent]
+            self.assertEqual(Notification.objects.count() - before, sent)
+            self.assertEqual({n.user_id for n in created}, user_ids)
+
+    @override_settings(NOTIFICATION_FANOUT_ASYNC=False)
+    def test_request_queues_the_fan_out_until_commit(self):
+        self.client.force_login(self.data['doctor'])
+        before = Notification.objects.count()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(reverse('send_notifications'), {
+                'audience': 'doctor-patients', 'title': 'Clinic closed', 'message': 'Friday',
+            })
+            self.assertEqual(Notification.objects.count(), before)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            Notification.objects.count() - before,
+            DoctorPatientPanel.objects.filter(doctor=self.data['doctor']).count(),
+        )
+
+    def test_doctors_cannot_notify_a_department(self):
+        self.client.force_login(self.data['doctor'])
+        response = self.client.post(reverse('send_notifications'), {
+            'audience': 'department', 'target': '1', 'title': 'x', 'message': 'y',
+        })
+        self.assertEqual(response.status_code, 403)
+
+
+class EventStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def test_published_events_reach_subscribed_streams(self):
+        async def scenario():
+            stream = events.stream(['user:1'], heartbeat=0.05, max_seconds=5)
+            self.assertTrue((await anext(stream)).startswith('retry:'))
+            self.assertEqual(await anext(stream), ': ping\n\n')
+            # Published from another thread, as signal handlers and the fan-out worker do
+            threading.Thread(target=events.hub.publish, args=(['user:1', 'user:2'], 'notification', {'title': 'Hi'})).start()
+            message = await anext(stream)
+            await stream.aclose()
+            return message
+
+        message = asyncio.run(scenario())
+        self.assertIn('event: notification', message)
+        self.assertIn('"title": "Hi"', message)
+        self.assertEqual(events.hub.subscriber_count(), 0)
+
+    def test_one_worker_holds_many_idle_streams(self):
+        async def scenario(n):
+            streams = [events.stream([events.TRIAGE_CHANNEL], heartbeat=60) for _ in range(n)]
+            for stream in streams:
+                await anext(stream)
+            waiting = [asyncio.ensure_future(anext(stream)) for stream in streams]
+            await asyncio.sleep(0)
+            events.hub.publish([events.TRIAGE_CHANNEL], 'triage', {'id': 1})
+            received = await asyncio.gather(*waiting)
+            for stream in streams:
+                await stream.aclose()
+            return received
+
+        received = asyncio.run(scenario(2000))
+        self.assertEqual(len(received), 2000)
+        self.assertTrue(all('event: triage' in message for message in received))
+
+    def test_changes_publish_after_commit(self):
+        published = []
+        relay, events.hub.relay = events.hub.relay, lambda channels, event: published.append((channels, event[1]))
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                Notification.objects.create(user=self.data['patient'], title='Result ready', message='See your record')
+                appt = Appointment.objects.filter(status='CONFIRMED').first()
+                appt.status = 'CANCELLED'
+                appt.save()
+                self.assertEqual(published, [])
+        finally:
+            events.hub.relay = relay
+        self.assertIn(([events.user_channel(self.data['patient'].id)], 'notification'), published)
+        self.assertIn(
+            ([events.user_channel(appt.doctor_id), events.user_channel(appt.patient_id), events.APPOINTMENTS_CHANNEL], 'appointment'),
+            published,
+        )
+
+    def test_wsgi_requests_poll_instead_of_streaming(self):
+        self.client.force_login(self.data['patient'])
+        self.assertEqual(self.client.get(reverse('event_stream')).status_code, 204)
+        page = self.client.get(reverse('patient_dashboard'))
+        self.assertFalse(page.context['live_events'])
+        self.assertNotContains(page, 'new EventSource')
+
+    async def test_asgi_requests_stream(self):
+        await self.async_client.aforce_login(self.data['patient'])
+        response = await self.async_client.get(reverse('event_stream'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue((await anext(response.streaming_content)).startswith(b'retry:'))
+        await response.streaming_content.aclose()
+
+
+class NotificationInboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.user = cls.data['patient']
+        Notification.objects.bulk_create([
+            Notification(user=cls.user, title=f'Bulk {n}', message='Hello', is_read=n % 3 == 0) for n in range(60)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_inbox_pages_cover_every_notification_once(self):
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(reverse('notifications'), {'cursor': cursor} if cursor else {})
+            page = response.context['notifications']
+            self.assertLessEqual(len(page), notifications.INBOX_PAGE_SIZE)
+            seen += [n.id for n in page]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, list(Notification.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_tampered_cursor_serves_the_first_page(self):
+        first = self.client.get(reverse('notifications'))
+        for values in (['x', 'y'], ['2026-01-01T00:00:00+00:00', 'abc'], ['1']):
+            response = self.client.get(reverse('notifications'), {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 200, values)
+            self.assertTrue(response.context['is_first_page'])
+            self.assertEqual(list(response.context['notifications']), list(first.context['notifications']))
+
+    def test_mark_all_read_is_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('mark_all_notifications_read'))
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "mainapp_notification"')]), 1)
+        self.assertFalse(Notification.objects.filter(user=self.user, is_read=False).exists())
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+
+    def test_archive_moves_only_old_read_notifications(self):
+        old = timezone.now() - timedelta(days=200)
+        Notification.objects.filter(user=self.user).update(created_at=old)
+        expected = set(Notification.objects.filter(is_read=True, created_at__lt=timezone.now() - timedelta(days=90)).values_list('id', flat=True))
+        unread = Notification.objects.filter(user=self.user, is_read=False).count()
+
+        moved = notifications.archive_read(90, chunk_size=7)
+        self.assertEqual(moved, len(expected))
+        self.assertEqual(set(NotificationArchive.objects.values_list('id', flat=True)), expected)
+        self.assertFalse(Notification.objects.filter(id__in=expected).exists())
+        self.assertEqual(Notification.objects.filter(user=self.user, is_read=False).count(), unread)
+        self.assertEqual(notifications.archive_read(90), 0)
+
+
+class NotificationDropdownTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+
+    def setUp(self):
+        cache.clear()
+
+    def notification_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [q for q in queries if 'mainapp_notification' in q['sql']]
+
+    def test_navigation_reuses_the_cached_list_and_fragment(self):
+        self.client.force_login(self.data['doctor'])
+        _, first = self.notification_queries(reverse('doctor_dashboard'))
+        self.assertEqual(len(first), 1)
+        _, again = self.notification_queries(reverse('appointment_list'))
+        self.assertEqual(again, [])
+
+    def test_new_notification_shows_up_in_the_dropdown(self):
+        user = self.data['patient']
+        self.client.force_login(user)
+        self.client.get(reverse('patient_dashboard'))
+        Notification.objects.create(user=user, title='Lab results ready', message='Open your record')
+        response, queries = self.notification_queries(reverse('patient_dashboard'))
+        self.assertTrue(queries)
+        self.assertContains(response, 'Lab results ready')
+
+    def test_fragment_expires_so_relative_times_move_on(self):
+        user = self.data['patient']
+        Notification.objects.filter(user=user).update(is_read=True)
+        Notification.objects.create(user=user, title='Lab results ready', message='Open your record')
+        Notification.objects.filter(user=user, is_read=False).update(created_at=timezone.now() - timedelta(minutes=2))
+        self.client.force_login(user)
+        with mock.patch.object(notifications, 'FRAGMENT_TTL', 1):
+            self.assertContains(self.client.get(reverse('patient_dashboard')), '2\xa0minutes ago')
+            # Only the clock moves; nothing bumps the user's version
+            Notification.objects.filter(user=user, is_read=False).update(created_at=timezone.now() - timedelta(minutes=5))
+            clock.sleep(1.1)
+            self.assertContains(self.client.get(reverse('patient_dashboard')), '5\xa0minutes ago')
+
+
+class TriagePriorityQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.department = cls.data['doctor'].doctorprofile.department
+
+    def setUp(self):
+        cache.clear()
+        triage._queues.clear()
+        self.appointment = Appointment.objects.filter(doctor=self.data['doctor']).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            for priority in ['LOW', 'URGENT', 'MEDIUM', 'HIGH', 'URGENT']:
+                TriageQueue.objects.create(patient=self.data['patient'], appointment=self.appointment, priority_level=priority)
+
+    def drain(self):
+        called = []
+        while (entry := triage.call_next(self.department.id, self.data['staff'])) is not None:
+            called.append(entry)
+        return called
+
+    def test_call_next_follows_clinical_order(self):
+        waiting = TriageQueue.objects.filter(department=self.department, is_processed=False)
+        expected = list(waiting.order_by('rank', 'checked_in_at', 'id').values_list('id', flat=True))
+        called = self.drain()
+        self.assertEqual([e.id for e in called], expected)
+        self.assertEqual(called[0].priority_level, 'URGENT')
+        self.assertFalse(waiting.exists())
+        self.assertTrue(all(e.called_by_id == self.data['staff'].id for e in called))
+
+    def test_entry_claimed_elsewhere_is_skipped(self):
+        triage.queue_for(self.department.id)
+        top = TriageQueue.objects.filter(department=self.department, is_processed=False).order_by('rank', 'checked_in_at', 'id').first()
+        # Another worker claims the top entry without this process hearing about it
+        TriageQueue.objects.filter(id=top.id).update(is_processed=True)
+        called = self.drain()
+        self.assertNotIn(top.id, [e.id for e in called])
+        self.assertEqual(len(called), len({e.id for e in called}))
+
+    def test_mirror_reloads_when_another_worker_changes_the_table(self):
+        _, before = triage.waiting(self.department.id)
+        # Written by another worker: this process's commit hook never sees it
+        TriageQueue.objects.create(patient=self.data['patient'], appointment=self.appointment, priority_level='LOW')
+        _, after = triage.waiting(self.department.id)
+        self.assertEqual(after, before + 1)
+
+    def test_priority_change_elsewhere_reorders_the_mirror(self):
+        triage.queue_for(self.department.id)
+        last = TriageQueue.objects.filter(department=self.department, is_processed=False).order_by('-rank', '-checked_in_at').first()
+        # Another worker escalates the least urgent patient; the count is unchanged, only updated_at moves
+        TriageQueue.objects.filter(id=last.id).update(priority_level='URGENT', rank=0, checked_in_at=last.checked_in_at - timedelta(days=1), updated_at=timezone.now())
+        self.assertEqual(triage.call_next(self.department.id, self.data['staff']).id, last.id)
+
+    def test_heap_stays_ordered_through_a_surge(self):
+        queue = triage.DepartmentQueue(None)
+        surge = [(random.randrange(4), random.random(), n) for n in range(20000)]
+        for key in surge:
+            queue.push(key, None)
+        for key in surge[::3]:
+            queue.discard(key[2])
+        popped = []
+        while (key := queue.pop()) is not None:
+            popped.append(key)
+        self.assertEqual(popped, sorted(k for k in surge if k[2] % 3))
+
+class WaitTimeEstimatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_hospital()
+        cls.department = cls.data['doctor'].doctorprofile.department
+
+    def setUp(self):
+        TriageQueue.objects.all().delete()
+        cache.clear()
+        triage._queues.clear()
+        self.appointment = Appointment.objects.filter(doctor=self.data['doctor']).first()
+
+    def check_in(self, priority, minutes_ago):
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = TriageQueue.objects.create(patient=self.data['patient'], appointment=self.appointment, priority_level=priority)
+        TriageQueue.objects.filter(id=entry.id).update(
+            checked_in_at=timezone.now() - timedelta(minutes=minutes_ago), updated_at=timezone.now(),
+        )
+        entry.refresh_from_db()
+        return entry
+
+    def test_p2_tracks_true_quantiles(self):
+        rng = random.Random(7)
+        samples = [rng.expovariate(1 / 600) for _ in range(10000)]
+        ordered = sorted(samples)
+        for p in (0.5, 0.9):
+            quantile = waittimes.P2Quantile(p)
+            for x in samples:
+                quantile.add(x)
+            true = ordered[int(p * len(ordered))]
+            self.assertAlmostEqual(quantile.value(), true, delta=true * 0.05)
+
+    def test_calls_update_stats_without_rescanning(self):
+        self.check_in('HIGH', 30)
+        stats = waittimes.department_stats(self.department.id)
+        high = TriageQueue.RANKS['HIGH']
+        self.assertEqual(stats[high].count, 0)
+
+        triage.call_next(self.department.id, self.data['staff'])
+        with self.assertNumQueries(0):
+            stats = waittimes.department_stats(self.department.id)
+        self.assertEqual(stats[high].count, 1)
+        self.assertAlmostEqual(stats[high].summary()['average_minutes'], 30, delta=0.5)
+
+        self.check_in('HIGH', 10)
+        triage.call_next(self.department.id, self.data['staff'])
+        stats = waittimes.department_stats(self.department.id)
+        self.assertEqual(stats[high].count, 2)
+        self.assertAlmostEqual(stats[high].ewma / 60, 0.2 * 10 + 0.8 * 30, delta=0.5)
+
+    def test_cold_cache_replays_recent_calls(self):
+        self.check_in('LOW', 20)
+        triage.call_next(self.department.id, self.data['staff'])
+        cache.clear()
+        stats = waittimes.department_stats(self.department.id)
+        self.assertEqual(stats[TriageQueue.RANKS['LOW']].count, 1)
+
+    def test_calls_made_by_other_workers_are_folded_in_on_rebuild(self):
+        low = TriageQueue.RANKS['LOW']
+
+        def called(minutes_ago):
+            entry = self.check_in('LOW', minutes_ago)
+            TriageQueue.objects.filter(id=entry.id).update(is_processed=True, called_at=timezone.now())
+            entry.refresh_from_db()
+            return entry
+
+        with mock.patch.object(waittimes, 'STATS_TTL', 1):
+            self.assertEqual(waittimes.department_stats(self.department.id)[low].count, 0)
+            called(20)  # by another worker, whose record() updated its own cache only
+            waittimes.record(called(10))
+            self.assertEqual(waittimes.department_stats(self.department.id)[low].count, 1)
+            clock.sleep(1.1)
+        self.assertEqual(waittimes.department_stats(self.department.id)[low].count, 2)
+
+    def test_estimate_grows_with_place_in_the_queue(self):
+        # Calls ten minutes apart, each after a five minute wait
+        for minutes_ago in (35, 25, 15):
+            entry = self.check_in('MEDIUM', minutes_ago + 5)
+            TriageQueue.objects.filter(id=entry.id).update(
+                is_processed=True, called_at=timezone.now() - timedelta(minutes=minutes_ago),
+            )
+        cache.clear()
+        triage._queues.clear()
+        interval = waittimes.call_interval(self.department.id)
+        self.assertEqual(interval.count, 2)
+        self.assertAlmostEqual(interval.ewma / 60, 10, delta=0.1)
+
+        waiting = [self.check_in('MEDIUM', 1) for _ in range(4)]
+        self.client.force_login(self.data['staff'])
+        body = self.client.get(reverse('triage_wait_times'), {'entry': waiting[-1].id}).json()
+        self.assertEqual(body['entry']['position'], 4)
+        self.assertAlmostEqual(body['entry']['estimated_remaining_minutes'], 40, delta=0.5)
+        medium = waittimes.department_stats(self.department.id)[TriageQueue.RANKS['MEDIUM']]
+        # First in line: the history's five minutes less the one waited is under one interval
+        self.assertAlmostEqual(waittimes.estimate(medium, 60, 1, interval), 10, delta=0.1)
+        self.assertAlmostEqual(waittimes.estimate(medium, 60), 4, delta=0.1)
+
+        # A call folds the gap since the previous one into the interval
+        triage.call_next(self.department.id, self.data['staff'])
+        self.assertEqual(waittimes.call_interval(self.department.id).count, 3)
+
+    def test_patient_sees_position_and_estimate(self):
+        self.check_in('MEDIUM', 40)
+        triage.call_next(self.department.id, self.data['staff'])
+        self.check_in('URGENT', 3)
+        self.check_in('MEDIUM', 5)
+        mine = self.check_in('MEDIUM', 2)
+
+        self.client.force_login(self.data['patient'])
+        body = self.client.get(reverse('triage_wait_times')).json()
+        self.assertTrue(body['success'])
+        self.assertEqual(body['entry']['id'], mine.id)
+        self.assertEqual(body['entry']['position'], 3)
+        self.assertAlmostEqual(body['entry']['estimated_remaining_minutes'], 38, delta=0.5)
+        self.assertNotIn('priorities', body)
+
+        self.client.force_login(self.data['staff'])
+        body = self.client.get(reverse('triage_wait_times'), {'department': self.department.id}).json()
+        medium = next(row for row in body['priorities'] if row['priority'] == 'MEDIUM')
+        self.assertEqual(medium['samples'], 1)
+        self.assertEqual(self.client.get(reverse('triage_wait_times'), {'entry': 'x'}).status_code, 400)
+
+def _budget_test(pattern):
+    def test(self):
+        url, response, recorder = self.request(pattern)
+        self.assertLess(response.status_code, 500)
+        budget = budget_for(resolve(url).func)
+        self.assertLessEqual(
+            len(recorder.queries), budget,
+            f'{url} ran {len(recorder.queries)} queries (budget {budget}): {recorder.repeated(2)}',
+        )
+        if response.request['REQUEST_METHOD'] == 'GET':
+            self.assertEqual(recorder.repeated(), [], f'{url} has repeated queries')
+    return test
+
+
+for _pattern in URL_CASES:
+    _name = 'test_budget_' + (''.join(c if c.isalnum() else '_' for c in _pattern).strip('_') or 'home')
+    setattr(QueryBudgetTests, _name, _budget_test(_pattern))
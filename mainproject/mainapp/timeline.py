@@ -0,0 +1,133 @@
+from datetime import date, datetime
+from django.db.models import Count, Max, Prefetch, Q
+from django.utils import timezone
+from .models import Appointment, MedicalHistory, Prescription, TriageQueue
+from .pagination import decode_cursor, encode_cursor, keyset_before
+
+TIMELINE_PAGE_SIZE = 20
+MAX_TIMELINE_PAGE_SIZE = 100
+
+
+class Source:
+    """One model feeding the timeline, ordered newest first on ``fields`` then ``id``.
+
+    ``rank`` breaks ties between sources at the same instant so the merged
+    order, and therefore the cursor, is total.
+    """
+
+    def __init__(self, kind, rank, fields, queryset):
+        self.kind = kind
+        self.rank = rank
+        self.fields = fields
+        self.queryset = queryset
+
+    def moment(self, obj):
+        if self.kind == 'appointment':
+            return datetime.combine(obj.appointment_date, obj.appointment_time)
+        value = getattr(obj, self.fields[0])
+        return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+
+    def _values(self, moment):
+        if self.kind == 'appointment':
+            return [moment.date(), moment.time()]
+        return [timezone.make_aware(moment) if timezone.is_naive(moment) else moment]
+
+    def after(self, moment, rank, obj_id):
+        """Rows that sort after the cursor ``(moment, rank, id)`` in the merged stream"""
+        values = self._values(moment)
+        if self.rank == rank:
+            return keyset_before(self.fields + ['id'], values + [obj_id])
+        earlier = keyset_before(self.fields, values)
+        if self.rank < rank:
+            # Lower ranks come later at the same instant
+            earlier |= Q(**dict(zip(self.fields, values)))
+        return earlier
+
+    def page(self, patient, cursor, limit):
+        queryset = self.queryset.filter(patient=patient)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(*cursor))
+        return list(queryset.order_by(*[f'-{f}' for f in self.fields + ['id']])[:limit])
+
+
+def _sources():
+    return [
+        Source('appointment', 3, ['appointment_date', 'appointment_time'],
+               Appointment.objects.select_related('doctor')),
+        Source('record', 2, ['date'], MedicalHistory.objects.select_related('doctor').prefetch_related(
+            Prefetch('prescription_set', queryset=Prescription.objects.order_by('id')),
+        )),
+        Source('triage', 1, ['checked_in_at'], TriageQueue.objects.all()),
+    ]
+
+
+def _decode(cursor):
+    values = decode_cursor(cursor, 3)
+    if values is None:
+        return None
+    try:
+        return datetime.fromisoformat(values[0]), int(values[1]), int(values[2])
+    except (TypeError, ValueError):
+        return None
+
+
+def timeline_page(patient, cursor=None, page_size=TIMELINE_PAGE_SIZE):
+    """One page of ``patient``'s history, newest first; returns ``(items, next_cursor)``.
+
+    Appointments, medical records (with their prescriptions) and triage
+    entries are merged into one stream of ``{'kind', 'at', 'object'}``
+    items. Each source is read with a keyset query bounded to one page,
+    so the cost is four queries however long the history is.
+    """
+    page_size = max(1, min(page_size, MAX_TIMELINE_PAGE_SIZE))
+    position = _decode(cursor)
+
+    candidates = []
+    for source in _sources():
+        for obj in source.page(patient, position, page_size + 1):
+            candidates.append((source.moment(obj), source.rank, obj.id, source, obj))
+    candidates.sort(key=lambda c: c[:3], reverse=True)
+
+    items = [{'kind': source.kind, 'at': at, 'object': obj} for at, _, _, source, obj in candidates[:page_size]]
+    next_cursor = None
+    if len(candidates) > page_size:
+        at, rank, obj_id = candidates[page_size - 1][:3]
+        next_cursor = encode_cursor([at.isoformat(), rank, obj_id])
+    return items, next_cursor
+
+
+def timeline_summary(patient):
+    """Last visit, next appointment and prescription count for the dashboard header"""
+    records = MedicalHistory.objects.filter(patient=patient).aggregate(
+        last_visit=Max('date'), prescriptions=Count('prescription'),
+    )
+    next_appointment = Appointment.objects.filter(
+        patient=patient, appointment_date__gte=date.today(), status__in=['PENDING', 'CONFIRMED'],
+    ).select_related('doctor').order_by('appointment_date', 'appointment_time').first()
+    return {
+        'last_visit_date': records['last_visit'],
+        'next_appointment': next_appointment,
+        'active_prescriptions_count': records['prescriptions'],
+    }
+
+
+def serialize(item):
+    obj = item['object']
+    data = {'kind': item['kind'], 'id': obj.id, 'at': item['at'].isoformat()}
+    if item['kind'] == 'appointment':
+        data.update(status=obj.status, reason=obj.reason, doctor={'id': obj.doctor_id, 'name': obj.doctor.name})
+    elif item['kind'] == 'record':
+        data.update(
+            diagnosis=obj.diagnosis, treatment=obj.treatment, symptoms=obj.symptoms,
+            doctor={'id': obj.doctor_id, 'name': obj.doctor.name},
+            prescriptions=[{
+                'medication': p.medication_name, 'dosage': p.dosage,
+                'frequency': p.frequency, 'duration': p.duration,
+            } for p in obj.prescription_set.all()],
+        )
+    else:
+        data.update(
+            priority=obj.priority_level, complaint=obj.chief_complaint,
+            blood_pressure=obj.blood_pressure, temperature=obj.temperature, pulse_rate=obj.pulse_rate,
+        )
+    return data
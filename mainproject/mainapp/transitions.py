@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.dispatch import Signal
+from . import revenue
+from .models import Appointment
+
+# Which statuses each status may move to
+TRANSITIONS = {
+    'PENDING': {'CONFIRMED', 'COMPLETED', 'CANCELLED'},
+    'CONFIRMED': {'COMPLETED', 'CANCELLED'},
+    'COMPLETED': set(),
+    'CANCELLED': set(),
+}
+
+# Sent after a bulk transition with the rows that changed (queryset.update()
+# bypasses post_save, so listeners that track appointments hook in here).
+# Each row is a dict of id, doctor_id, patient_id, appointment_date, the
+# previous status and the fee captured for it (set when completing).
+appointments_transitioned = Signal()
+
+
+def can_transition(current, target):
+    return target in TRANSITIONS.get(current, ())
+
+
+def sources_for(target):
+    return [status for status, targets in TRANSITIONS.items() if target in targets]
+
+
+def bulk_transition(queryset, target):
+    """Move every appointment in ``queryset`` to ``target`` with one UPDATE.
+
+    Rows whose current status does not allow the move are left alone and
+    reported. Returns ``{'updated': [ids], 'skipped': [{'id', 'status', 'error'}]}``.
+    """
+    if target not in TRANSITIONS:
+        raise ValueError(f'Unknown appointment status: {target}')
+    sources = sources_for(target)
+
+    with transaction.atomic():
+        rows = list(queryset.values('id', 'doctor_id', 'patient_id', 'appointment_date', 'status', 'fee'))
+        changed = [row for row in rows if row['status'] in sources]
+        if changed:
+            updates = {'status': target}
+            if target == 'COMPLETED':
+                # Capture the fee now so later fee changes do not rewrite past revenue
+                updates['fee'] = revenue.current_fee()
+            queryset.filter(status__in=sources).update(**updates)
+            if target == 'COMPLETED':
+                fees = revenue.charge([row['id'] for row in changed])
+                for row in changed:
+                    row['fee'] = fees.get(row['id'])
+
+    if changed:
+        appointments_transitioned.send(sender=Appointment, rows=changed, target=target)
+    return {
+        'updated': [row['id'] for row in changed],
+        'skipped': [
+            {'id': row['id'], 'status': row['status'], 'error': f"{row['status']} cannot become {target}"}
+            for row in rows if row['status'] not in sources
+        ],
+    }
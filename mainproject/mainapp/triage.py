@@ -0,0 +1,184 @@
+import heapq
+import threading
+from collections import Counter
+from django.dispatch import Signal
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from .models import TriageQueue
+
+# Sent after call_next claims an entry, since its UPDATE bypasses post_save
+entry_called = Signal()  # kwargs: entry
+
+
+def _key(entry):
+    # Heap order: most urgent rank first, then longest waiting, then id for a total order
+    return entry.rank, entry.checked_in_at, entry.id
+
+
+def table_state(department_id):
+    """``(waiting entries, latest change among them)`` for a department, read from the table.
+
+    Every change to a waiting entry moves its ``updated_at`` forward and
+    every claim or removal lowers the count, so any change made by any
+    worker process changes this pair.
+    """
+    state = TriageQueue.objects.filter(department_id=department_id, is_processed=False).aggregate(
+        n=Count('id'), last=Max('updated_at'),
+    )
+    return state['n'], state['last']
+
+
+class DepartmentQueue:
+    """In-memory heap mirror of one department's waiting triage entries.
+
+    ``push`` and ``pop`` are O(log n). Removals and re-prioritised entries
+    leave their old heap items behind, and those are skipped when they reach
+    the top. Before each use the mirror's own count and latest change are
+    compared with ``table_state``, one indexed aggregate. A mismatch means
+    another worker changed the queue, and the mirror reloads from the table.
+    """
+
+    def __init__(self, department_id):
+        self.department_id = department_id
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.heap = []
+        self.entries = {}
+        self.updated = {}
+        self.rank_counts = Counter()
+
+    def load(self):
+        rows = TriageQueue.objects.filter(department_id=self.department_id, is_processed=False).values_list(
+            'rank', 'checked_in_at', 'id', 'updated_at',
+        )
+        self.entries = {row[2]: row[:3] for row in rows}
+        self.updated = {row[2]: row[3] for row in rows}
+        self.rank_counts = Counter(key[0] for key in self.entries.values())
+        self.heap = list(self.entries.values())
+        heapq.heapify(self.heap)
+        self.loaded = True
+
+    def state(self):
+        return len(self.entries), max(self.updated.values(), default=None)
+
+    def sync(self):
+        if not self.loaded or self.state() != table_state(self.department_id):
+            self.load()
+
+    def push(self, key, updated_at):
+        self.discard(key[2])
+        self.entries[key[2]] = key
+        self.updated[key[2]] = updated_at
+        self.rank_counts[key[0]] += 1
+        heapq.heappush(self.heap, key)
+
+    def discard(self, entry_id):
+        key = self.entries.pop(entry_id, None)
+        if key is not None:
+            del self.updated[entry_id]
+            self.rank_counts[key[0]] -= 1
+
+    def peek(self):
+        while self.heap and self.entries.get(self.heap[0][2]) != self.heap[0]:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def pop(self):
+        top = self.peek()
+        if top is not None:
+            heapq.heappop(self.heap)
+            self.discard(top[2])
+        return top
+
+    def ahead_of_rank(self, rank):
+        """Waiting entries of more urgent ranks, O(1) from the per-rank counts"""
+        return sum(n for r, n in self.rank_counts.items() if r < rank)
+
+    def ordered(self, limit):
+        return heapq.nsmallest(limit, self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def queue_for(department_id):
+    """The current mirror for a department (``None`` for walk-ins), reloaded if stale"""
+    with _queues_lock:
+        queue = _queues.setdefault(department_id, DepartmentQueue(department_id))
+    with queue.lock:
+        queue.sync()
+    return queue
+
+
+def _changed(department_id, apply):
+    # Keep this process's mirror in step with its own writes; other workers notice through table_state
+    queue = _queues.get(department_id)
+    if queue is not None:
+        with queue.lock:
+            apply(queue)
+
+
+def entry_saved(entry):
+    if entry.is_processed:
+        _changed(entry.department_id, lambda queue: queue.discard(entry.id))
+    else:
+        _changed(entry.department_id, lambda queue: queue.push(_key(entry), entry.updated_at))
+
+
+def entry_deleted(entry):
+    _changed(entry.department_id, lambda queue: queue.discard(entry.id))
+
+
+def call_next(department_id, user):
+    """Claim the most urgent waiting entry of a department for ``user``; ``None`` if nobody waits.
+
+    The heap picks the candidate and a conditional UPDATE claims it. The
+    UPDATE only matches an entry that is still waiting, so two nurses, even
+    in different worker processes, can never call the same patient. When a
+    claim loses, the next candidate is tried.
+    """
+    queue = queue_for(department_id)
+    while True:
+        with queue.lock:
+            top = queue.pop()
+        if top is None:
+            return None
+        now = timezone.now()
+        claimed = TriageQueue.objects.filter(id=top[2], department_id=department_id, is_processed=False).update(
+            is_processed=True, called_at=now, called_by=user, updated_at=now,
+        )
+        _changed(department_id, lambda q: q.discard(top[2]))
+        if claimed:
+            entry = TriageQueue.objects.select_related('patient', 'appointment__doctor').get(id=top[2])
+            entry_called.send(sender=TriageQueue, entry=entry)
+            return entry
+
+
+def waiting(department_id, limit=10):
+    """The next ``limit`` entries in call order, from the mirror, plus how many are waiting"""
+    queue = queue_for(department_id)
+    with queue.lock:
+        top = queue.ordered(limit)
+        count = len(queue)
+    entries = TriageQueue.objects.select_related('patient').in_bulk([key[2] for key in top])
+    return [entries[key[2]] for key in top if key[2] in entries], count
+
+
+def position(entry):
+    """1-based place of a waiting entry in its department's call order.
+
+    More urgent ranks come from the mirror's counts; earlier arrivals of the
+    same rank are one range COUNT on the (is_processed, rank, checked_in_at) index.
+    """
+    queue = queue_for(entry.department_id)
+    with queue.lock:
+        ahead = queue.ahead_of_rank(entry.rank)
+    ahead += TriageQueue.objects.filter(
+        Q(checked_in_at__lt=entry.checked_in_at) | Q(checked_in_at=entry.checked_in_at, id__lt=entry.id),
+        is_processed=False, rank=entry.rank, department_id=entry.department_id,
+    ).count()
+    return ahead + 1
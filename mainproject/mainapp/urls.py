@@ -20,16 +20,24 @@ urlpatterns = [
     path('doctor/profile/', views.doctor_profile, name='doctor_profile'),
     path('profile/security/', views.profile_security, name='profile_security'),
     path('staff/dashboard/', views.staff_dashboard, name='staff_dashboard'),
+    path('staff/dashboard/data/', views.staff_dashboard_data, name='staff_dashboard_data'),
     path('staff/profile/', views.staff_profile, name='staff_profile'),
     path('patient/dashboard/', views.patient_dashboard, name='patient_dashboard'),
+    path('patient/timeline/', views.patient_timeline, name='patient_timeline'),
     
     # Appointments
     path('appointments/', views.appointment_list, name='appointment_list'),
+    path('appointments/json/', views.appointment_list_json, name='appointment_list_json'),
     path('appointments/complete/<int:appt_id>/', views.complete_appointment, name='complete_appointment'),
+    path('appointments/status/', views.bulk_appointment_status, name='bulk_appointment_status'),
     path('book-appointment/', views.book_appointment_view, name='book_appointment_view'),
+    path('appointments/bulk/', views.bulk_book_appointments, name='bulk_book_appointments'),
+    path('appointments/series/<int:series_id>/following/', views.series_following, name='series_following'),
+    path('appointments/slots/', views.doctor_slots, name='doctor_slots'),
     
     # Patient Management
     path('patients/', views.patient_list, name='patient_list'),
+    path('patients/search/', views.patient_search, name='patient_search'),
     path('patients/create-guest/', views.create_guest_patient, name='create_guest_patient'),
     path('patient/<int:patient_id>/', views.patient_detail, name='patient_detail'),
     
@@ -44,12 +52,18 @@ urlpatterns = [
     # Triage
     path('triage/', views.triage_form, name='triage_form'),
     path('triage/<int:patient_id>/', views.triage_form, name='triage_form_patient'),
+    path('triage/call-next/', views.call_next_patient, name='call_next_patient'),
+    path('triage/wait/', views.triage_wait_times, name='triage_wait_times'),
     
     # Notifications
     path('notifications/', views.notifications_view, name='notifications'),
+    path('notifications/read-all/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
+    path('notifications/send/', views.send_notifications, name='send_notifications'),
+    path('events/', views.event_stream, name='event_stream'),
     
     # Reports
     path('reports/', views.reports_view, name='reports'),
+    path('exports/<str:kind>/', views.export_data, name='export_data'),
 
     # Admin User Management
     path('admin/add-doctor/', views.admin_add_doctor, name='admin_add_doctor'),
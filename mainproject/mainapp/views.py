@@ -2,10 +2,16 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db.models import Q, Count
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.db.models import Q, Count, Sum, Prefetch, prefetch_related_objects
 from django.utils import timezone
 from datetime import datetime, date, timedelta
+import csv
+import io
+import json
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
@@ -15,6 +21,11 @@ from django.urls import reverse
 from .models import *
 from .forms import *
 from .decorators import role_required
+from . import events, exports, notifications, panels, reports, revenue, rollups, scheduling, search, snapshots, timeline, triage, waittimes
+from . import series as series_ops
+from .pagination import decode_keyset, keyset_page
+from .querybudget import query_budget
+from .transitions import TRANSITIONS, bulk_transition
 
 
 def home(request):
@@ -130,41 +141,24 @@ def logout_view(request):
     logout(request)
     return redirect('home')
 
+@query_budget(8)
 @role_required(['ADMIN'])
 def admin_dashboard(request):
-    from django.db.models import Sum
-    total_patients = PatientProfile.objects.count()
-    total_doctors = DoctorProfile.objects.count()
-    total_staff = StaffProfile.objects.count()
-    total_appointments = Appointment.objects.count()
-    
-    # Calculate revenue from completed appointments
-    revenue = Appointment.objects.filter(status='COMPLETED').aggregate(
-        total=Sum('doctor__doctorprofile__consultation_fee')
-    )['total'] or 0
-    
-    context = {
-        'total_patients': total_patients,
-        'total_doctors': total_doctors,
-        'total_staff': total_staff,
-        'total_users': User.objects.count(),
-        'total_appointments': total_appointments,
-        'revenue': revenue,
-        'doctors': User.objects.filter(role='DOCTOR'),
-        'departments': Department.objects.all(),
-    }
+    context = dict(snapshots.admin_snapshot())
+    context['doctors'] = User.objects.filter(role='DOCTOR').select_related('doctorprofile__department')
     return render(request, 'admin_dashboard.html', context)
 
+@query_budget(10)
 @role_required(['DOCTOR'])
 def doctor_dashboard(request):
     today = date.today()
-    appointments = Appointment.objects.filter(doctor=request.user, appointment_date=today)
+    appointments = Appointment.objects.filter(doctor=request.user, appointment_date=today).select_related('patient')
     doctor_profile = DoctorProfile.objects.filter(user=request.user).first()
     
     # Do not force redirect from dashboard; initial login already handles first-login flow.
 
     # Calculate statistics
-    total_patients_count = User.objects.filter(role='PATIENT', patient_appointments__doctor=request.user).distinct().count()
+    total_patients_count = DoctorPatientPanel.objects.filter(doctor=request.user).count()
     pending_requests_count = Appointment.objects.filter(doctor=request.user, status='PENDING').count()
 
     context = {
@@ -173,7 +167,7 @@ def doctor_dashboard(request):
         'doctor_profile': doctor_profile,
         'total_patients': total_patients_count,
         'pending_requests': pending_requests_count,
-        'notifications': Notification.objects.filter(user=request.user, is_read=False)[:5],
+        'notifications': notifications.recent_unread(request.user.id),
     }
     return render(request, 'doctor_dashboard.html', context)
 
@@ -279,24 +273,76 @@ def profile_security(request):
         'base_template': base_template
     })
 
+@query_budget(12)
 @role_required(['STAFF'])
 def staff_dashboard(request):
-    today = date.today()
-    staff_profile = StaffProfile.objects.filter(user=request.user).first()
-    today_appointments = Appointment.objects.filter(appointment_date=today).order_by('appointment_time')
-    
-    context = {
-        'today_appointments': today_appointments,
-        'appointments_today_count': today_appointments.count(),
-        'patients_waiting_count': TriageQueue.objects.filter(is_processed=False).count(),
-        'doctors_on_duty_count': DoctorProfile.objects.filter(is_available=True).count(),
-        'pending_requests_count': Appointment.objects.filter(status='PENDING').count(),
-        'current_date': today.strftime("%Y-%m-%d"),
+    version = _staff_board_etag(request)
+    board = snapshots.staff_board()
+    staff_profile = StaffProfile.objects.filter(user=request.user).select_related('department').first()
+    context = dict(board)
+    context.update(_triage_board(staff_profile.department_id if staff_profile else None))
+    context.update({
+        'current_date': board['date'],
+        'board_version': version,
         'staff_profile': staff_profile,
-        'notifications': Notification.objects.filter(user=request.user, is_read=False)[:5],
-    }
+        'notifications': notifications.recent_unread(request.user.id),
+    })
     return render(request, 'staff_dashboard.html', context)
 
+def _triage_board(department_id):
+    # The department's next waiting entries with their place and estimated wait, plus typical waits
+    triage_waiting, triage_waiting_count = triage.waiting(department_id)
+    wait_stats = waittimes.department_stats(department_id)
+    interval = waittimes.call_interval(department_id)
+    now = timezone.now()
+    for place, entry in enumerate(triage_waiting, 1):
+        entry.position = place
+        entry.estimated_wait = waittimes.estimate(
+            wait_stats[entry.rank], (now - entry.checked_in_at).total_seconds(), place, interval,
+        )
+    return {
+        'triage_waiting': triage_waiting,
+        'triage_waiting_count': triage_waiting_count,
+        'wait_times': _wait_summaries(wait_stats),
+    }
+
+def _staff_board_etag(request):
+    # The date is part of the tag so the queue rolls over at midnight
+    return f'{timezone.localdate().isoformat()}-{snapshots.staff_board_stamp():.6f}'
+
+def _staff_board_modified(request):
+    midnight = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+    return max(datetime.fromtimestamp(snapshots.staff_board_stamp(), tz=timezone.get_current_timezone()), midnight)
+
+@query_budget(12)
+@role_required(['STAFF'])
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_staff_board_etag, last_modified_func=_staff_board_modified)
+def staff_dashboard_data(request):
+    """Counters, today's queue and the triage waiting list for the staff dashboard to poll.
+
+    Polls carrying the current ETag get a 304 from the cached version stamp
+    without querying the appointment tables.
+    """
+    # Read the stamp first so a change made while building the board is picked up by the next poll
+    version = _staff_board_etag(request)
+    board = snapshots.staff_board()
+    waiting = _triage_board(_own_department_id(request.user))
+    board['triage'] = {
+        'count': waiting['triage_waiting_count'],
+        'waiting': [{
+            'id': entry.id,
+            'position': entry.position,
+            'priority': entry.priority_level,
+            'patient': entry.patient.name,
+            'complaint': entry.chief_complaint,
+            'checked_in': timezone.localtime(entry.checked_in_at).strftime('%H:%M'),
+            'estimated_wait': entry.estimated_wait,
+        } for entry in waiting['triage_waiting']],
+        'wait_times': waiting['wait_times'],
+    }
+    return JsonResponse({'success': True, 'version': version, **board})
+
 # uhunnhnybybygy
 
 @role_required(['STAFF'])
@@ -348,33 +394,48 @@ def staff_profile(request):
     }
     return render(request, 'staff_profile.html', context)
 
+@query_budget(10)
 @role_required(['PATIENT'])
 def patient_dashboard(request):
-    from datetime import date
-    patient_profile = PatientProfile.objects.filter(user=request.user).first()
-    appointments = Appointment.objects.filter(patient=request.user).order_by('-appointment_date')
-    medical_history = MedicalHistory.objects.filter(patient=request.user).order_by('-date')
-    
-    # Calculate health status metrics
-    last_visit = medical_history.first()
-    next_appointment = appointments.filter(
-        appointment_date__gte=date.today()
-    ).order_by('appointment_date').first()
-    active_prescriptions_count = medical_history.filter(
-        prescription__isnull=False
-    ).count()
-    
-    context = {
-        'appointments': appointments[:5],
-        'medical_history': medical_history[:5],
-        'patient_profile': patient_profile,
-        'last_visit_date': last_visit.date if last_visit else None,
-        'next_appointment': next_appointment,
-        'active_prescriptions_count': active_prescriptions_count,
-        'notifications': Notification.objects.filter(user=request.user, is_read=False)[:5],
-    }
+    timeline_items, timeline_cursor = timeline.timeline_page(request.user, page_size=10)
+    context = timeline.timeline_summary(request.user)
+    context.update({
+        'timeline': timeline_items,
+        'timeline_cursor': timeline_cursor,
+        'patient_profile': PatientProfile.objects.filter(user=request.user).first(),
+        'notifications': notifications.recent_unread(request.user.id),
+    })
     return render(request, 'patient_dashboard.html', context)
 
+@query_budget(8)
+@role_required(['PATIENT', 'DOCTOR', 'STAFF', 'ADMIN'])
+def patient_timeline(request):
+    """One page of a patient's timeline; patients see their own, others pass ``patient``.
+
+    Doctors only reach patients on their panel, as in the patient list.
+    """
+    if request.user.role == 'PATIENT':
+        patient = request.user
+    else:
+        patients = User.objects.filter(role='PATIENT')
+        if request.user.role == 'DOCTOR':
+            patients = patients.filter(panel_doctors__doctor=request.user)
+        try:
+            patient = patients.get(id=int(request.GET.get('patient', '')))
+        except (ValueError, User.DoesNotExist):
+            return JsonResponse({'success': False, 'error': 'Unknown patient'}, status=404)
+    try:
+        page_size = int(request.GET.get('page_size', timeline.TIMELINE_PAGE_SIZE))
+    except ValueError:
+        page_size = timeline.TIMELINE_PAGE_SIZE
+
+    items, next_cursor = timeline.timeline_page(patient, request.GET.get('cursor'), page_size)
+    return JsonResponse({
+        'success': True,
+        'results': [timeline.serialize(item) for item in items],
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def dashboard(request):
     # Redirect user to their role-specific dashboard
@@ -397,6 +458,8 @@ def book_appointment_view(request):
         appointment_time = request.POST.get('appointment_time')
         reason = request.POST.get('reason')
         
+        is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+        
         doctor = get_object_or_404(User, id=doctor_id, role='DOCTOR')
         
         if request.user.role == 'STAFF':
@@ -404,24 +467,38 @@ def book_appointment_view(request):
         else:
             patient = request.user
 
-        appointment = Appointment.objects.create(
-            patient=patient,
-            doctor=doctor,
-            appointment_date=appointment_date,
-            appointment_time=appointment_time,
-            reason=reason
-        )
+        # Only allow booking into a free slot within the doctor's working hours
+        day, requested_time = scheduling.parse_slot(appointment_date, appointment_time)
+
+        repeat = request.POST.get('repeat', '')
+        if repeat in dict(AppointmentSeries.FREQUENCY_CHOICES):
+            return _book_series(request, patient, doctor, day, requested_time, reason, repeat, is_ajax)
+        appointment, suggestions = None, []
+        if day and day >= timezone.localdate():
+            appointment, suggestions = scheduling.book_slot(patient.id, doctor.id, day, requested_time, reason)
+        else:
+            suggestions = scheduling.next_free_slots(doctor.id, timezone.localdate(), 3)
+
+        if appointment is None:
+            suggestions = [s.strftime('%Y-%m-%d %H:%M') for s in suggestions]
+            error = 'The selected time slot is not available.'
+            if suggestions:
+                error += ' Next available: ' + ', '.join(suggestions)
+            if is_ajax:
+                return JsonResponse({'success': False, 'error': error, 'suggestions': suggestions}, status=409)
+            messages.error(request, error)
+            return redirect('book_appointment_view')
         
         messages.success(request, 'Appointment booked successfully!')
         
-        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        if is_ajax:
             return JsonResponse({'success': True, 'appointment_id': appointment.id, 'status': appointment.status})
 
         if request.user.role == 'STAFF':
             return redirect('staff_dashboard')
         return redirect('patient_dashboard')
     
-    doctors = User.objects.filter(role='DOCTOR', is_active_user=True)
+    doctors = User.objects.filter(role='DOCTOR', is_active_user=True).select_related('doctorprofile')
     patients = User.objects.filter(role='PATIENT') if request.user.role == 'STAFF' else None
     
     if request.user.role == 'STAFF':
@@ -437,10 +514,175 @@ def book_appointment_view(request):
         'base_template': base_template
     })
 
+BULK_BOOKING_LIMIT = 2000
+
+
+def _parse_booking_rows(request):
+    """Read booking rows from an uploaded/posted CSV or a JSON body"""
+    upload = request.FILES.get('file')
+    if upload or 'csv' in request.content_type:
+        raw = upload.read() if upload else request.body
+        return list(csv.DictReader(io.StringIO(raw.decode('utf-8-sig'))))
+    payload = json.loads(request.body or b'[]')
+    if isinstance(payload, dict):
+        payload = payload.get('appointments', [])
+    if not isinstance(payload, list) or not all(isinstance(row, dict) for row in payload):
+        raise ValueError('Expected a list of appointment objects')
+    return payload
+
+
+# About 20 fixed queries, plus one INSERT per ~100 rows (SQLite's 999-parameter cap) up to BULK_BOOKING_LIMIT
+@query_budget(42)
+@role_required(['STAFF'])
+def bulk_book_appointments(request):
+    """Book a batch of appointments in one request.
+
+    Accepts JSON ``{"appointments": [{patient, doctor, date, time, reason}, ...]}``
+    or CSV with those column headers. Returns one result per row.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=400)
+
+    try:
+        rows = _parse_booking_rows(request)
+    except (ValueError, UnicodeDecodeError, csv.Error) as exc:
+        return JsonResponse({'success': False, 'error': f'Could not read rows: {exc}'}, status=400)
+
+    if not rows:
+        return JsonResponse({'success': False, 'error': 'No rows supplied'}, status=400)
+    if len(rows) > BULK_BOOKING_LIMIT:
+        return JsonResponse({'success': False, 'error': f'At most {BULK_BOOKING_LIMIT} rows per request'}, status=400)
+
+    results = scheduling.book_batch(rows)
+    booked = sum(1 for r in results if r['success'])
+    return JsonResponse({
+        'success': booked == len(rows),
+        'booked': booked,
+        'failed': len(rows) - booked,
+        'results': results,
+    })
+
+@login_required
+def doctor_slots(request):
+    """Free slots for a doctor as JSON.
+
+    Query params: doctor (user id), date (YYYY-MM-DD, defaults to today), n (max 50)
+    """
+    try:
+        doctor_id = int(request.GET.get('doctor', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid doctor'}, status=400)
+    if not User.objects.filter(id=doctor_id, role='DOCTOR').exists():
+        return JsonResponse({'success': False, 'error': 'Unknown doctor'}, status=404)
+
+    day, _ = scheduling.parse_slot(request.GET.get('date') or timezone.localdate().isoformat(), '00:00')
+    if day is None:
+        return JsonResponse({'success': False, 'error': 'Invalid date'}, status=400)
+
+    try:
+        n = min(max(int(request.GET.get('n', 10)), 1), 50)
+    except ValueError:
+        n = 10
+
+    slots = scheduling.next_free_slots(doctor_id, day, n)
+    return JsonResponse({
+        'success': True,
+        'doctor': doctor_id,
+        'slots': [{'date': s.date().isoformat(), 'time': s.strftime('%H:%M')} for s in slots],
+    })
+
+@role_required(['ADMIN', 'STAFF'])
+def patient_search(request):
+    """Ranked prefix search over patients for pickers. Query params: q, n (max 50)"""
+    try:
+        limit = min(max(int(request.GET.get('n', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    patients = search.search_users(request.GET.get('q', ''), role='PATIENT', limit=limit)
+    return JsonResponse({
+        'success': True,
+        'results': [{'id': p.id, 'name': p.name, 'email': p.email} for p in patients],
+    })
+
+def _book_series(request, patient, doctor, day, requested_time, reason, frequency, is_ajax):
+    try:
+        occurrences = int(request.POST.get('occurrences', 4))
+        interval = int(request.POST.get('interval', 1))
+    except ValueError:
+        occurrences = interval = 0
+
+    error = None
+    if not day or day < timezone.localdate():
+        error = 'Choose a start date from today onwards.'
+    elif not 2 <= occurrences <= series_ops.MAX_OCCURRENCES or not 1 <= interval <= 12:
+        error = f'A series needs 2 to {series_ops.MAX_OCCURRENCES} visits, repeating every 1 to 12 periods.'
+    if error:
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': error}, status=400)
+        messages.error(request, error)
+        return redirect('book_appointment_view')
+
+    series, results = series_ops.create_series(
+        patient.id, doctor.id, day, requested_time, frequency, interval, occurrences, reason
+    )
+    booked = [r for r in results if r['success']]
+    if is_ajax:
+        return JsonResponse({
+            'success': series is not None,
+            'series_id': series.id if series else None,
+            'booked': len(booked),
+            'results': results,
+        }, status=200 if series else 409)
+
+    if series:
+        messages.success(request, f'{len(booked)} of {len(results)} recurring appointments booked.')
+        skipped = [r['date'] for r in results if not r['success']]
+        if skipped:
+            messages.warning(request, 'Not available on: ' + ', '.join(skipped))
+    else:
+        messages.error(request, 'None of the recurring dates are available at that time.')
+        return redirect('book_appointment_view')
+    if request.user.role == 'STAFF':
+        return redirect('staff_dashboard')
+    return redirect('patient_dashboard')
+
+@role_required(['PATIENT', 'STAFF', 'DOCTOR'])
+def series_following(request, series_id):
+    """Cancel or reschedule one occurrence of a series and all that follow it.
+
+    POST from_date (YYYY-MM-DD), action ("cancel" or "reschedule") and, for
+    reschedule, time (HH:MM) and/or reason.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=400)
+    series = get_object_or_404(AppointmentSeries, id=series_id)
+    if (request.user.role == 'PATIENT' and series.patient_id != request.user.id) or \
+            (request.user.role == 'DOCTOR' and series.doctor_id != request.user.id):
+        return JsonResponse({'success': False, 'error': 'Not your appointment series'}, status=403)
+
+    from_date, _ = scheduling.parse_slot(request.POST.get('from_date'), '00:00')
+    if from_date is None:
+        return JsonResponse({'success': False, 'error': 'Invalid from_date'}, status=400)
+
+    action = request.POST.get('action')
+    if action == 'cancel':
+        result = series_ops.cancel_following(series, from_date)
+        return JsonResponse({'success': True, 'cancelled': result['updated'], 'skipped': result['skipped']})
+    if action == 'reschedule':
+        new_time = None
+        if request.POST.get('time'):
+            _, new_time = scheduling.parse_slot(from_date.isoformat(), request.POST.get('time'))
+            if new_time is None:
+                return JsonResponse({'success': False, 'error': 'Invalid time'}, status=400)
+        result = series_ops.reschedule_following(series, from_date, new_time, request.POST.get('reason', '').strip())
+        return JsonResponse({'success': not result['conflicts'], **result}, status=409 if result['conflicts'] else 200)
+    return JsonResponse({'success': False, 'error': 'Unknown action'}, status=400)
+
+@query_budget(10)
 @role_required(['ADMIN', 'DOCTOR', 'STAFF'])
 def patient_list(request):
     if request.user.role == 'DOCTOR':
-        patients = User.objects.filter(role='PATIENT', patient_appointments__doctor=request.user).distinct()
+        patients = User.objects.filter(role='PATIENT', panel_doctors__doctor=request.user)
     else:
         patients = User.objects.filter(role='PATIENT')
     selected_patient_id = request.GET.get('p')
@@ -473,34 +715,49 @@ def patient_list(request):
 def patient_detail(request, patient_id):
     return redirect(f"/patients/?p={patient_id}")
 
+@query_budget(8)
 @role_required(['ADMIN', 'DOCTOR'])
 def reports_view(request):
-    if request.user.role == 'DOCTOR':
-        # Get count for each weekday (1=Sunday, 2=Monday, ..., 6=Friday, 7=Saturday)
-        # We focus on work days: Mon-Fri (2-6)
-        density_data = []
-        weekdays = [
-            (2, 'Mon'), (3, 'Tue'), (4, 'Wed'), (5, 'Thu'), (6, 'Fri')
-        ]
-        
-        max_count = 0
-        counts = []
-        for day_num, day_name in weekdays:
-            count = Appointment.objects.filter(doctor=request.user, appointment_date__week_day=day_num).count()
-            counts.append({'day': day_name, 'count': count})
-            if count > max_count:
-                max_count = count
-        
-        # Scale to percentage for bar height
-        for item in counts:
-            height = (item['count'] / max_count * 100) if max_count > 0 else 0
-            density_data.append({'label': item['day'], 'height': height, 'count': item['count']})
+    """Appointment density, status and revenue for a date range.
 
-        # Basic patient stats
-        total_patients_count = User.objects.filter(patient_appointments__doctor=request.user).distinct().count()
+    Doctors see their own figures; admins see the whole hospital or one
+    department (``?department=``). ``start``/``end`` take ``YYYY-MM-DD``.
+    """
+    start, end = reports.default_range()
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else start
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else end
+    except ValueError:
+        messages.error(request, 'Dates must be in YYYY-MM-DD format.')
+    if start > end:
+        start, end = end, start
+
+    doctor_id = department_id = None
+    departments = []
+    if request.user.role == 'DOCTOR':
+        doctor_id = request.user.id
+        total_patients_count = DoctorPatientPanel.objects.filter(doctor=request.user).count()
     else:
-        density_data = []
-        total_patients_count = 0
+        department_id = request.GET.get('department', '')
+        department_id = int(department_id) if department_id.isdigit() else None
+        departments = Department.objects.order_by('name')
+        total_patients_count = None
+
+    report = reports.build_report(start, end, doctor_id=doctor_id, department_id=department_id)
+
+    # Mon-Fri bars scaled to the busiest day
+    by_weekday = report['density']['by_weekday'][:5]
+    busiest = max(by_weekday) or 1
+    density_data = [
+        {'label': label, 'count': count, 'height': count / busiest * 100}
+        for label, count in zip(reports.WEEKDAYS, by_weekday)
+    ]
+    # Heatmap rows trimmed to the hours that saw any bookings
+    hours = [h for h, n in enumerate(report['density']['by_hour']) if n]
+    heatmap = [
+        {'label': label, 'cells': [{'hour': h, 'count': row[h], 'level': row[h] / (report['density']['max'] or 1)} for h in hours]}
+        for label, row in zip(reports.WEEKDAYS, report['density']['matrix'])
+    ]
 
     if request.user.role == 'DOCTOR':
         base_template = 'base_doctor.html'
@@ -510,12 +767,46 @@ def reports_view(request):
         base_template = 'base.html'
 
     context = {
+        'report': report,
+        'snapshot_built_at': datetime.fromtimestamp(report['snapshot_built_at'], tz=timezone.get_current_timezone()) if 'snapshot_built_at' in report else None,
         'density_data': density_data,
+        'heatmap': heatmap,
+        'heatmap_hours': hours,
+        'departments': departments,
+        'selected_department': department_id,
         'total_patients': total_patients_count,
         'base_template': base_template
     }
     return render(request, 'reports.html', context)
 
+@query_budget(6)
+@role_required(['ADMIN'])
+def export_data(request, kind):
+    """Stream appointments, medical records or prescriptions as CSV or NDJSON.
+
+    Query parameters: ``format`` (csv/ndjson), ``gzip=1``, ``start``/``end``
+    (YYYY-MM-DD) and ``doctor``.
+    """
+    if kind not in exports.EXPORTS:
+        return JsonResponse({'success': False, 'error': f'Unknown export: {kind}'}, status=404)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'success': False, 'error': 'format must be csv or ndjson'}, status=400)
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+        doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid start, end or doctor'}, status=400)
+
+    compress = request.GET.get('gzip') in ('1', 'true')
+    response = StreamingHttpResponse(
+        exports.stream(kind, fmt, compress, start, end, doctor_id),
+        content_type='application/gzip' if compress else exports.FORMATS[fmt][0],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(kind, fmt, compress)}"'
+    return response
+
 @role_required(['DOCTOR'])
 def add_medical_record(request, patient_id):
     if request.method == 'POST':
@@ -537,15 +828,57 @@ def add_medical_record(request, patient_id):
 
 @role_required(['DOCTOR'])
 def complete_appointment(request, appt_id):
-    appt = get_object_or_404(Appointment, id=appt_id)
+    appt = get_object_or_404(Appointment.objects.select_related('patient').only('id', 'doctor_id', 'patient__name'), id=appt_id)
     # Only the doctor assigned to the appointment may mark it completed
-    if appt.doctor != request.user:
+    if appt.doctor_id != request.user.id:
         messages.error(request, "You can only complete your own appointments.")
         return redirect('appointment_list')
 
-    appt.status = 'COMPLETED'
-    appt.save()
-    messages.success(request, f"Appointment for {appt.patient.name} marked as completed.")
+    result = bulk_transition(Appointment.objects.filter(id=appt.id), 'COMPLETED')
+    if result['updated']:
+        messages.success(request, f"Appointment for {appt.patient.name} marked as completed.")
+    else:
+        messages.error(request, f"Appointment for {appt.patient.name} cannot be completed ({result['skipped'][0]['status'].lower()}).")
+    return redirect('appointment_list')
+
+@query_budget(30)
+@role_required(['DOCTOR', 'STAFF', 'ADMIN'])
+def bulk_appointment_status(request):
+    """Move many appointments to one status.
+
+    POST ids (repeated or comma separated) and status. Doctors can only
+    change their own appointments. Returns JSON for AJAX requests,
+    otherwise redirects back to the appointment list.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=400)
+    is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+    target = request.POST.get('status', '')
+    try:
+        ids = {int(i) for value in request.POST.getlist('ids') for i in value.split(',') if i.strip()}
+    except ValueError:
+        ids = None
+    if not ids or target not in TRANSITIONS:
+        error = 'Select at least one appointment and a valid status.'
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': error}, status=400)
+        messages.error(request, error)
+        return redirect('appointment_list')
+
+    appointments = Appointment.objects.filter(id__in=ids)
+    if request.user.role == 'DOCTOR':
+        appointments = appointments.filter(doctor=request.user)
+    result = bulk_transition(appointments, target)
+    found = set(result['updated']) | {row['id'] for row in result['skipped']}
+    result['skipped'] += [{'id': i, 'error': 'Not found'} for i in sorted(ids - found)]
+
+    if is_ajax:
+        return JsonResponse({'success': not result['skipped'], **result})
+    if result['updated']:
+        messages.success(request, f"{len(result['updated'])} appointment(s) marked as {target.lower()}.")
+    if result['skipped']:
+        messages.warning(request, f"{len(result['skipped'])} appointment(s) could not be changed.")
     return redirect('appointment_list')
 
 @role_required(['DOCTOR'])
@@ -557,10 +890,17 @@ def doctor_list(request):
     doctors = User.objects.filter(role='DOCTOR')
     return render(request, 'doctor_list.html', {'doctors': doctors})
 
+@query_budget(46)
 @role_required(['ADMIN'])
 def delete_doctor(request, doctor_id):
     doctor = get_object_or_404(User, id=doctor_id, role='DOCTOR')
-    doctor.delete()
+    # The doctor's DailyStats rows cascade with them, so skip the per-appointment rollup updates
+    # and reverse their revenue in the ledger in one go; panel refreshes for the cascading
+    # appointments and records are applied once at the end
+    with transaction.atomic(), rollups.paused(), panels.deferred():
+        completed = Appointment.objects.filter(doctor=doctor, status='COMPLETED').values_list('id', flat=True)
+        revenue.charge(list(completed), sign=-1)
+        doctor.delete()
     messages.success(request, 'Doctor deleted successfully')
     return redirect('hospital_admin_dashboard')
 
@@ -620,12 +960,112 @@ def triage_form(request, patient_id=None):
     }
     return render(request, 'triage_form.html', context)
 
+def _own_department_id(user):
+    profile = {'STAFF': StaffProfile, 'DOCTOR': DoctorProfile}.get(user.role)
+    if profile is None:
+        return None
+    return profile.objects.filter(user=user).values_list('department_id', flat=True).first()
+
+@query_budget(8)
+@role_required(['STAFF', 'DOCTOR', 'ADMIN'])
+def call_next_patient(request):
+    """Claim the most urgent waiting triage entry of a department.
+
+    POST department (an id, or "walk-in" for entries without one); staff and
+    doctors default to their own department. Returns JSON for AJAX requests,
+    otherwise redirects back to the dashboard with a message.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=400)
+    is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+    department = request.POST.get('department', '')
+    if department == 'walk-in':
+        department_id = None
+    elif department.isdigit():
+        department_id = int(department)
+    elif not department:
+        department_id = _own_department_id(request.user)
+    else:
+        return JsonResponse({'success': False, 'error': 'Invalid department'}, status=400)
+
+    entry = triage.call_next(department_id, request.user)
+    back = {'STAFF': 'staff_dashboard', 'DOCTOR': 'doctor_dashboard'}.get(request.user.role, 'dashboard')
+    if entry is None:
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': 'No patients waiting'}, status=404)
+        messages.info(request, 'No patients waiting.')
+        return redirect(back)
+
+    if is_ajax:
+        return JsonResponse({'success': True, 'entry': {
+            'id': entry.id,
+            'patient': {'id': entry.patient.id, 'name': entry.patient.name},
+            'priority': entry.priority_level,
+            'checked_in_at': entry.checked_in_at.isoformat(),
+            'appointment': entry.appointment_id,
+            'doctor': entry.appointment.doctor.name if entry.appointment else None,
+        }})
+    messages.success(request, f"Calling {entry.patient.name} ({entry.get_priority_level_display()} priority).")
+    return redirect(back)
+
+def _wait_summaries(wait_stats):
+    names = {rank: level for level, rank in TriageQueue.RANKS.items()}
+    return [{'priority': names[rank], **stats.summary()} for rank, stats in sorted(wait_stats.items())]
+
+@query_budget(6)
 @login_required
-def appointment_list(request):
-    # Retrieve filters
+def triage_wait_times(request):
+    """Wait-time estimates for a triage queue as JSON.
+
+    Patients get their own place in the queue. Staff, doctors and admins get
+    the per-priority figures for a department (``?department=``, defaulting
+    to their own), and ``?entry=`` adds one entry's place and estimate. The
+    figures are read from running statistics in the cache, not recomputed.
+    """
+    user = request.user
+    if user.role == 'PATIENT':
+        entry = TriageQueue.objects.filter(patient=user, is_processed=False).order_by('-checked_in_at').first()
+        department_id = entry.department_id if entry else None
+    else:
+        entry_id = request.GET.get('entry', '')
+        department = request.GET.get('department', '')
+        if (entry_id and not entry_id.isdigit()) or (department and department != 'walk-in' and not department.isdigit()):
+            return JsonResponse({'success': False, 'error': 'Invalid entry or department'}, status=400)
+        entry = TriageQueue.objects.filter(id=entry_id, is_processed=False).first() if entry_id else None
+        if entry is not None:
+            department_id = entry.department_id
+        elif department == 'walk-in':
+            department_id = None
+        else:
+            department_id = int(department) if department else _own_department_id(user)
+
+    wait_stats = waittimes.department_stats(department_id)
+    data = {'success': True, 'department': department_id, 'entry': None}
+    if user.role != 'PATIENT':
+        data['priorities'] = _wait_summaries(wait_stats)
+    if entry is not None:
+        waited = (timezone.now() - entry.checked_in_at).total_seconds()
+        position = triage.position(entry)
+        data['entry'] = {
+            'id': entry.id,
+            'priority': entry.priority_level,
+            'position': position,
+            'waited_minutes': round(waited / 60, 1),
+            'estimated_remaining_minutes': waittimes.estimate(
+                wait_stats[entry.rank], waited, position, waittimes.call_interval(department_id),
+            ),
+        }
+    return JsonResponse(data)
+
+APPOINTMENT_PAGE_SIZE = 24
+APPOINTMENT_KEYSET = ('appointment_date', 'appointment_time', 'id')
+
+
+def _visible_appointments(request):
+    """Appointments the current user may see, with the list's search/status filters applied"""
     query = request.GET.get('q', '')
     status_filter = request.GET.get('status', '')
-    
+
     if request.user.role == 'DOCTOR':
         appointments = Appointment.objects.filter(doctor=request.user)
     elif request.user.role == 'PATIENT':
@@ -633,19 +1073,48 @@ def appointment_list(request):
     else:
         appointments = Appointment.objects.all()
 
-    # Apply search filter
+    # Apply search filter (full-text index over patient name, email, ID and phone)
     if query:
-        appointments = appointments.filter(patient__name__icontains=query)
+        appointments = search.filter_by_user(appointments, query, 'patient_id')
     
     # Apply status filter
     if status_filter:
         appointments = appointments.filter(status=status_filter)
-        
-    appointments = appointments.order_by('-appointment_date', '-appointment_time')
+
+    return appointments, query, status_filter
+
+
+def _appointment_page(request):
+    appointments, query, status_filter = _visible_appointments(request)
+    # Only load the columns the cards render, joined in the same query
+    appointments = appointments.select_related(
+        'patient', 'doctor', 'doctor__doctorprofile'
+    ).only(
+        'id', 'appointment_date', 'appointment_time', 'status', 'reason',
+        'patient__id', 'patient__name',
+        'doctor__id', 'doctor__name', 'doctor__doctorprofile__specialty',
+    )
+    rows, next_cursor = keyset_page(
+        appointments, APPOINTMENT_KEYSET,
+        cursor=request.GET.get('cursor'), page_size=APPOINTMENT_PAGE_SIZE,
+    )
+    return rows, next_cursor, query, status_filter
+
+
+@query_budget(10)
+@login_required
+def appointment_list(request):
+    appointments, next_cursor, query, status_filter = _appointment_page(request)
+    prefetch_related_objects(appointments, Prefetch(
+        'triagequeue_set',
+        queryset=TriageQueue.objects.only(
+            'id', 'appointment_id', 'blood_pressure', 'temperature', 'pulse_rate', 'weight', 'checked_in_at'
+        ).order_by('-checked_in_at'),
+    ))
         
     # Provide doctors and patients lists for staff modal booking
-    doctors = User.objects.filter(role='DOCTOR', is_active_user=True)
-    patients = User.objects.filter(role='PATIENT') if request.user.role == 'STAFF' else None
+    doctors = User.objects.filter(role='DOCTOR', is_active_user=True).only('id', 'name')
+    patients = User.objects.filter(role='PATIENT').only('id', 'name') if request.user.role == 'STAFF' else None
 
     if request.user.role == 'DOCTOR':
         base_template = 'base_doctor.html'
@@ -658,6 +1127,7 @@ def appointment_list(request):
 
     return render(request, 'appointment_list.html', {
         'appointments': appointments, 
+        'next_cursor': next_cursor,
         'base_template': base_template,
         'query': query,
         'status_filter': status_filter,
@@ -665,10 +1135,107 @@ def appointment_list(request):
         'patients': patients,
     })
 
+@query_budget(5)
+@login_required
+def appointment_list_json(request):
+    """One keyset page of the appointment list for infinite scroll.
+
+    Accepts the same q/status filters as the HTML page plus ``cursor``.
+    """
+    appointments, next_cursor, _, _ = _appointment_page(request)
+    return JsonResponse({
+        'success': True,
+        'results': [{
+            'id': appt.id,
+            'date': appt.appointment_date.isoformat(),
+            'time': appt.appointment_time.strftime('%H:%M'),
+            'status': appt.status,
+            'reason': appt.reason,
+            'patient': {'id': appt.patient.id, 'name': appt.patient.name},
+            'doctor': {'id': appt.doctor.id, 'name': appt.doctor.name},
+        } for appt in appointments],
+        'next_cursor': next_cursor,
+    })
+
+@query_budget(6)
 @login_required
 def notifications_view(request):
-    notifications = Notification.objects.filter(user=request.user)
-    return render(request, 'notifications.html', {'notifications': notifications})
+    """The user's inbox, newest first, a keyset page at a time (``?cursor=`` for older)"""
+    cursor = request.GET.get('cursor')
+    inbox, next_cursor = keyset_page(
+        Notification.objects.filter(user=request.user), notifications.INBOX_KEYSET,
+        cursor=cursor, page_size=notifications.INBOX_PAGE_SIZE,
+    )
+    return render(request, 'notifications.html', {
+        'notifications': inbox,
+        'next_cursor': next_cursor,
+        # A cursor that does not decode serves the first page, so label it as one
+        'is_first_page': decode_keyset(cursor, Notification, notifications.INBOX_KEYSET) is None,
+    })
+
+@query_budget(4)
+@login_required
+def mark_all_notifications_read(request):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=400)
+    updated = notifications.mark_read(request.user.id)
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'success': True, 'updated': updated})
+    messages.success(request, f'{updated} notification(s) marked as read.')
+    return redirect('notifications')
+
+@query_budget(2)
+@login_required
+async def event_stream(request):
+    """Server-sent events for the signed-in user.
+
+    Streams their notifications and appointment changes, and for staff the
+    triage and appointment queues. Served from mainproject.asgi, where an
+    idle connection is a parked coroutine rather than a thread. Under WSGI
+    it answers 204, which tells EventSource not to reconnect.
+    """
+    if not events.streaming_supported(request):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    response = StreamingHttpResponse(events.stream(events.channels_for(user)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx buffering the stream
+    return response
+
+@query_budget(4)
+@role_required(['DOCTOR', 'STAFF', 'ADMIN'])
+def send_notifications(request):
+    """Notify a whole audience in the background.
+
+    POST audience (department, doctor-patients or tomorrow), target (the
+    department or doctor id), title, message and optional type. Doctors can
+    only reach their own patients. Returns 202 once the job is queued.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=400)
+
+    audience = request.POST.get('audience')
+    target = request.POST.get('target') or None
+    title = request.POST.get('title', '').strip()
+    message = request.POST.get('message', '').strip()
+    notification_type = request.POST.get('type', 'GENERAL')
+    if request.user.role == 'DOCTOR':
+        if audience not in ('doctor-patients', 'tomorrow'):
+            return JsonResponse({'success': False, 'error': 'Doctors can only notify their own patients'}, status=403)
+        target = request.user.id
+    if audience not in notifications.AUDIENCES:
+        return JsonResponse({'success': False, 'error': f'Unknown audience {audience!r}'}, status=400)
+    if target is not None and not str(target).isdigit():
+        return JsonResponse({'success': False, 'error': 'target must be an id'}, status=400)
+    if audience != 'tomorrow' and target is None:
+        return JsonResponse({'success': False, 'error': 'target is required'}, status=400)
+    if not title or not message:
+        return JsonResponse({'success': False, 'error': 'title and message are required'}, status=400)
+    if notification_type not in dict(Notification.NOTIFICATION_TYPES):
+        return JsonResponse({'success': False, 'error': 'Unknown notification type'}, status=400)
+
+    notifications.enqueue(audience, target, title, message, notification_type)
+    return JsonResponse({'success': True, 'queued': True, 'audience': audience, 'target': target}, status=202)
 
 @role_required(['ADMIN'])
 def admin_add_doctor(request):
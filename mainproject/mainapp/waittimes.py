@@ -0,0 +1,203 @@
+import bisect
+import threading
+import time
+from django.core.cache import cache
+from .models import TriageQueue
+
+STATS_KEY = 'triage:wait:{}'
+# Weight of the newest wait in the moving average
+EWMA_ALPHA = 0.2
+QUANTILES = (0.5, 0.9)
+# Recent called entries replayed to seed a department's statistics when the cache has none
+WARMUP_SIZE = 500
+# Statistics are rebuilt from the table this often. Calls recorded by other workers (with a
+# per-process cache) or lost to concurrent read-modify-writes are folded in within this time.
+STATS_TTL = 5 * 60
+RANKS = sorted(TriageQueue.RANKS.values())
+# Statistics of the time between consecutive calls in a department, whatever the priority
+INTERVAL = 'interval'
+# Longer pauses between calls (breaks, nights) are idle time, not time spent seeing patients
+MAX_CALL_GAP = 60 * 60
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile in five markers (Jain & Chlamtac's P² algorithm).
+
+    Each observation is O(1) time and the state is a few numbers, so it can
+    live in the cache and be updated as entries are processed.
+    """
+
+    def __init__(self, p, state=None):
+        self.p = p
+        if state is None:
+            state = ([], [1, 2, 3, 4, 5], [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+        self.heights, self.positions, self.desired = state
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def state(self):
+        return self.heights, self.positions, self.desired
+
+    def add(self, x):
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = height
+                n[i] += step
+
+    def _parabolic(self, i, step):
+        q, n = self.heights, self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[round(self.p * (len(q) - 1))]
+        return q[2]
+
+
+class WaitStats:
+    """Running wait-time statistics (seconds) for one department and priority"""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.count = state.get('count', 0)
+        self.ewma = state.get('ewma')
+        self.quantiles = {p: P2Quantile(p, state.get('quantiles', {}).get(p)) for p in QUANTILES}
+
+    def add(self, seconds):
+        self.count += 1
+        self.ewma = seconds if self.ewma is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma
+        for quantile in self.quantiles.values():
+            quantile.add(seconds)
+
+    def state(self):
+        return {'count': self.count, 'ewma': self.ewma, 'quantiles': {p: q.state() for p, q in self.quantiles.items()}}
+
+    def summary(self):
+        def minutes(seconds):
+            return None if seconds is None else round(seconds / 60, 1)
+        return {
+            'samples': self.count,
+            'average_minutes': minutes(self.ewma),
+            'median_minutes': minutes(self.quantiles[0.5].value()),
+            'p90_minutes': minutes(self.quantiles[0.9].value()),
+        }
+
+
+# Serialises read-modify-write of the statistics within this process only; see STATS_TTL
+_lock = threading.Lock()
+
+
+def _seconds(checked_in_at, called_at):
+    return (called_at - checked_in_at).total_seconds()
+
+
+def _warm(department_id):
+    # Seed every priority of a department, and its call interval, from its most recent calls in one query
+    stats = {rank: WaitStats() for rank in RANKS}
+    interval, last_called = WaitStats(), None
+    recent = TriageQueue.objects.filter(department_id=department_id, called_at__isnull=False).order_by(
+        '-called_at',
+    ).values_list('rank', 'checked_in_at', 'called_at')[:WARMUP_SIZE]
+    for rank, checked_in_at, called_at in reversed(list(recent)):
+        if rank in stats and called_at >= checked_in_at:
+            stats[rank].add(_seconds(checked_in_at, called_at))
+        if last_called is not None and _seconds(last_called, called_at) <= MAX_CALL_GAP:
+            interval.add(_seconds(last_called, called_at))
+        last_called = called_at
+    expires = time.time() + STATS_TTL
+    states = {STATS_KEY.format(f'{department_id}:{rank}'): s.state() for rank, s in stats.items()}
+    states[STATS_KEY.format(f'{department_id}:{INTERVAL}')] = {**interval.state(), 'last_called': last_called}
+    cache.set_many({key: {**state, 'expires': expires} for key, state in states.items()}, STATS_TTL)
+    return stats, interval
+
+
+def department_stats(department_id):
+    """``{rank: WaitStats}`` for a department, from the cache in one round trip"""
+    keys = {rank: STATS_KEY.format(f'{department_id}:{rank}') for rank in RANKS}
+    found = cache.get_many(keys.values())
+    if len(found) < len(keys):
+        with _lock:
+            return _warm(department_id)[0]
+    return {rank: WaitStats(found[key]) for rank, key in keys.items()}
+
+
+def call_interval(department_id):
+    """``WaitStats`` of the seconds between consecutive calls in a department"""
+    state = cache.get(STATS_KEY.format(f'{department_id}:{INTERVAL}'))
+    if state is None:
+        with _lock:
+            return _warm(department_id)[1]
+    return WaitStats(state)
+
+
+def record(entry):
+    """Fold one processed entry's wait into its priority's statistics and the department's call interval"""
+    if entry.called_at is None or entry.called_at < entry.checked_in_at:
+        return
+    key = STATS_KEY.format(f'{entry.department_id}:{entry.rank}')
+    interval_key = STATS_KEY.format(f'{entry.department_id}:{INTERVAL}')
+    with _lock:
+        found = cache.get_many([key, interval_key])
+        state, interval_state = found.get(key), found.get(interval_key)
+        remaining = min(state['expires'], interval_state['expires']) - time.time() if len(found) == 2 else 0
+        if remaining <= 0:
+            # Seeding replays recent calls, this one included
+            _warm(entry.department_id)
+            return
+        stats = WaitStats(state)
+        stats.add(_seconds(entry.checked_in_at, entry.called_at))
+        interval = WaitStats(interval_state)
+        last_called = interval_state['last_called']
+        if last_called is not None and 0 <= _seconds(last_called, entry.called_at) <= MAX_CALL_GAP:
+            interval.add(_seconds(last_called, entry.called_at))
+        if last_called is None or entry.called_at > last_called:
+            last_called = entry.called_at
+        # Keep the expiry the warm-up set, so steady traffic cannot postpone the rebuild
+        cache.set_many({
+            key: {**stats.state(), 'expires': state['expires']},
+            interval_key: {**interval.state(), 'last_called': last_called, 'expires': interval_state['expires']},
+        }, remaining)
+
+
+def estimate(stats, waited_seconds=0, position=1, interval=None):
+    """Expected minutes still to wait for the entry at ``position`` in the call order.
+
+    The larger of two views: the priority's typical total wait less the time
+    already waited, and one call ``interval`` for each place up to this one.
+    The first covers priorities that usually wait behind later, more urgent
+    arrivals; the second a long queue the history has not caught up with.
+    """
+    candidates = []
+    if stats.ewma is not None:
+        candidates.append(stats.ewma - waited_seconds)
+    if interval is not None and interval.ewma is not None:
+        candidates.append(position * interval.ewma)
+    if not candidates:
+        return None
+    return round(max(0, *candidates) / 60, 1)
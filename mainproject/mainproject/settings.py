@@ -48,8 +48,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mainapp.querybudget.QueryBudgetMiddleware',
 ]
 
+# Per-view query budgets (see mainapp.querybudget); log overruns and N+1 patterns in development
+QUERY_BUDGET_ENABLED = DEBUG
+QUERY_BUDGET_RAISE = False
+
 ROOT_URLCONF = 'mainproject.urls'
 
 TEMPLATES = [
@@ -78,6 +83,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Concurrent bookings queue for the write lock instead of failing immediately
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            # File-backed so threaded tests exercise real SQLite locking
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# LocMemCache is private to each process. Everything cached that another
+# worker's writes can invalidate (unread counts, slot maps, the staff board
+# stamp, triage wait statistics) carries a short TTL, so a worker that missed
+# a change is only briefly stale. Deployments running several workers should
+# point this at a shared backend such as Redis or Memcached, where every
+# invalidation reaches all of them at once.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hms',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
@@ -123,6 +155,14 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Columnar snapshots for long-range reports, rebuilt nightly by build_analytics_snapshot
+ANALYTICS_SNAPSHOT_DIR = BASE_DIR / 'analytics'
+
+# Bulk notifications are written by a background thread after the request commits
+NOTIFICATION_FANOUT_ASYNC = True
+# Read notifications older than this are moved to the archive by archive_notifications
+NOTIFICATION_RETENTION_DAYS = 90
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 